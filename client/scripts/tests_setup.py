@@ -29,6 +29,8 @@ if __name__ == '__main__':
     env = os.getenv('ENIGMA_ENV', 'COMPOSE')
     config = Config(required=required)
     provider = Provider(config=config)
+    provider.prefetch(['enigma_abi', 'enigma_contract_address', 'token_contract_address'] +
+                      (['voting_contract_address', 'sample_contract_address'] if env == 'COMPOSE' else []))
 
     # *** Load parameters from config
 
@@ -45,7 +47,6 @@ if __name__ == '__main__':
     contract_abi_path = contracts_folder_path + enigma_abi_filename
     save_to_path(contract_abi_path, enigma_contract_abi)
 
-    token_contract_abi = json.loads(provider.enigma_token_abi)
     token_contract_address = provider.token_contract_address
 
     eng_contract_addr = provider.enigma_contract_address
@@ -0,0 +1,58 @@
+""" Ethereum addresses, validated and checksummed once
+
+Checksumming an address runs keccak over it, and the same handful of addresses -- our contracts, the worker's
+operating and staking accounts, the faucet's coinbase accounts -- is checksummed over and over. Address(value) does it
+once per distinct value: the result is interned in an LRU, so the same input gives back the very same object.
+
+An Address is a str holding the checksummed form, so it goes wherever an address string goes today, web3 included.
+"""
+import functools
+from typing import Union
+
+from eth_utils import is_address, to_checksum_address
+
+__all__ = ['Address']
+
+# distinct addresses to keep -- far more than any of our processes deals with
+CACHE_SIZE = 4096
+
+
+class Address(str):
+    """ A checksummed ethereum address. Accepts an address in any case, with or without 0x, or its 20 bytes. Raises
+    ValueError if it isn't one """
+    __slots__ = ()
+
+    def __new__(cls, value: Union[str, bytes, bytearray, memoryview, 'Address']) -> 'Address':
+        if isinstance(value, Address):
+            return value
+        if isinstance(value, (bytearray, memoryview)):
+            # slices of a bytearray or an mmap: hashable bytes for the cache
+            value = bytes(value)
+        try:
+            return _intern(value)
+        except TypeError:
+            raise ValueError(f'Invalid ethereum address: {value!r}') from None
+
+    @property
+    def canonical(self) -> str:
+        """ lower case, the way the node returns addresses """
+        return self.lower()
+
+    def to_bytes(self) -> bytes:
+        return bytes.fromhex(self[2:])
+
+    def __repr__(self) -> str:
+        return f'Address({str.__repr__(self)})'
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _intern(value: Union[str, bytes]) -> Address:
+    if isinstance(value, bytes):
+        if len(value) != 20:
+            raise ValueError(f'Invalid ethereum address: {value!r}')
+        value = '0x' + value.hex()
+    elif isinstance(value, str) and len(value) == 40:
+        value = '0x' + value
+    if not isinstance(value, str) or not is_address(value):
+        raise ValueError(f'Invalid ethereum address: {value!r}')
+    return str.__new__(Address, to_checksum_address(value))
@@ -0,0 +1,60 @@
+""" Slim contract artifacts
+
+A Truffle build JSON carries the bytecode, AST, source and source maps of a contract, but everything that talks to a
+deployed contract only needs its ABI, the selectors of its functions and the addresses it is deployed at. A
+ContractArtifact is just that, usually a few percent of the size of the build file.
+"""
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from eth_utils import encode_hex, function_signature_to_4byte_selector
+
+
+def _canonical_type(param: dict) -> str:
+    """ ABI type of a function parameter as it appears in the signature -- tuples are spelled out """
+    if param['type'].startswith('tuple'):
+        components = ','.join(_canonical_type(c) for c in param.get('components', []))
+        return f'({components}){param["type"][len("tuple"):]}'
+    return param['type']
+
+
+def selectors(abi: List[dict]) -> Dict[str, str]:
+    """ signature -> 4 byte selector (hex) of every function in the ABI """
+    result: Dict[str, str] = {}
+    for entry in abi:
+        if entry.get('type', 'function') != 'function':
+            continue
+        signature = f'{entry["name"]}({",".join(_canonical_type(p) for p in entry.get("inputs", []))})'
+        result[signature] = encode_hex(function_signature_to_4byte_selector(signature))
+    return result
+
+
+@dataclass(frozen=True)
+class ContractArtifact:
+    contract_name: str
+    abi: List[dict]
+    selectors: Dict[str, str] = field(default_factory=dict)
+    # network id -> {'address': ..., 'transactionHash': ...}, as in the build file
+    networks: Dict[str, dict] = field(default_factory=dict)
+
+    @classmethod
+    def from_build(cls, build: Any) -> 'ContractArtifact':
+        """ From a Truffle build JSON, as text, bytes or already decoded """
+        if isinstance(build, (str, bytes, bytearray)):
+            build = json.loads(build)
+        networks = {network: {k: v for k, v in deployment.items() if k in ('address', 'transactionHash')}
+                    for network, deployment in build.get('networks', {}).items()}
+        return cls(build.get('contractName', ''), build['abi'], selectors(build['abi']), networks)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'ContractArtifact':
+        return cls(data.get('contractName', ''), data['abi'], data.get('selectors', {}), data.get('networks', {}))
+
+    def to_dict(self) -> dict:
+        # same key names as the build file, so the slim artifact can stand in for it
+        return {'contractName': self.contract_name, 'abi': self.abi, 'selectors': self.selectors,
+                'networks': self.networks}
+
+    def address(self, network_id: str) -> Optional[str]:
+        return self.networks.get(str(network_id), {}).get('address')
@@ -0,0 +1,212 @@
+""" asyncio versions of EthereumGateway and Contract, so many chain operations can run concurrently on one event loop
+
+Requests go over a pooled aiohttp session (one per gateway, created lazily in the loop that uses it). What needs no
+I/O is shared with the synchronous classes: ABI encoding, signing, the process-wide nonce manager and gas oracle, and
+the block watcher, which wakes coroutines waiting for receipts and confirmations when a new block arrives.
+"""
+import asyncio
+import itertools
+import time
+from typing import Any, Dict, List, Optional, Union
+
+import aiohttp
+import web3
+from web3.datastructures import AttributeDict
+
+from .address import Address
+from .batch import call_params, decoder
+from .blocks import block_watcher
+from .enigma import Contract, gas_oracle, nonce_manager
+from .logger import get_logger
+
+logger = get_logger('enigma_common.async_ethereum')
+
+__all__ = ['AsyncEthereumGateway', 'AsyncContract']
+
+# receipt fields that are quantities -- web3 returns them as ints
+_RECEIPT_QUANTITIES = ('blockNumber', 'cumulativeGasUsed', 'gasUsed', 'status', 'transactionIndex')
+
+
+def _hex(value: Union[bytes, str]) -> str:
+    return value if isinstance(value, str) else web3.Web3.toHex(value)
+
+
+class AsyncEthereumGateway:
+    # connections kept open to the node
+    max_connections = 16
+
+    def __init__(self, eth_node: str, timeout: float = 30):
+        """
+        :param eth_node: address of ethereum node (example: http://localhost:8545)
+        """
+        self.eth_node = eth_node
+        self.timeout = timeout
+        # for what is shared with the synchronous classes. Whatever they send with it runs off the event loop
+        self.w3 = web3.Web3(web3.HTTPProvider(eth_node))
+        self.nonces = nonce_manager(eth_node, self.w3)
+        self.watcher = block_watcher(eth_node)
+        self._ids = itertools.count(1)
+        self._chain_id: Optional[int] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # created lazily, since a session belongs to the event loop it was created in
+        if self._session is None:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_connections),
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def request(self, method: str, params: list) -> Any:
+        """ A JSON-RPC request. Raises ValueError with the node's error, like web3 does """
+        payload = {'jsonrpc': '2.0', 'id': next(self._ids), 'method': method, 'params': params}
+        async with self._get_session().post(self.eth_node, json=payload) as resp:
+            resp.raise_for_status()
+            reply = await resp.json(content_type=None)
+        if 'error' in reply:
+            raise ValueError(reply['error'])
+        return reply['result']
+
+    async def balance(self, account: str) -> str:
+        try:
+            account = Address(account)
+        except ValueError:
+            raise ValueError(f'Trying to get balance for malformed ethereum account {account}') from None
+        return str(self.w3.fromWei(int(await self.request('eth_getBalance', [account, 'latest']), 16), 'ether'))
+
+    async def block_number(self) -> int:
+        return int(await self.request('eth_blockNumber', []), 16)
+
+    async def transaction_count(self, account: str, block: str = 'pending') -> int:
+        return int(await self.request('eth_getTransactionCount', [Address(account), block]), 16)
+
+    async def chain_id(self) -> int:
+        if self._chain_id is None:
+            self._chain_id = int(await self.request('eth_chainId', []), 16)
+        return self._chain_id
+
+    async def gas_price(self) -> int:
+        """ From the process-wide gas oracle, as Contract.gasprice """
+        oracle = gas_oracle(self.eth_node, self.w3)
+        return await asyncio.get_event_loop().run_in_executor(None, oracle.price)
+
+    async def reserve_nonce(self, account: str) -> int:
+        """ The sender's next nonce, counted with every other (sync or async) contract on this node """
+        if not self.nonces.known(account):
+            self.nonces.seed(account, await self.transaction_count(account))
+        return self.nonces.reserve(account)
+
+    async def send_raw_transaction(self, raw_transaction: bytes) -> str:
+        return await self.request('eth_sendRawTransaction', [_hex(raw_transaction)])
+
+    async def get_transaction_receipt(self, tx_hash: Union[bytes, str]) -> Optional[AttributeDict]:
+        """ The receipt, or None if the transaction isn't mined yet """
+        receipt = await self.request('eth_getTransactionReceipt', [_hex(tx_hash)])
+        if receipt is None:
+            return None
+        return AttributeDict({key: int(value, 16) if key in _RECEIPT_QUANTITIES and value is not None else value
+                              for key, value in receipt.items()})
+
+    async def wait_for_block(self, after: int, timeout: Optional[float] = None) -> Optional[int]:
+        """ The number of the first block after {after}, or None if there isn't one within {timeout} seconds """
+        seen: List[int] = []
+
+        def condition(number: int) -> bool:
+            if number > after:
+                seen.append(number)
+            return bool(seen)
+        return seen[0] if await self.watcher.wait_async(condition, timeout) else None
+
+    async def wait_for_receipt(self, tx_hash: Union[bytes, str], timeout: float = 120) -> AttributeDict:
+        """ Waits for the transaction to be mined -- looking for its receipt once per new block. Raises TimeoutError """
+        deadline = time.monotonic() + timeout
+        while True:
+            block = self.watcher.block_number
+            if block is None:
+                block = await self.block_number()
+            receipt = await self.get_transaction_receipt(tx_hash)
+            if receipt is not None:
+                return receipt
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or await self.wait_for_block(block, remaining) is None:
+                raise TimeoutError(f'Transaction {_hex(tx_hash)} is not in the chain after {timeout}s')
+
+    async def wait_for_confirmations(self, receipt, confirmations: int, timeout: Optional[float] = None) -> bool:
+        return await self.watcher.wait_async(lambda number: number - receipt.blockNumber >= int(confirmations),
+                                             timeout)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+class AsyncContract:
+    gas_default = Contract.gas_default
+
+    def __init__(self, eth_node: str, contract_address: str, contract_abi, gateway: AsyncEthereumGateway = None):
+        """
+        :param eth_node: address of ethereum node (example: http://localhost:8545)
+        :param contract_address: contract address
+        :param contract_abi: contract ABI
+        :param gateway: to share one connection pool between contracts on the same node
+        """
+        self.eth_node = eth_node
+        self.contract_address = contract_address
+        self.contract_abi = contract_abi
+        self.gateway = gateway or AsyncEthereumGateway(eth_node)
+        self.contract = self.gateway.w3.eth.contract(contract_address, abi=contract_abi)  # type: ignore
+
+    async def call(self, func: str, *args, block: str = 'latest') -> Any:
+        """ Calls a constant function and returns its decoded result """
+        function = getattr(self.contract.functions, func)(*args)
+        return decoder(self.gateway.w3, function)(await self.gateway.request('eth_call', call_params(function, block)))
+
+    async def build(self, sending_address: str, func: str, *args, nonce: Optional[int] = None) -> Dict[str, Any]:
+        """ Builds a transaction calling {func}. Unless a nonce is given, the sender's pending transaction count is
+        used -- for transactions that are signed somewhere else """
+        csum_addr = Address(sending_address)
+        function = getattr(self.contract.functions, func)(*args)
+        if nonce is None:
+            nonce = await self.gateway.transaction_count(csum_addr)
+        gas_price, chain_id = await asyncio.gather(self.gateway.gas_price(), self.gateway.chain_id())
+        return {'from': csum_addr,
+                'to': function.address,
+                'data': function._encode_transaction_data(),
+                'value': 0,
+                'gas': self.gas_default,
+                'gasPrice': gas_price,
+                'nonce': nonce,
+                'chainId': chain_id}
+
+    async def send(self, sending_address: str, key: Union[bytes, str], func: str, *args) -> str:
+        """ Builds, signs and sends a transaction without waiting for it to be mined. Returns its hash """
+        csum_addr = Address(sending_address)
+        nonce = await self.gateway.reserve_nonce(csum_addr)
+        try:
+            signed_tx = Contract._sign(await self.build(csum_addr, func, *args, nonce=nonce), key)
+        except Exception:
+            self.gateway.nonces.release(csum_addr, nonce)
+            raise
+        try:
+            tx_hash = await self.gateway.send_raw_transaction(signed_tx.rawTransaction)
+        except Exception:
+            # too low, or it timed out after the node took it: ask the node for the count next time
+            self.gateway.nonces.reset(csum_addr)
+            raise
+        logger.debug(f'Sent {func} from {csum_addr} with nonce {nonce}: {tx_hash}')
+        return tx_hash
+
+    async def transact(self, sending_address: str, key: Union[bytes, str], func: str, *args) -> AttributeDict:
+        return await self.wait_for_receipt(await self.send(sending_address, key, func, *args))
+
+    async def wait_for_receipt(self, tx_hash: Union[bytes, str], timeout: float = 120) -> AttributeDict:
+        return await self.gateway.wait_for_receipt(tx_hash, timeout)
+
+    async def close(self):
+        await self.gateway.close()
@@ -0,0 +1,251 @@
+""" asyncio versions of the storage backends, so many artifacts can be fetched concurrently
+
+Every async container has `get(key)` and `get_many(keys)`. SyncContainer wraps any of them back into the regular
+IndexableContainer interface by running it on a background event loop, so synchronous callers keep working and still
+get concurrent `get_many`. ConcurrentContainer pairs a synchronous backend with its async counterpart: single items
+(conditional fetches, watches) go to the first, get_many to the second -- this is what Provider uses
+"""
+import asyncio
+import functools
+import os
+import random
+import threading
+from typing import Any, AnyStr, Coroutine, Dict, Generic, Iterable, Optional, Tuple, TypeVar
+from urllib.parse import urlparse
+
+import aiohttp
+from azure.core.exceptions import ResourceNotFoundError
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.storage.blob.aio import BlobServiceClient, ContainerClient
+
+from . import readiness
+from .logger import get_logger
+from .storage import DiscoveryBundle, IndexableContainer, LocalStorage
+
+logger = get_logger('enigma_common.async_storage')
+
+T = TypeVar('T')
+
+
+class AsyncIndexableContainer(Generic[T]):
+    # default limit of requests in flight for get_many
+    max_concurrency = 8
+
+    async def get(self, key: str) -> T:
+        raise NotImplementedError
+
+    async def get_many(self, keys: Iterable[str], max_concurrency: int = None, *,
+                       return_exceptions: bool = False) -> Dict[str, Any]:
+        """ Fetches all the keys concurrently, at most max_concurrency at a time. Raises the first error, unless
+        return_exceptions: then a failed key's value is its error """
+        keys = list(keys)
+        semaphore = asyncio.Semaphore(max_concurrency or self.max_concurrency)
+
+        async def get_one(key: str) -> T:
+            async with semaphore:
+                return await self.get(key)
+
+        values = await asyncio.gather(*(get_one(key) for key in keys), return_exceptions=return_exceptions)
+        return dict(zip(keys, values))
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+class AsyncHttpFileService(AsyncIndexableContainer[Any]):
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, url, namespace: str = 'contract', directory='address', timeout: int = 60,
+                 connect_timeout: float = 5, read_timeout: float = 30, retries: int = 3, backoff: float = 0.5,
+                 bundle: DiscoveryBundle = None):
+        """ Takes the same settings as storage.HttpFileService, and retries the same way """
+        p = urlparse(url)
+        self.hostname = p.hostname
+        self.port = p.port
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.directory = directory
+        self.account_url = f'{url}/{namespace}/{directory}?name='
+        self.bundle = bundle
+        self.credential = os.getenv('STORAGE_CONNECTION_STRING')
+        self._connected = False
+        self._connecting: Optional[asyncio.Lock] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # created lazily, since a session belongs to the event loop it was created in
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout))
+        return self._session
+
+    async def wait_till_open(self):
+        if self._connected:
+            return
+        if self._connecting is None:
+            self._connecting = asyncio.Lock()
+        async with self._connecting:  # concurrent gets share a single wait
+            if self._connected:
+                return
+            wait = functools.partial(readiness.wait_for, readiness.Target(self.hostname, self.port), timeout=self.timeout)
+            try:
+                await asyncio.get_event_loop().run_in_executor(None, wait)
+            except TimeoutError:
+                raise TimeoutError(f'Timeout for server @ {self.account_url}') from None
+            self._connected = True
+
+    async def get(self, key: str) -> Any:
+        await self.wait_till_open()
+        if self.bundle is not None:
+            # the first lookup downloads the bundle, so not on the loop
+            bundled = await asyncio.get_event_loop().run_in_executor(None, self.bundle.lookup, self.directory, key)
+            if bundled is not None:
+                return bundled
+        url = f'{self.account_url}{key}'
+        attempt = 0
+        while True:
+            try:
+                async with self._get_session().get(url) as resp:
+                    logger.debug(f'GET {url} -> {resp.status}')
+                    if resp.status == 404:
+                        raise IndexError(f'Value {key} not found @ {self.account_url}')
+                    if resp.status < 500 or attempt >= self.retries:
+                        resp.raise_for_status()
+                        return await resp.json(content_type=None)
+                    reason = f'status {resp.status}'
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= self.retries:
+                    raise
+                reason = str(e) or type(e).__name__
+            delay = random.uniform(0, self.backoff * 2 ** attempt)
+            logger.info(f'Request to {url} failed ({reason}), retrying in {delay:.2f}s')
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class AsyncAzureContainerFileService(AsyncIndexableContainer[bytes]):
+    def __init__(self, directory: str):
+        self.account_name = 'objectstorage2'
+        self.account_url = f'https://{self.account_name}.blob.core.windows.net/'
+        self.container_name = directory
+        self.credential = os.getenv('STORAGE_CONNECTION_STRING')
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._container: Optional[ContainerClient] = None
+
+    def _get_container(self) -> ContainerClient:
+        # all the blob clients share the container's pipeline, and with it one aiohttp session
+        if self._container is None:
+            self._session = aiohttp.ClientSession()
+            service = BlobServiceClient(account_url=self.account_url, credential=self.credential,
+                                        transport=AioHttpTransport(session=self._session, session_owner=False))
+            self._container = service.get_container_client(self.container_name)
+        return self._container
+
+    async def get(self, key: str) -> bytes:
+        try:
+            downloader = await self._get_container().get_blob_client(key).download_blob()
+            return await downloader.content_as_bytes()
+        except ResourceNotFoundError:
+            raise IndexError(f'Value {key} not found in container {self.container_name}') from None
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+            self._container = None
+
+
+class AsyncLocalStorage(AsyncIndexableContainer[AnyStr]):
+    def __init__(self, directory: str, flags: str = 'b+'):
+        self.storage = LocalStorage(directory, flags)
+
+    async def get(self, key: str) -> AnyStr:
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.storage.__getitem__, key)
+
+
+class _BackgroundLoop:
+    """ One event loop per process, running in a daemon thread, for synchronous code that needs to run coroutines """
+    loop: Optional[asyncio.AbstractEventLoop] = None
+    lock = threading.Lock()
+
+    @classmethod
+    def get(cls) -> asyncio.AbstractEventLoop:
+        with cls.lock:
+            if cls.loop is None:
+                cls.loop = asyncio.new_event_loop()
+                threading.Thread(target=cls.loop.run_forever, name='enigma-storage-loop', daemon=True).start()
+            return cls.loop
+
+
+def run_sync(coro: Coroutine) -> Any:
+    """ Runs a coroutine on the background loop and waits for its result. Safe to call from inside another event
+    loop, like the CLI's """
+    return asyncio.run_coroutine_threadsafe(coro, _BackgroundLoop.get()).result()
+
+
+class SyncContainer(IndexableContainer[T]):
+    """ Synchronous IndexableContainer on top of an AsyncIndexableContainer """
+    def __init__(self, container: AsyncIndexableContainer[T]):
+        self.container = container
+
+    def __getattr__(self, name):
+        if name == 'container':
+            raise AttributeError(name)
+        return getattr(self.container, name)
+
+    def __getitem__(self, key: str) -> T:
+        return run_sync(self.container.get(key))
+
+    def __setitem__(self, key: str, value: Any):
+        raise NotImplementedError
+
+    def get_many(self, keys: Iterable[str], max_concurrency: int = None, *,
+                 return_exceptions: bool = False) -> Dict[str, Any]:
+        return run_sync(self.container.get_many(keys, max_concurrency, return_exceptions=return_exceptions))
+
+    def close(self):
+        run_sync(self.container.close())
+
+
+class ConcurrentContainer(IndexableContainer[T]):
+    """ A synchronous backend whose get_many runs on an async one for the same items, e.g. HttpFileService and
+    AsyncHttpFileService with the same settings. Everything else goes to the synchronous backend """
+    def __init__(self, container: IndexableContainer[T], concurrent: AsyncIndexableContainer[T]):
+        self.container = container
+        self.concurrent = SyncContainer(concurrent)
+
+    def __getattr__(self, name):
+        if name in ('container', 'concurrent'):
+            raise AttributeError(name)
+        return getattr(self.container, name)
+
+    def __getitem__(self, key: str) -> T:
+        return self.container[key]
+
+    def __setitem__(self, key: str, value: Any):
+        self.container[key] = value
+
+    def fetch(self, key: str, validators: dict = None) -> Optional[Tuple[T, dict]]:
+        return self.container.fetch(key, validators)
+
+    def watch(self, key: str, validators: dict = None, timeout: Optional[float] = None,
+              interval: float = None) -> Tuple[T, dict]:
+        kwargs = {} if interval is None else {'interval': interval}
+        return self.container.watch(key, validators, timeout=timeout, **kwargs)
+
+    def get_many(self, keys: Iterable[str], *, return_exceptions: bool = False) -> Dict[str, Any]:
+        return self.concurrent.get_many(keys, return_exceptions=return_exceptions)
@@ -0,0 +1,132 @@
+""" Many read calls to an ethereum node in one round trip
+
+web3 sends every call as its own HTTP request. A Batch gathers eth_getBalance, eth_getTransactionCount and eth_call
+requests and sends them as JSON-RPC batches -- one HTTP request for up to MAX_BATCH_SIZE of them -- and gives back a
+result for each, in the order they were added. A call that fails doesn't fail the others: its result holds the error.
+
+    batch = Batch(w3)
+    for account in accounts:
+        batch.balance(account)
+    batch.call(token.functions.balanceOf(account))
+    results = batch.execute()
+"""
+import itertools
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, List, Optional, Tuple, cast
+
+import requests
+import web3
+
+from .address import Address
+from .logger import get_logger
+
+logger = get_logger('enigma_common.batch')
+
+__all__ = ['Batch', 'CallResult', 'BatchError', 'MAX_BATCH_SIZE', 'call_params', 'decoder']
+
+# requests per HTTP request -- nodes limit the size of a batch (and of a request body)
+MAX_BATCH_SIZE = 500
+
+_session = requests.Session()
+_ids = itertools.count(1)
+_ids_lock = threading.Lock()
+
+
+class BatchError(ValueError):
+    """ A call in the batch failed on the node. Carries the JSON-RPC error object, like web3's ValueErrors do """
+
+
+@dataclass(frozen=True)
+class CallResult:
+    value: Any = None
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _to_int(result: str) -> int:
+    return int(result, 16)
+
+
+def call_params(function, block: str) -> list:
+    """ eth_call parameters for a contract function with its arguments, e.g. contract.functions.balanceOf(account) """
+    return [{'to': function.address, 'data': function._encode_transaction_data()}, block]
+
+
+def decoder(w3: web3.Web3, function) -> Callable[[str], Any]:
+    """ Decodes the eth_call result of the function the way web3's call() does """
+    output_types = [output['type'] for output in function.abi['outputs']]
+
+    def decode(result: str) -> Any:
+        decoded = w3.codec.decode_abi(output_types, bytes.fromhex(result[2:]))
+        values = [Address(value) if kind == 'address' else value for kind, value in zip(output_types, decoded)]
+        return values[0] if len(values) == 1 else values
+    return decode
+
+
+class Batch:
+    def __init__(self, w3: web3.Web3):
+        self.w3 = w3
+        # (method, params, decoder of the result)
+        self._requests: List[Tuple[str, list, Callable[[Any], Any]]] = []
+
+    def __len__(self) -> int:
+        return len(self._requests)
+
+    def balance(self, account: str, block: str = 'latest') -> int:
+        """ Adds the balance (wei) of an account. Returns the index of its result """
+        return self._add('eth_getBalance', [Address(account), block], _to_int)
+
+    def transaction_count(self, account: str, block: str = 'pending') -> int:
+        return self._add('eth_getTransactionCount', [Address(account), block], _to_int)
+
+    def call(self, function, block: str = 'latest') -> int:
+        """ Adds a contract call, e.g. contract.functions.balanceOf(account). Its result is decoded the way web3's
+        call() decodes it """
+        return self._add('eth_call', call_params(function, block), decoder(self.w3, function))
+
+    def _add(self, method: str, params: list, decode: Callable[[Any], Any]) -> int:
+        self._requests.append((method, params, decode))
+        return len(self._requests) - 1
+
+    def execute(self) -> List[CallResult]:
+        """ Sends everything added so far and returns the results, in the order the calls were added. Raises if the
+        node can't be reached """
+        results: List[CallResult] = []
+        for start in range(0, len(self._requests), MAX_BATCH_SIZE):
+            results.extend(self._send(self._requests[start:start + MAX_BATCH_SIZE]))
+        logger.debug(f'Sent {len(self._requests)} calls in {-(-len(self._requests) // MAX_BATCH_SIZE)} batches')
+        self._requests = []
+        return results
+
+    def _send(self, batch: List[Tuple[str, list, Callable[[Any], Any]]]) -> List[CallResult]:
+        with _ids_lock:
+            ids = [next(_ids) for _ in batch]
+        payload = [{'jsonrpc': '2.0', 'id': request_id, 'method': method, 'params': params}
+                   for request_id, (method, params, _) in zip(ids, batch)]
+        provider = cast(web3.HTTPProvider, self.w3.provider)  # batches are only sent over HTTP
+        response = _session.post(provider.endpoint_uri, json=payload, **provider.get_request_kwargs())
+        response.raise_for_status()
+        replies = response.json()
+        if not isinstance(replies, list):
+            # some nodes answer a batch they won't take with a single error
+            raise BatchError(replies.get('error', replies))
+
+        # replies may come in any order
+        by_id = {reply.get('id'): reply for reply in replies}
+        results = []
+        for request_id, (method, _, decode) in zip(ids, batch):
+            reply = by_id.get(request_id)
+            if reply is None:
+                results.append(CallResult(error=BatchError(f'No reply to {method}')))
+            elif 'error' in reply:
+                results.append(CallResult(error=BatchError(reply['error'])))
+            else:
+                try:
+                    results.append(CallResult(value=decode(reply['result'])))
+                except Exception as e:  # pylint: disable=broad-except
+                    results.append(CallResult(error=e))
+        return results
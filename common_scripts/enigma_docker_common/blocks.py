@@ -0,0 +1,254 @@
+""" New ethereum blocks, watched once per process
+
+Waiting for confirmations, or for an account to be funded, used to mean asking the node every few seconds, separately
+for each thing waited on. A BlockWatcher follows the chain head instead -- through a websocket newHeads subscription,
+or, if the node has no websocket endpoint, by polling a block filter over HTTP -- and checks every registered condition
+once per new block. Waiters wake up on the block that satisfies them.
+
+Conditions are functions of the new block's number, e.g. lambda number: number - receipt.blockNumber >= 12
+"""
+import asyncio
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+import web3
+
+from .logger import get_logger
+
+try:
+    import websockets
+except ImportError:
+    websockets = None  # type: ignore
+
+logger = get_logger('enigma_common.blocks')
+
+__all__ = ['BlockWatcher', 'block_watcher', 'websocket_url']
+
+# seconds between polls of the block filter, when there is no websocket
+POLL_INTERVAL = 1.0
+# seconds to wait for a message on the websocket before checking whether we were stopped
+_RECV_TIMEOUT = 1.0
+
+
+def websocket_url(eth_node: str) -> str:
+    """ ganache (what we run locally) serves websockets on the same port as HTTP """
+    p = urlparse(eth_node)
+    return p._replace(scheme='wss' if p.scheme == 'https' else 'ws').geturl()
+
+
+class _Waiter:
+    def __init__(self, condition: Callable[[int], bool], on_set: Callable[[], Any] = None):
+        self.condition = condition
+        self.on_set = on_set
+        self.event = threading.Event()
+
+    def check(self, number: int) -> bool:
+        try:
+            if not self.event.is_set() and self.condition(number):
+                self.event.set()
+                if self.on_set is not None:
+                    self.on_set()
+        except Exception as e:  # pylint: disable=broad-except
+            logger.debug(f'Failed to check condition on block {number}: {e}')
+        return self.event.is_set()
+
+
+class BlockWatcher:
+    """ Follows the head of the chain on a background thread while anyone waits. The thread ends when the last waiter
+    is done, and the next wait starts it again """
+    def __init__(self, eth_node: str, ws_url: Optional[str] = '', poll_interval: float = POLL_INTERVAL):
+        """
+        :param eth_node: address of ethereum node (example: http://localhost:8545)
+        :param ws_url: its websocket endpoint. Derived from eth_node by default, None to only use HTTP
+        """
+        self.eth_node = eth_node
+        self.ws_url = websocket_url(eth_node) if ws_url == '' else ws_url
+        # whether ws_url was given, rather than derived
+        self.ws_url_explicit = ws_url != ''
+        self.poll_interval = poll_interval
+        self.w3 = web3.Web3(web3.HTTPProvider(eth_node))
+        self.block_number: Optional[int] = None
+
+        self._lock = threading.Lock()
+        self._waiters: List[_Waiter] = []
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def wait(self, condition: Callable[[int], bool], timeout: Optional[float] = None) -> bool:
+        """ Blocks until condition(block number) holds -- checked right away, and then on every new block. Returns
+        False if it didn't within {timeout} seconds """
+        waiter = _Waiter(condition)
+        with self._lock:
+            self._waiters.append(waiter)
+        try:
+            # the number we have is stale if nothing followed the chain until now
+            if self._start() or self.block_number is None:
+                self._on_block(self.w3.eth.blockNumber)
+            return waiter.check(self.block_number) or waiter.event.wait(timeout)  # type: ignore
+        finally:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+    async def wait_async(self, condition: Callable[[int], bool], timeout: Optional[float] = None) -> bool:
+        """ wait, for coroutines: the event loop isn't blocked meanwhile. The condition is still checked on the watcher's
+        thread, so it shouldn't do I/O -- compare block numbers """
+        loop = asyncio.get_event_loop()
+        done = asyncio.Event()
+        waiter = _Waiter(condition, lambda: loop.call_soon_threadsafe(done.set))
+        with self._lock:
+            self._waiters.append(waiter)
+        try:
+            if self._start() or self.block_number is None:
+                self._on_block(await loop.run_in_executor(None, lambda: self.w3.eth.blockNumber))
+            if waiter.check(self.block_number):  # type: ignore
+                return True
+            try:
+                await asyncio.wait_for(done.wait(), timeout)
+                return True
+            except asyncio.TimeoutError:
+                return False
+        finally:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+    def wait_for_block(self, after: int, timeout: Optional[float] = None) -> Optional[int]:
+        """ The number of the first block after {after}, or None if there isn't one within {timeout} seconds """
+        seen: List[int] = []
+
+        def condition(number: int) -> bool:
+            if number > after:
+                seen.append(number)
+            return bool(seen)
+        return seen[0] if self.wait(condition, timeout) else None
+
+    def wait_for_confirmations(self, receipt, confirmations: int, timeout: Optional[float] = None) -> bool:
+        return self.wait(lambda number: number - receipt.blockNumber >= int(confirmations), timeout)
+
+    def wait_for_balance(self, account: str, minimum: int, timeout: Optional[float] = None) -> bool:
+        """ Waits for {account} to hold at least {minimum} wei. The balance is asked for here, once per new block --
+        not on the watcher's thread, which would hold up every other waiter """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            block = self.block_number
+            if block is None:
+                block = self.w3.eth.blockNumber
+            if self.w3.eth.getBalance(account) >= minimum:
+                return True
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if (remaining is not None and remaining <= 0) or self.wait_for_block(block, remaining) is None:
+                return False
+
+    def use_websocket(self, ws_url: Optional[str]):
+        """ Sets the websocket endpoint (None to only use HTTP), unless it was already given or the watcher started """
+        with self._lock:
+            if self.ws_url_explicit or self._thread is not None:
+                if ws_url != self.ws_url:
+                    logger.debug(f'Already following blocks of {self.eth_node} on {self.ws_url or "HTTP"}')
+                return
+            self.ws_url = ws_url
+            self.ws_url_explicit = True
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def _start(self) -> bool:
+        """ Follows the chain, unless it is followed already. Returns whether it wasn't """
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._thread = threading.Thread(target=self._run, name='block-watcher', daemon=True)
+            self._thread.start()
+            return True
+
+    def _waiting(self) -> bool:
+        return bool(self._waiters) and not self._stop.is_set()
+
+    def _done(self) -> bool:
+        """ Whether the thread should end -- and if so, the next wait starts another """
+        with self._lock:
+            if self._waiting():
+                return False
+            self._thread = None
+            return True
+
+    def _on_block(self, number: int):
+        with self._lock:
+            if self.block_number is not None and number <= self.block_number:
+                return
+            self.block_number = number
+            waiters = list(self._waiters)
+        for waiter in waiters:
+            waiter.check(number)
+
+    def _run(self):
+        while not self._done():
+            if self.ws_url and websockets is not None:
+                try:
+                    asyncio.run(self._subscribe())
+                    continue
+                except Exception as e:  # pylint: disable=broad-except
+                    logger.warning(f'Can\'t follow new blocks on {self.ws_url} ({e}), polling {self.eth_node} instead')
+                    self.ws_url = None
+            try:
+                self._poll()
+            except Exception as e:  # pylint: disable=broad-except
+                logger.warning(f'Failed to poll {self.eth_node} for new blocks: {e}')
+                self._stop.wait(self.poll_interval)
+
+    async def _subscribe(self):
+        async with websockets.connect(self.ws_url) as ws:
+            await ws.send(json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': 'eth_subscribe', 'params': ['newHeads']}))
+            reply = json.loads(await asyncio.wait_for(ws.recv(), timeout=10))
+            if 'error' in reply:
+                raise ConnectionError(reply['error'].get('message', reply['error']))
+            logger.debug(f'Following new blocks on {self.ws_url}')
+            # whatever was mined before we subscribed
+            self._on_block(self.w3.eth.blockNumber)
+            while self._waiting():
+                try:
+                    message = json.loads(await asyncio.wait_for(ws.recv(), timeout=_RECV_TIMEOUT))
+                except asyncio.TimeoutError:
+                    continue
+                if message.get('method') == 'eth_subscription':
+                    self._on_block(int(message['params']['result']['number'], 16))
+
+    def _poll(self):
+        try:
+            block_filter = self.w3.eth.filter('latest')
+        except ValueError:
+            block_filter = None  # the node doesn't do filters -- compare block numbers
+        # whatever was mined before the filter was created
+        self._on_block(self.w3.eth.blockNumber)
+        while self._waiting():
+            if block_filter is None or block_filter.get_new_entries():
+                self._on_block(self.w3.eth.blockNumber)
+            self._stop.wait(self.poll_interval)
+        if block_filter is not None:
+            try:
+                self.w3.eth.uninstallFilter(block_filter.filter_id)
+            except ValueError as e:
+                logger.debug(f'Failed to remove the block filter, the node will expire it: {e}')
+
+
+_watchers: Dict[str, BlockWatcher] = {}
+_watchers_lock = threading.Lock()
+
+
+def block_watcher(eth_node: str, ws_url: Optional[str] = '') -> BlockWatcher:
+    """ The process-wide watcher for this node. The first caller that gives a websocket endpoint (or None) sets it """
+    with _watchers_lock:
+        if eth_node not in _watchers:
+            _watchers[eth_node] = BlockWatcher(eth_node, ws_url)
+            return _watchers[eth_node]
+        watcher = _watchers[eth_node]
+    if ws_url != '':
+        watcher.use_websocket(ws_url)
+    return watcher
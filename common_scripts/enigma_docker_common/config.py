@@ -1,8 +1,20 @@
+import hashlib
 import json
 import os
+import threading
 from collections import UserDict
+from collections.abc import Mapping
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
 from .logger import get_logger
 
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
 logger = get_logger('pycommon.config')
 
 DEFAULT_CONF_PATH = "/conf/"
@@ -21,7 +33,69 @@ env_defaults = {'K8S': './config/k8s_config.json',
                 'COMPOSE': './config/compose_config.json'}
 
 
-__all__ = ['Config']
+__all__ = ['Config', 'ConfigError', 'ConfigSnapshot', 'Field', 'ReloadableConfig', 'load_config']
+
+# how often a watched config file is checked for changes when inotify isn't available, in seconds
+RELOAD_INTERVAL = 2.0
+
+_TRUE = ('true', '1', 'yes', 'on')
+_FALSE = ('false', '0', 'no', 'off', '')
+
+
+class ConfigError(ValueError):
+    """ Raised with every problem found in the configuration, not just the first """
+    def __init__(self, errors: List[str]):
+        super().__init__('Invalid configuration:\n  ' + '\n  '.join(errors))
+        self.errors = errors
+
+
+@dataclass(frozen=True)
+class Field:
+    """ A configuration parameter: the type its value is converted to, and its default if it isn't set anywhere """
+    type: type = str
+    default: Any = None
+    required: bool = False
+
+    def convert(self, value: Any) -> Any:
+        """ `value` as `type`. Environment variables are always strings, so those are parsed. Raises ValueError """
+        if value is None or (self.type is not str and isinstance(value, self.type) and not isinstance(value, bool)):
+            return value
+        if self.type is bool:
+            if isinstance(value, bool):
+                return value
+            if str(value).lower() in _TRUE:
+                return True
+            if str(value).lower() in _FALSE:
+                return False
+            raise ValueError(f'{value!r} is not a boolean')
+        if self.type in (list, dict):
+            parsed = json.loads(value) if isinstance(value, str) else value
+            if not isinstance(parsed, self.type):
+                raise ValueError(f'{value!r} is not a JSON {self.type.__name__}')
+            return parsed
+        if self.type is int and isinstance(value, float) and value.is_integer():
+            return int(value)
+        return self.type(value)
+
+
+def _from_environ(key: str) -> Optional[str]:
+    """ The environment variable for `key` -- either the key itself or its upper case form """
+    if key in os.environ:
+        return os.environ[key]
+    return os.environ.get(key.upper())
+
+
+def _load_config_file(config_file: str) -> dict:
+    logger.info(f'Loading custom configuration: {config_file}')
+    try:
+        with open(config_file) as f:
+            return json.load(f)
+    except IOError:
+        logger.critical("there was a problem opening the config file")
+        raise
+    except json.JSONDecodeError as e:
+        logger.critical("config file isn't valid json")
+        raise ValueError from e
 
 
 class Config(UserDict):
@@ -38,17 +112,8 @@ class Config(UserDict):
         super().__init__()
         if not config_file:
             config_file = env_defaults[os.getenv('ENIGMA_ENV', 'COMPOSE')]
-        logger.info(f'Loading custom configuration: {config_file}')
-        try:
-            with open(config_file) as f:
-                conf_file = json.load(f)
-                self.update(conf_file)
-        except IOError:
-            logger.critical("there was a problem opening the config file")
-            raise
-        except json.JSONDecodeError as e:
-            logger.critical("config file isn't valid json")
-            raise ValueError from e
+        self.config_file = config_file
+        self.update(_load_config_file(config_file))
 
         self.check_required()
 
@@ -73,3 +138,215 @@ class Config(UserDict):
                 return os.getenv(env_name)
 
         return super().__getitem__(item)
+
+    def resolve(self, schema: Dict[str, Field]) -> 'ConfigSnapshot':
+        """ Resolves every parameter in the schema or the config file once -- environment first, then the config file,
+        then the schema's default -- and converts it to its type. Raises ConfigError with everything that's missing
+        or invalid """
+        values: Dict[str, Any] = {}
+        errors = []
+        for key in sorted(set(schema) | set(self.data)):
+            field = schema.get(key, Field(type=object))
+            value = self[key] if key in self else field.default
+            if value is None:
+                if field.required:
+                    errors.append(f'Missing key {key} in configuration file or environment variables')
+                    continue
+            elif field.type is not object:
+                try:
+                    value = field.convert(value)
+                except ValueError as e:
+                    errors.append(f'Invalid value for {key} (expected {field.type.__name__}): {e}')
+                    continue
+            values[key] = value
+        if errors:
+            for error in errors:
+                logger.critical(error)
+            raise ConfigError(errors)
+        return ConfigSnapshot(values)
+
+
+class ConfigSnapshot(Mapping):
+    """ Configuration resolved once, with typed values. Lookups are a dict access and the values are never
+    converted again. Keys that are neither in the schema nor the config file fall through to the environment, the way
+    Config does """
+    def __init__(self, values: Dict[str, Any]):
+        self._values = MappingProxyType(dict(values))
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return self._values[key]
+        except KeyError:
+            value = _from_environ(key) if isinstance(key, str) else None
+            if value is None:
+                raise
+            return value
+
+    def __contains__(self, key) -> bool:
+        return key in self._values or (isinstance(key, str) and _from_environ(key) is not None)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._values)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __repr__(self) -> str:
+        return f'ConfigSnapshot({dict(self._values)!r})'
+
+    def save(self, path: str, fingerprint: str = ''):
+        """ Writes the resolved configuration to a cache file, atomically """
+        partial = f'{path}.{os.getpid()}.part'
+        with open(partial, 'w') as f:
+            json.dump({'fingerprint': fingerprint, 'values': dict(self._values)}, f)
+        os.replace(partial, path)
+
+
+def _fingerprint(schema: Dict[str, Field], config_file: str, keys: Iterable[str]) -> str:
+    """ Everything a resolved configuration depends on: the schema, the config file and the environment variables
+    that could override it """
+    st = os.stat(config_file)
+    inputs = [sorted((key, repr(field)) for key, field in schema.items()), config_file, st.st_mtime_ns, st.st_size,
+              [(key, _from_environ(key)) for key in sorted(keys)]]
+    return hashlib.sha256(json.dumps(inputs, default=str).encode()).hexdigest()
+
+
+def load_config(schema: Dict[str, Field], config_file: str = None, required: list = None,
+                cache_dir: str = None) -> ConfigSnapshot:
+    """ The resolved configuration for `schema` (see Config.resolve). Keys in `required` must be set, whatever their
+    type
+
+    With a cache directory (by default CONFIG_CACHE_DIR, if it is set), the result is saved there, and later processes
+    with the same schema, config file and environment load it instead of resolving it again """
+    if not config_file:
+        config_file = env_defaults[os.getenv('ENIGMA_ENV', 'COMPOSE')]
+    schema = {**{key: Field(required=True) for key in required or []}, **schema}
+    cache_dir = os.getenv('CONFIG_CACHE_DIR', '') if cache_dir is None else cache_dir
+    if not cache_dir:
+        return Config(config_file=config_file).resolve(schema)
+
+    name = hashlib.sha256(f'{config_file}:{sorted(schema)}'.encode()).hexdigest()[:16]
+    path = os.path.join(cache_dir, f'config-{name}.json')
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+        if cached['fingerprint'] == _fingerprint(schema, config_file, cached['values']):
+            logger.debug(f'Loaded resolved configuration from {path}')
+            return ConfigSnapshot(cached['values'])
+    except (IOError, ValueError, KeyError, TypeError):
+        pass
+
+    snapshot = Config(config_file=config_file).resolve(schema)
+    os.makedirs(cache_dir, exist_ok=True)
+    snapshot.save(path, _fingerprint(schema, config_file, snapshot))
+    return snapshot
+
+
+class ReloadableConfig(Mapping):
+    """ Configuration of a long-running service, reloaded when its config file changes
+
+    Reads go to the current ConfigSnapshot, which a reload replaces as a whole -- use `snapshot` to read several values
+    that must be consistent with each other. A config file that doesn't load or validate is logged and ignored, and
+    the previous configuration stays in effect. Subscribers are called with the new snapshot and the keys that
+    changed """
+    def __init__(self, schema: Dict[str, Field] = None, config_file: str = None, required: list = None):
+        self.schema = schema or {}
+        self.config_file = config_file or env_defaults[os.getenv('ENIGMA_ENV', 'COMPOSE')]
+        self.required = required or []
+        self._snapshot = load_config(self.schema, self.config_file, self.required)
+        self._version = self._file_version()
+        self._subscribers: List[Tuple[Callable[[ConfigSnapshot, Set[str]], None], Optional[Set[str]]]] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def snapshot(self) -> ConfigSnapshot:
+        return self._snapshot
+
+    def __getitem__(self, key: str) -> Any:
+        return self._snapshot[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self._snapshot
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._snapshot)
+
+    def __len__(self) -> int:
+        return len(self._snapshot)
+
+    def subscribe(self, callback: Callable[[ConfigSnapshot, Set[str]], None], keys: Iterable[str] = None):
+        """ Calls `callback(snapshot, changed_keys)` after every reload that changes any of `keys` (any key at all, if
+        not given) """
+        with self._lock:
+            self._subscribers.append((callback, None if keys is None else set(keys)))
+        return callback
+
+    def unsubscribe(self, callback: Callable[[ConfigSnapshot, Set[str]], None]):
+        with self._lock:
+            self._subscribers = [(c, keys) for c, keys in self._subscribers if c is not callback]
+
+    def _file_version(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.config_file)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def reload(self) -> Set[str]:
+        """ Loads the config file again, if it changed since it was last loaded, and returns the keys whose values
+        changed """
+        with self._lock:
+            version = self._file_version()
+            if version is None or version == self._version:
+                return set()
+            try:
+                snapshot = load_config(self.schema, self.config_file, self.required)
+            except (IOError, ValueError) as e:
+                logger.error(f'Failed to reload {self.config_file}, keeping the current configuration: {e}')
+                self._version = version
+                return set()
+            old, self._snapshot, self._version = self._snapshot, snapshot, version
+            changed = {key for key in set(old) | set(snapshot) if old.get(key) != snapshot.get(key)}
+            if not changed:
+                # touched, or written again with the same values
+                return changed
+            subscribers = [callback for callback, keys in self._subscribers if keys is None or keys & changed]
+        logger.info(f'Reloaded {self.config_file}, changed: {", ".join(sorted(changed))}')
+        for callback in subscribers:
+            try:
+                callback(snapshot, changed)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error(f'Config subscriber {callback} failed: {e!r}')
+        return changed
+
+    def watch(self, interval: float = RELOAD_INTERVAL) -> 'ReloadableConfig':
+        """ Reloads the config file in a background thread whenever it changes -- on inotify events if inotify_simple
+        is installed, otherwise by checking it every `interval` seconds """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, args=(interval,), name='config-watch', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _watch(self, interval: float):
+        if inotify_simple is None:
+            while not self._stop.wait(interval):
+                self.reload()
+            return
+
+        # watch the directory, not the file -- editors and Kubernetes ConfigMaps replace the file rather than write it
+        flags = inotify_simple.flags
+        with inotify_simple.INotify() as inotify:
+            inotify.add_watch(os.path.dirname(os.path.abspath(self.config_file)),
+                              flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.DELETE)
+            while not self._stop.is_set():
+                if inotify.read(timeout=int(interval * 1000)):
+                    self.reload()
@@ -1,20 +1,27 @@
-import binascii
+import functools
+import hashlib
 import os
 import pathlib
 from collections import UserDict
 from dataclasses import dataclass
-from typing import Tuple
+from typing import Dict, Iterator, Tuple, Type
 
 from Crypto import Random
 from Crypto.Cipher import AES
 from Crypto.Hash import keccak
 from Crypto.Util import Counter
-from ecdsa import SigningKey, SECP256k1
-from web3.auto import w3 as auto_w3
+from ecdsa import SigningKey, SECP256k1, VerifyingKey
+from ecdsa.util import sigdecode_string, sigencode_string
 
+from .address import Address
 from .logger import get_logger
 from .utils import remove_0x
 
+try:
+    import coincurve
+except ImportError:
+    coincurve = None
+
 logger = get_logger('enigma_common.crypto')
 
 PRIVATE_KEY_NAME = 'keystore.bin'
@@ -23,6 +30,76 @@ ETHER_ADDRESS_NAME = 'eth_address.txt'
 # AES supports multiple key sizes: 16 (AES128), 24 (AES192), or 32 (AES256).
 KEY_BYTES = 32
 IV_LEN = AES.block_size
+# chunks encrypt_stream and decrypt_stream work in
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+class CurveBackend:
+    """ secp256k1 operations. Keys are raw bytes: 32 for a private key, 64 (x || y) for a public key """
+    name = ''
+
+    def generate(self) -> bytes:
+        raise NotImplementedError
+
+    def public_key(self, private_key: bytes) -> bytes:
+        raise NotImplementedError
+
+    def sign(self, private_key: bytes, digest: bytes) -> bytes:
+        """ Deterministic (RFC 6979), low-s signature of a 32 byte digest: r || s || recovery id, 65 bytes """
+        raise NotImplementedError
+
+
+class EcdsaBackend(CurveBackend):
+    """ pure Python -- always available, but takes milliseconds per operation """
+    name = 'ecdsa'
+
+    def generate(self) -> bytes:
+        return SigningKey.generate(curve=SECP256k1).to_string()
+
+    def public_key(self, private_key: bytes) -> bytes:
+        return SigningKey.from_string(private_key, curve=SECP256k1).get_verifying_key().to_string()
+
+    def sign(self, private_key: bytes, digest: bytes) -> bytes:
+        signing_key = SigningKey.from_string(private_key, curve=SECP256k1)
+        r, s = sigdecode_string(signing_key.sign_digest_deterministic(digest, hashfunc=hashlib.sha256,
+                                                                      sigencode=sigencode_string), SECP256k1.order)
+        # Ethereum only accepts the lower of the two valid values of s
+        s = min(s, SECP256k1.order - s)
+        signature = sigencode_string(r, s, SECP256k1.order)
+        public_key = signing_key.get_verifying_key().to_string()
+        candidates = VerifyingKey.from_public_key_recovery_with_digest(signature, digest, SECP256k1,
+                                                                       hashfunc=hashlib.sha256)
+        recovery_id = [candidate.to_string() for candidate in candidates].index(public_key)
+        return signature + bytes([recovery_id])
+
+
+class CoincurveBackend(CurveBackend):
+    """ libsecp256k1, through coincurve """
+    name = 'coincurve'
+
+    def generate(self) -> bytes:
+        return coincurve.PrivateKey().secret
+
+    def public_key(self, private_key: bytes) -> bytes:
+        return coincurve.PrivateKey(private_key).public_key.format(compressed=False)[1:]
+
+    def sign(self, private_key: bytes, digest: bytes) -> bytes:
+        return coincurve.PrivateKey(private_key).sign_recoverable(digest, hasher=None)
+
+
+BACKENDS: Dict[str, Type[CurveBackend]] = {EcdsaBackend.name: EcdsaBackend}
+if coincurve is not None:
+    BACKENDS[CoincurveBackend.name] = CoincurveBackend
+
+# the fastest one installed
+backend: CurveBackend = CoincurveBackend() if coincurve is not None else EcdsaBackend()
+
+
+def set_backend(name: str):
+    """ Use the named backend ('ecdsa' or 'coincurve') from now on. Raises KeyError if it isn't installed """
+    global backend  # pylint: disable=global-statement
+    backend = BACKENDS[name]()
+    logger.info(f'Using {name} for secp256k1')
 
 
 @dataclass
@@ -32,11 +109,11 @@ class EthereumKey:
 
     def __post_init__(self):
         if self.key and not self.address:
-            self.address = auto_w3.toChecksumAddress(address_from_private(self.key))
+            self.address = checksum_address_from_private(self.key)
 
 
 def _derive_key(password: str) -> bytes:
-    """ keccak256(password) """
+    """ keccak256(password). Derived once per call (or stream), and not cached, so passwords aren't kept around """
     passwd_bytes = password.encode()
     keccak_hash = keccak.new(digest_bits=256)
     keccak_hash.update(passwd_bytes)
@@ -44,59 +121,121 @@ def _derive_key(password: str) -> bytes:
     return bytes.fromhex(key)
 
 
-def encrypt(password: str, plaintext: bytes) -> bytes:
-    key = _derive_key(password)
+def _cipher(key: bytes, iv: bytes):
     if len(key) != KEY_BYTES:
         raise RuntimeError(f'Wrong length in encryption key: expected:{KEY_BYTES}, got: {len(key)}')
 
-    iv = Random.new().read(IV_LEN)
-    iv_int = int(binascii.hexlify(iv), 16)
+    ctr = Counter.new(AES.block_size * 8, initial_value=int.from_bytes(iv, 'big'))
+    return AES.new(key, AES.MODE_CTR, counter=ctr)
 
-    ctr = Counter.new(AES.block_size * 8, initial_value=iv_int)
-    aes = AES.new(key, AES.MODE_CTR, counter=ctr)
 
-    ciphertext = aes.encrypt(plaintext)
+def encrypt(password: str, plaintext: bytes) -> bytes:
+    iv = Random.new().read(IV_LEN)
+    ciphertext = _cipher(_derive_key(password), iv).encrypt(plaintext)
     return iv+ciphertext
 
 
 def decrypt(password, ciphertext: bytes) -> bytes:
-    key = _derive_key(password)
-    if len(key) != KEY_BYTES:
-        raise RuntimeError(f'Wrong length in encryption key: expected:{KEY_BYTES}, got: {len(key)}')
+    view = memoryview(ciphertext)
+    return _cipher(_derive_key(password), bytes(view[:IV_LEN])).decrypt(view[IV_LEN:])
+
+
+def _chunks(src, chunk_size: int) -> Iterator[memoryview]:
+    """ `src` -- a binary file object or a bytes-like object -- in chunks, without copying it: a buffer is sliced,
+    and a file is read into one buffer that is reused for every chunk """
+    if hasattr(src, 'readinto'):
+        buffer = memoryview(bytearray(chunk_size))
+        while True:
+            size = src.readinto(buffer)
+            if not size:
+                return
+            yield buffer[:size]
+    else:
+        data = memoryview(src).cast('B')
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+
+
+def _crypt_stream(crypt, src, dst, offset: int, chunk_size: int) -> int:
+    """ Runs `crypt` (a cipher's encrypt or decrypt) over src, writing to dst -- a binary file object, or a writable
+    buffer, from `offset` on. Returns how many bytes it processed """
+    out = None if hasattr(dst, 'write') else memoryview(dst).cast('B')
+    scratch = memoryview(bytearray(chunk_size)) if out is None else None
+    total = 0
+    for chunk in _chunks(src, chunk_size):
+        size = len(chunk)
+        if out is None:
+            crypt(chunk, output=scratch[:size])  # type: ignore
+            dst.write(scratch[:size])  # type: ignore
+        else:
+            if offset + total + size > len(out):
+                raise ValueError(f'Output buffer too small: {len(out)} bytes')
+            crypt(chunk, output=out[offset + total:offset + total + size])
+        total += size
+    return total
+
+
+def encrypt_stream(src, dst, password: str, chunk_size: int = STREAM_CHUNK_SIZE) -> int:
+    """ Encrypts src into dst in chunks, in the format of `encrypt` (IV, then the ciphertext). Each can be a binary
+    file object or a buffer (bytes, bytearray, memoryview, mmap...); a dst buffer must have room for the IV and all of
+    src. Returns the number of bytes written """
+    iv = Random.new().read(IV_LEN)
+    if hasattr(dst, 'write'):
+        dst.write(iv)
+    else:
+        memoryview(dst).cast('B')[:IV_LEN] = iv
+    return IV_LEN + _crypt_stream(_cipher(_derive_key(password), iv).encrypt, src, dst, IV_LEN, chunk_size)
 
-    iv = ciphertext[:IV_LEN]
-    iv_int = int(iv.hex(), 16)
-    ctr = Counter.new(AES.block_size * 8, initial_value=iv_int)
-    aes = AES.new(key, AES.MODE_CTR, counter=ctr)
 
-    plaintext = aes.decrypt(ciphertext[IV_LEN:])
-    return plaintext
+def decrypt_stream(src, dst, password: str, chunk_size: int = STREAM_CHUNK_SIZE) -> int:
+    """ Decrypts what `encrypt` or `encrypt_stream` wrote, from src into dst in chunks. Each can be a binary file
+    object or a buffer. Returns the number of bytes written """
+    if hasattr(src, 'readinto'):
+        iv = src.read(IV_LEN)
+    else:
+        src = memoryview(src).cast('B')
+        iv, src = bytes(src[:IV_LEN]), src[IV_LEN:]
+    if len(iv) != IV_LEN:
+        raise ValueError('Ciphertext is shorter than its IV')
+    return _crypt_stream(_cipher(_derive_key(password), iv).decrypt, src, dst, 0, chunk_size)
 
 
 def generate_key() -> Tuple[str, bytes]:
     """
     Generate private key and public key
-    Save as PEMs for management
 
-    :return: ECDSA Key Object - pri_key, pub_key
+    :return: private key (hex), public key (64 bytes)
     """
-    pri_key = SigningKey.generate(curve=SECP256k1)
-    pub_key = pri_key.get_verifying_key()
-    return '0x' + pri_key.to_string().hex(), pub_key.to_string()
+    private_key = backend.generate()
+    return '0x' + private_key.hex(), backend.public_key(private_key)
+
+
+def public_key_from_private(private_key: bytes) -> bytes:
+    """ 64 byte public key of a private key. Not memoized, so private keys aren't kept around -- addresses are
+    memoized by public key instead (pubkey_to_addr) """
+    return backend.public_key(private_key)
 
 
 def address_from_private(pk) -> str:
     """
-    Generate private key and public key
-    Save as PEMs for management
+    Ethereum address (lower case) of a private key
 
-    :return: ECDSA Key Object - pri_key, pub_key
+    :param pk: private key, hex
     """
-    pri_key = SigningKey.from_string(string=bytes.fromhex(remove_0x(pk)), curve=SECP256k1)
-    pub_key = pri_key.get_verifying_key()
-    return pubkey_to_addr(pub_key.to_string().hex())
+    return pubkey_to_addr(public_key_from_private(bytes.fromhex(remove_0x(pk))).hex())
+
+
+def checksum_address_from_private(pk: str) -> Address:
+    """ Checksummed ethereum address of a private key """
+    return Address(address_from_private(pk))
+
+
+def sign_hash(pk, digest: bytes) -> bytes:
+    """ Signature of a 32 byte message hash: r || s || recovery id """
+    return backend.sign(bytes.fromhex(remove_0x(pk)), digest)
 
 
+@functools.lru_cache(maxsize=1024)
 def pubkey_to_addr(pubkey: str) -> str:
     public_key_bytes = bytes.fromhex(pubkey)
     keccak_hash = keccak.new(digest_bits=256)
@@ -122,7 +261,7 @@ def save_to_path(path, file, flags='wb+'):
 
 def _create_keystore(privkey_path: pathlib.Path, pubkey_path: pathlib.Path, password: str = '') -> Tuple[str, str]:
     private_key, eth_address = get_eth_address()
-    eth_address = auto_w3.toChecksumAddress(eth_address)
+    eth_address = Address(eth_address)
     if password:
         enc_key = encrypt(password, bytes.fromhex(private_key[2:])).hex()
         save_to_path(privkey_path, enc_key, 'w+')
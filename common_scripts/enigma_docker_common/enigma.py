@@ -1,9 +1,13 @@
+import threading
 import time
-from typing import Union
+from typing import Any, Dict, List, Optional, Union
 
 import web3
 from web3.auto import w3 as auto_w3
 
+from .address import Address
+from .batch import Batch, CallResult
+from .blocks import block_watcher
 from .logger import get_logger
 
 logger = get_logger('enigma_common.enigma')
@@ -13,6 +17,176 @@ class StakingAddressAlreadySet(ValueError):
     pass
 
 
+class NonceManager:
+    """ Hands out the nonces of each sender locally, so several transactions from the same sender can be signed and
+    sent back to back. The node is only asked for a sender's transaction count the first time, and again after a send
+    failed """
+    def __init__(self, w3: web3.Web3):
+        self.w3 = w3
+        self._lock = threading.Lock()
+        self._next: Dict[str, int] = {}
+
+    def reserve(self, address: str) -> int:
+        with self._lock:
+            nonce = self._next.get(address)
+            if nonce is None:
+                nonce = self.w3.eth.getTransactionCount(address, 'pending')
+            self._next[address] = nonce + 1
+            return nonce
+
+    def known(self, address: str) -> bool:
+        with self._lock:
+            return address in self._next
+
+    def seed(self, address: str, count: int):
+        """ Starts counting from the sender's pending transaction count, fetched by the caller -- asynchronously,
+        say. Ignored if the sender's nonces are already counted """
+        with self._lock:
+            self._next.setdefault(address, count)
+
+    def release(self, address: str, nonce: int):
+        """ Gives back a nonce whose transaction was never sent. If sending it failed, the node may have taken it
+        anyway (or the nonce was stale to begin with) -- reset the sender instead """
+        with self._lock:
+            if self._next.get(address) == nonce + 1:
+                self._next[address] = nonce
+            else:
+                # later nonces are out already -- we can't tell which will go through, so ask the node next time
+                self._next.pop(address, None)
+
+    def reset(self, address: str = None):
+        with self._lock:
+            if address is None:
+                self._next.clear()
+            else:
+                self._next.pop(address, None)
+
+
+# one per ethereum node, shared by all the contracts that talk to it -- the same sender signs for several contracts
+_nonce_managers: Dict[str, NonceManager] = {}
+_nonce_managers_lock = threading.Lock()
+
+
+def nonce_manager(eth_node: str, w3: web3.Web3) -> NonceManager:
+    with _nonce_managers_lock:
+        if eth_node not in _nonce_managers:
+            _nonce_managers[eth_node] = NonceManager(w3)
+        return _nonce_managers[eth_node]
+
+
+class GasPriceStrategy:
+    """ How the gas oracle estimates the gas price. estimate returns wei, or None if it has no estimate """
+    def estimate(self, w3: web3.Web3) -> Optional[int]:
+        raise NotImplementedError
+
+
+class FixedGasPrice(GasPriceStrategy):
+    def __init__(self, price: int):
+        self.price = price
+
+    def estimate(self, w3: web3.Web3) -> Optional[int]:
+        return self.price
+
+
+class NodeGasPrice(GasPriceStrategy):
+    """ What the node suggests (eth_gasPrice) """
+    def estimate(self, w3: web3.Web3) -> Optional[int]:
+        return int(w3.eth.gasPrice)
+
+
+class PercentileGasPrice(GasPriceStrategy):
+    """ The given percentile of the gas prices paid in the last {blocks} blocks. Blocks are only fetched once. Falls
+    back to what the node suggests if they have no transactions (a quiet local chain) """
+    def __init__(self, percentile: float = 60, blocks: int = 20):
+        self.percentile = percentile
+        self.blocks = blocks
+        self._prices: Dict[int, List[int]] = {}
+
+    def estimate(self, w3: web3.Web3) -> Optional[int]:
+        latest = w3.eth.blockNumber
+        wanted = range(max(0, latest - self.blocks + 1), latest + 1)
+        for number in wanted:
+            if number not in self._prices:
+                block = w3.eth.getBlock(number, full_transactions=True)
+                self._prices[number] = [int(tx['gasPrice']) for tx in block['transactions']]
+        self._prices = {number: self._prices[number] for number in wanted}
+
+        prices = sorted(price for block_prices in self._prices.values() for price in block_prices)
+        if not prices:
+            return NodeGasPrice().estimate(w3)
+        return prices[round((len(prices) - 1) * self.percentile / 100)]
+
+
+class GasOracle:
+    """ Gas price estimates for an ethereum node, cached for {ttl} seconds and capped at {cap}. Once the estimate is
+    stale it is still served, while a fresh one is fetched in the background -- only the very first call waits for the
+    node. If the node can't be asked, the last estimate (or the cap, if there is none yet) is used """
+    def __init__(self, w3: web3.Web3, strategy: GasPriceStrategy = None, cap: int = 20000000000, ttl: float = 60):
+        self.w3 = w3
+        self.strategy = strategy or NodeGasPrice()
+        self.cap = cap
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._price: Optional[int] = None
+        self._updated = 0.0
+        self._refreshing = False
+
+    def price(self) -> int:
+        with self._lock:
+            price, stale = self._price, time.monotonic() - self._updated >= self.ttl
+            if price is not None and stale and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self.refresh, daemon=True).start()
+        if price is None:
+            return self.refresh()
+        return price
+
+    def refresh(self) -> int:
+        try:
+            estimate = self.strategy.estimate(self.w3)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning(f'Failed to estimate gas price: {e}')
+            estimate = None
+        with self._lock:
+            self._refreshing = False
+            if estimate is not None:
+                self._price, self._updated = min(estimate, self.cap), time.monotonic()
+            return self._price if self._price is not None else self.cap
+
+    def configure(self, strategy: GasPriceStrategy = None, cap: int = None, ttl: float = None):
+        """ Changes whatever is given, and drops the cached estimate """
+        with self._lock:
+            self.strategy = strategy if strategy is not None else self.strategy
+            self.cap = cap if cap is not None else self.cap
+            self.ttl = ttl if ttl is not None else self.ttl
+            self._price, self._updated = None, 0.0
+
+
+# one per ethereum node, shared by every contract in the process
+_gas_oracles: Dict[str, GasOracle] = {}
+_gas_oracles_lock = threading.Lock()
+# what new oracles are created with -- see set_gas_strategy
+_gas_settings: Dict[str, Any] = {}
+
+
+def gas_oracle(eth_node: str, w3: web3.Web3) -> GasOracle:
+    with _gas_oracles_lock:
+        if eth_node not in _gas_oracles:
+            _gas_oracles[eth_node] = GasOracle(w3, **{'cap': Contract.max_gas_price, **_gas_settings})
+        return _gas_oracles[eth_node]
+
+
+def set_gas_strategy(strategy: GasPriceStrategy, cap: int = None, ttl: float = None):
+    """ Use this strategy (and cap, and TTL, if given) for the gas price of every contract from now on """
+    settings: Dict[str, Any] = {key: value for key, value in (('strategy', strategy), ('cap', cap), ('ttl', ttl))
+                                if value is not None}
+    with _gas_oracles_lock:
+        _gas_settings.update(settings)
+        oracles = list(_gas_oracles.values())
+    for oracle in oracles:
+        oracle.configure(**settings)
+
+
 class Contract:
 
     max_gas_price = 20000000000
@@ -31,15 +205,15 @@ class Contract:
         self.w3provider = web3.HTTPProvider(eth_node)
         self.w3 = web3.Web3(self.w3provider)
         self.contract = self.w3.eth.contract(contract_address, abi=contract_abi)
-
-        self._gasprice = self.max_gas_price
+        self.nonces = nonce_manager(eth_node, self.w3)
+        self.gas_oracle = gas_oracle(eth_node, self.w3)
 
     @staticmethod
-    def toCheckSumAddress(address: str):
-        return auto_w3.toChecksumAddress(address)
+    def toCheckSumAddress(address: str) -> Address:
+        return Address(address)
 
     @staticmethod
-    def _sign(raw_tx, key: bytes) -> dict:
+    def _sign(raw_tx, key: Union[bytes, str]):
         # stupid_w3.eth.defaultAccount = public_key
         return auto_w3.eth.account.sign_transaction(raw_tx, private_key=key)
 
@@ -49,25 +223,57 @@ class Contract:
         return tx_receipt
 
     def wait_for_confirmations(self, receipt, confirmations):
-        while self.w3.eth.blockNumber - receipt.blockNumber < int(confirmations):
-            time.sleep(5)
+        block_watcher(self.eth_node).wait_for_confirmations(receipt, confirmations)
+
+    def wait_for_transactions(self, tx_hashes: List[bytes], confirmations: int = 0) -> list:
+        """ Waits until all of the transactions are mined, and the last of them has {confirmations} confirmations.
+        Returns their receipts, in the same order
+
+        :param tx_hashes: as returned by send, in the order they were sent
+        """
+        receipts = [self.w3.eth.waitForTransactionReceipt(tx_hash) for tx_hash in tx_hashes]
+        if receipts and confirmations:
+            self.wait_for_confirmations(max(receipts, key=lambda receipt: receipt.blockNumber), confirmations)
+        return receipts
 
     @property
     def gasprice(self):
-        est = self.w3.eth.generateGasPrice()
-        if est:
-            self._gasprice = max(int(est), self.max_gas_price)
-        return self._gasprice
+        """ the shared gas oracle's estimate -- capped at max_gas_price, unless set_gas_strategy says otherwise """
+        return self.gas_oracle.price()
 
-    def transact(self, sending_address, key, func, *args):
-        transaction = self.build(sending_address, func, *args)
-        signed_tx = self._sign(transaction, key)
-        receipt = self._send_transactions(signed_tx)
-        return receipt
+    def batch(self) -> Batch:
+        """ For reading many things from the node at once -- batch.call(self.contract.functions.<func>(*args)) """
+        return Batch(self.w3)
 
-    def build(self, sending_address, func, *args):
-        csum_addr = self.w3.toChecksumAddress(sending_address)
-        nonce = self.w3.eth.getTransactionCount(csum_addr, 'pending')
+    def transact(self, sending_address, key, func, *args):
+        tx_hash = self.send(sending_address, key, func, *args)
+        return self.w3.eth.waitForTransactionReceipt(tx_hash)
+
+    def send(self, sending_address, key, func, *args) -> bytes:
+        """ Builds, signs and sends a transaction without waiting for it to be mined, with the sender's next nonce
+        from the local nonce manager. Returns the transaction hash """
+        csum_addr = Address(sending_address)
+        nonce = self.nonces.reserve(csum_addr)
+        try:
+            signed_tx = self._sign(self.build(csum_addr, func, *args, nonce=nonce), key)
+        except Exception:
+            self.nonces.release(csum_addr, nonce)
+            raise
+        try:
+            self.w3.eth.sendRawTransaction(signed_tx.rawTransaction)
+        except Exception:
+            # too low, or it timed out after the node took it: ask the node for the count next time
+            self.nonces.reset(csum_addr)
+            raise
+        logger.debug(f'Sent {func} from {csum_addr} with nonce {nonce}: {signed_tx.hash.hex()}')
+        return signed_tx.hash
+
+    def build(self, sending_address, func, *args, nonce: Optional[int] = None):
+        """ Builds a transaction calling {func}. Unless a nonce is given, the sender's pending transaction count is
+        used -- for transactions that are signed somewhere else """
+        csum_addr = Address(sending_address)
+        if nonce is None:
+            nonce = self.w3.eth.getTransactionCount(csum_addr, 'pending')
         transaction = getattr(self.contract.functions, func)(*args).buildTransaction(
             {'from': csum_addr,
              'gasPrice': self.gasprice,
@@ -79,10 +285,7 @@ class Contract:
 class EnigmaTokenContract(Contract):
     def _approve_build_transaction(self, approver: str, to: str, amount) -> dict:
 
-        if not self.w3.isAddress(approver):
-            raise ValueError(f'Invalid ethereum address {approver}')
-
-        public_key = self.w3.toChecksumAddress(approver)
+        public_key = Address(approver)
         nonce = self.w3.eth.getTransactionCount(public_key, 'pending')
         return self.contract.functions.approve(to, amount).buildTransaction({'from': public_key,
                                                                              'gasPrice': self.gasprice,
@@ -99,6 +302,10 @@ class EnigmaTokenContract(Contract):
         """
         self.transact(approver, key, 'approve', to, amount)
 
+    def approve_send(self, approver: str, to: str, amount, key: bytes) -> bytes:
+        """ Like approve, without waiting for the transaction to be mined. Returns its hash """
+        return self.send(approver, key, 'approve', to, amount)
+
     def approve_build(self, approver: str, to: str, amount):
         """
         Builds approve command for {amount} ENG from {approver} to {to}
@@ -111,34 +318,45 @@ class EnigmaTokenContract(Contract):
         return self.build(approver, 'approve', to, amount)
 
     def check_allowance(self, approver, to):
-        approver = self.w3.toChecksumAddress(approver)
-        to = self.w3.toChecksumAddress(to)
-        val = self.contract.functions.allowance(approver, to).call()
+        val = self.contract.functions.allowance(Address(approver), Address(to)).call()
         return val
 
+    def balances(self, accounts: List[str]) -> List[CallResult]:
+        """ ENG balance (in fragments of ENG) of each account, in one round trip """
+        batch = self.batch()
+        for account in accounts:
+            batch.call(self.contract.functions.balanceOf(Address(account)))
+        return batch.execute()
+
 
 class EnigmaContract(Contract):
     def deposit(self, staking_address: str, staking_key: Union[bytes, str], deposit_amount: int,
                 confirmations: int = 0):
-        receipt = self.transact(self.toCheckSumAddress(staking_address), staking_key, 'deposit',
-                                self.toCheckSumAddress(staking_address), deposit_amount)
-        if confirmations:
-            self.wait_for_confirmations(receipt, confirmations)
+        receipt, = self.wait_for_transactions([self.deposit_send(staking_address, staking_key, deposit_amount)],
+                                              confirmations)
         return receipt
 
+    def deposit_send(self, staking_address: str, staking_key: Union[bytes, str], deposit_amount: int) -> bytes:
+        return self.send(self.toCheckSumAddress(staking_address), staking_key, 'deposit',
+                         self.toCheckSumAddress(staking_address), deposit_amount)
+
     # noinspection PyPep8Naming
     def setOperatingAddress(self, staking_address: str, staking_key: Union[bytes, str],
                             eth_address: str, confirmations: int = 0):
+        receipt, = self.wait_for_transactions([self.setOperatingAddress_send(staking_address, staking_key, eth_address)],
+                                              confirmations)
+        return receipt
+
+    # noinspection PyPep8Naming
+    def setOperatingAddress_send(self, staking_address: str, staking_key: Union[bytes, str], eth_address: str) -> bytes:
         try:
-            receipt = self.transact(self.toCheckSumAddress(staking_address), staking_key, 'setOperatingAddress',
-                                    self.toCheckSumAddress(eth_address))
-            if confirmations:
-                self.wait_for_confirmations(receipt, confirmations)
-            return receipt
+            return self.send(self.toCheckSumAddress(staking_address), staking_key, 'setOperatingAddress',
+                             self.toCheckSumAddress(eth_address))
         except ValueError as e:
             if 'Staking address currently tied to an in-use operating address' in str(e):
                 raise StakingAddressAlreadySet(f'Cannot call setOperatingAddress twice for the same staking address: '
                                                f'{staking_address}') from None
+            raise
 
     def deposit_build(self, staking_address: str, eth_address: str, deposit_amount: int):
         return self.build(self.toCheckSumAddress(staking_address), 'deposit', self.toCheckSumAddress(eth_address),
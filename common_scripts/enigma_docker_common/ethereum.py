@@ -1,5 +1,10 @@
+from typing import Iterable, List
+
 import web3
 
+from .address import Address
+from .batch import Batch, CallResult
+from .blocks import block_watcher
 from .logger import get_logger
 
 logger = get_logger('enigma_common.enigma')
@@ -11,12 +16,24 @@ class EthereumGateway:
         self.w3 = web3.Web3(self.provider)
 
     def balance(self, account: str) -> str:
-        if not self.w3.isAddress(account):
-            raise ValueError(f'Trying to get balance for malformed ethereum account {account}')
-        account = self.w3.toChecksumAddress(account)
+        try:
+            account = Address(account)
+        except ValueError:
+            raise ValueError(f'Trying to get balance for malformed ethereum account {account}') from None
         val = self.w3.fromWei(self.w3.eth.getBalance(account), 'ether')
         return str(val)
 
+    def batch(self) -> Batch:
+        return Batch(self.w3)
+
+    def balances(self, accounts: Iterable[str]) -> List[CallResult]:
+        """ The balance of each account, like balance(), in one round trip (or a few, for very many accounts) """
+        batch = self.batch()
+        for account in accounts:
+            batch.balance(account)
+        return [CallResult(value=str(self.w3.fromWei(result.value, 'ether'))) if result.ok else result
+                for result in batch.execute()]
+
 
 def check_eth_limit(account: str,
                     min_ether: float,
@@ -28,3 +45,12 @@ def check_eth_limit(account: str,
                     f'the worker. Please transfer currency to the worker account: {account} and restart the worker')
         return False
     return True
+
+
+def wait_for_eth_limit(account: str, min_ether: float, eth_node: str, ws_url: str = ''):
+    """ Blocks until {account} holds at least {min_ether}. The balance is checked again on every new block """
+    if check_eth_limit(account, min_ether, eth_node):
+        return
+    watcher = block_watcher(eth_node, ws_url)
+    watcher.wait_for_balance(Address(account), watcher.w3.toWei(min_ether, 'ether'))
+    logger.info(f'Ethereum balance of {account} reached {min_ether} ETH')
@@ -1,30 +1,19 @@
-import socket
 import time
 from collections import UserDict
-from urllib.parse import urlparse
 
 import requests
 
+from . import readiness
 from .logger import get_logger
 
 logger = get_logger('enigma_common.faucet')
 
 
 def _wait_till_open(url, timeout: int = 60) -> None:
-    p = urlparse(url)
-    hostname = p.hostname
-    port = p.port
-
-    def is_ready():
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        result = sock.connect_ex((hostname, port))
-        return result == 0
-
-    for _ in range(timeout):
-        if is_ready():
-            return
-        time.sleep(1)
-    raise ConnectionError(f'Timeout waiting for {url}')
+    try:
+        readiness.wait_for(readiness.Target.endpoint(url), timeout=timeout)
+    except TimeoutError:
+        raise ConnectionError(f'Timeout waiting for {url}') from None
 
 
 def request_coins(faucet_url, account: str, currency: str) -> float:
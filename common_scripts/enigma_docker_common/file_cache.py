@@ -0,0 +1,137 @@
+""" In-memory cache of the files served by the discovery servers
+
+Each file is read, JSON encoded (the way flask_restplus returns a string) and compressed once per version -- the
+version being its mtime and size -- so serving it again costs a stat. Responses carry a strong ETag, and a client that
+already has the current version gets an empty 304.
+
+`watch_response` serves the long-poll watch endpoints: it holds the request until the file is published or changes,
+so clients waiting for an artifact get it right away without polling the server.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Tuple
+
+from flask import Response
+
+from .logger import get_logger
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = get_logger('enigma_common.file_cache')
+
+# bodies smaller than this aren't worth compressing
+MIN_COMPRESS_SIZE = 256
+# longest a watch request is held open, in seconds
+MAX_WATCH_TIME = 60.0
+# how often a held watch request checks the file on disk, in seconds
+WATCH_INTERVAL = 0.2
+
+
+@dataclass(frozen=True)
+class CachedFile:
+    text: str
+    body: bytes
+    etag: str
+    # Content-Encoding -> precompressed body
+    encoded: Dict[str, bytes] = field(default_factory=dict)
+
+    @classmethod
+    def from_body(cls, body: bytes, text: str = '', etag: str = None) -> 'CachedFile':
+        encoded = {}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            encoded['gzip'] = gzip.compress(body, compresslevel=9)
+            if brotli is not None:
+                encoded['br'] = brotli.compress(body)
+        return cls(text, body, etag or hashlib.sha256(body).hexdigest()[:32], encoded)
+
+    @classmethod
+    def from_text(cls, text: str) -> 'CachedFile':
+        return cls.from_body(f'{json.dumps(text)}\n'.encode(), text)
+
+    @classmethod
+    def from_json(cls, obj) -> 'CachedFile':
+        """ A JSON document, rather than a file served as a JSON string """
+        text = json.dumps(obj)
+        return cls.from_body(text.encode(), text)
+
+    def response(self, request) -> Response:
+        """ The response to a flask request for this file: 304 if the client has this version, otherwise the body
+        in the best encoding the client accepts """
+        headers = {'ETag': f'"{self.etag}"', 'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache'}
+        if self.etag in request.if_none_match:
+            return Response(status=304, headers=headers)
+        for encoding in ('br', 'gzip'):
+            if encoding in self.encoded and encoding in request.accept_encodings:
+                headers['Content-Encoding'] = encoding
+                return Response(self.encoded[encoding], mimetype='application/json', headers=headers)
+        return Response(self.body, mimetype='application/json', headers=headers)
+
+
+class FileCache:
+    def __init__(self, render: Callable[[str], CachedFile] = CachedFile.from_text):
+        """
+        :param render: builds the cached response from the file's contents. Raises ValueError if it can't
+        """
+        self.render = render
+        self._files: Dict[str, Tuple[Tuple[int, int], CachedFile]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> CachedFile:
+        """ Returns the cached file, reading it again if it changed on disk since. Raises FileNotFoundError """
+        st = os.stat(path)
+        version = (st.st_mtime_ns, st.st_size)
+        cached = self._files.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        with open(path) as f:
+            entry = self.render(f.read())
+        logger.debug(f'Cached {path}: {len(entry.body)} bytes, etag {entry.etag}')
+        with self._lock:
+            self._files[path] = (version, entry)
+        return entry
+
+    def watch(self, path: str, etag: Optional[str] = None, timeout: float = MAX_WATCH_TIME) -> Optional[CachedFile]:
+        """ Blocks until the file exists and its ETag isn't `etag`. Returns None if that didn't happen in time """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                entry = self.get(path)
+                if entry.etag != etag:
+                    return entry
+            except FileNotFoundError:
+                pass
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(WATCH_INTERVAL)
+
+    def watch_response(self, path: str, request) -> Response:
+        """ The response to a flask long-poll request: the file as soon as it exists -- or, if the client sent the
+        ETag of the version it has, as soon as it changes. 304 if neither happened within the `wait` query argument
+        (seconds, at most MAX_WATCH_TIME). 400 if `wait` isn't a number of seconds """
+        etag = next(iter(request.if_none_match), None)
+        try:
+            wait = float(request.args.get('wait', MAX_WATCH_TIME))
+            if not wait >= 0:  # nan too
+                raise ValueError
+        except ValueError:
+            return Response(f'wait must be a number of seconds, not {request.args.get("wait")!r}', status=400)
+        entry = self.watch(path, etag, timeout=min(wait, MAX_WATCH_TIME))
+        if entry is None:
+            return Response(status=304)
+        return entry.response(request)
+
+    def forget(self, path: Optional[str] = None):
+        with self._lock:
+            if path is None:
+                self._files.clear()
+            else:
+                self._files.pop(path, None)
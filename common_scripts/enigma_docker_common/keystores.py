@@ -0,0 +1,457 @@
+""" Bulk generation of ethereum keystores, and a keystore file that holds many keys
+
+generate_keystores creates keystore directories laid out the way open_eth_keystore expects them (keystore.bin,
+eth_address.txt), so any of them can be handed to a worker as is, and an index file mapping each address to its
+keystore. generate_keystore_file puts the keys in a single KeystoreFile instead. Either way key generation is spread
+over a process pool.
+
+A KeystoreFile is a header followed by fixed-size records, one per key, that are only ever appended:
+    header    8 bytes magic, b'ENIGKEYS', 2 bytes format version, 2 bytes record size (little endian)
+    record    20 bytes address, 1 byte flags (1 if the key is encrypted), 48 bytes key: IV and AES-CTR ciphertext
+              (see crypto.encrypt), or 16 zero bytes and the key itself
+Next to it, <path>.idx indexes the records by address: a hash table of record numbers, kept at most half full, that
+appends update in place (or rebuild, once it would be more than half full). Both are read through mmap, so opening a
+key reads a few slots of the index and that one record, however many keys the file holds.
+    header    8 bytes magic, b'ENIGKIDX', 4 bytes format version, 4 bytes number of slots, 4 bytes records indexed
+    slot      4 bytes record number + 1, 0 if empty. A key's first slot comes from the first 8 bytes of its address
+Records appended by something that didn't update the index are indexed the next time the file is read.
+
+open_keystore opens a key from either kind of keystore.
+
+usage:
+    python -m enigma_docker_common.keystores <count> <output directory or .keys file> [--password PASSWORD]
+        [--workers N]
+"""
+import argparse
+import fcntl
+import itertools
+import json
+import mmap
+import os
+import pathlib
+import struct
+import threading
+import time
+from collections import UserDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .address import Address
+from .crypto import ETHER_ADDRESS_NAME, IV_LEN, PRIVATE_KEY_NAME, EthereumKey, _create_keystore, decrypt, encrypt, \
+    get_eth_address, open_eth_keystore
+from .logger import get_logger
+from .utils import remove_0x
+
+logger = get_logger('enigma_common.keystores')
+
+INDEX_NAME = 'index.json'
+# a keystore file holding many keys, rather than a directory with one
+KEYSTORE_FILE_SUFFIX = '.keys'
+
+MAGIC = b'ENIGKEYS'
+FORMAT = 1
+_HEADER = struct.Struct('<8sHH')
+_ADDRESS_LEN = 20
+_KEY_LEN = 32
+_ENCRYPTED = 1
+RECORD_SIZE = _ADDRESS_LEN + 1 + IV_LEN + _KEY_LEN
+
+# the index next to a keystore file: <path>.idx
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'ENIGKIDX'
+INDEX_FORMAT = 1
+# magic, format, number of slots (a power of two), number of records indexed
+_INDEX_HEADER = struct.Struct('<8sIII')
+# record number + 1 -- 0 is an empty slot
+_SLOT = struct.Struct('<I')
+_MIN_SLOTS = 1024
+
+
+def _slot(address: bytes, slots: int) -> int:
+    # addresses are hashes already
+    return int.from_bytes(address[:8], 'little') & (slots - 1)
+
+
+def _insert(table, slots: int, address: bytes, number: int):
+    """ Puts record `number` in the first free slot from the address' own, in a table of `slots` slots """
+    slot = _slot(address, slots)
+    while _SLOT.unpack_from(table, _INDEX_HEADER.size + slot * _SLOT.size)[0]:
+        slot = (slot + 1) & (slots - 1)
+    _SLOT.pack_into(table, _INDEX_HEADER.size + slot * _SLOT.size, number + 1)
+
+
+def _record_address(data, number: int) -> bytes:
+    offset = _HEADER.size + number * RECORD_SIZE
+    return data[offset:offset + _ADDRESS_LEN]
+
+
+def _version(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+class KeystoreFile:
+    """ Many keys in one file, found by address without reading the others. Safe to append to from several
+    processes: appends take an exclusive lock on the file """
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self._lock = threading.Lock()
+        self._map: Optional[mmap.mmap] = None
+        self._index: Optional[mmap.mmap] = None
+        self._versions: Tuple[Optional[tuple], Optional[tuple]] = (None, None)
+        # records the index doesn't have, if it can't be brought up to date (e.g. on a read-only file system)
+        self._unindexed: Dict[bytes, int] = {}
+
+    @staticmethod
+    def _address_bytes(address: str) -> bytes:
+        return bytes.fromhex(remove_0x(address).lower())
+
+    def _records(self) -> int:
+        # a partially written record doesn't count
+        return 0 if self._map is None else (len(self._map) - _HEADER.size) // RECORD_SIZE
+
+    def _index_header(self) -> Tuple[int, int]:
+        """ (slots, records indexed) """
+        if self._index is None:
+            return 0, 0
+        _, _, slots, indexed = _INDEX_HEADER.unpack_from(self._index)
+        return slots, indexed
+
+    def _refresh(self, locked: bool = False):
+        """ Maps the file and its index again if they changed, and indexes records the index doesn't have yet.
+        `locked` if we hold the file lock already """
+        self._remap()
+        if self._index_header()[1] == self._records():
+            return
+        try:
+            if locked:
+                self._write_index()
+            else:
+                with open(self.path, 'ab') as f:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    try:
+                        self._write_index()
+                    finally:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+            self._remap()
+        except OSError as e:
+            logger.debug(f'Can\'t update the index of {self.path} ({e}), indexing the rest in memory')
+        # whatever the index still doesn't have -- nothing, unless it couldn't be written
+        _, indexed = self._index_header()
+        self._unindexed = {}
+        for number in range(indexed, self._records()):
+            offset = _HEADER.size + number * RECORD_SIZE
+            self._unindexed.setdefault(self._map[offset:offset + _ADDRESS_LEN], offset)  # type: ignore
+
+    def _remap(self):
+        data_version, index_version = _version(self.path), _version(self.index_path)
+        if data_version is None:
+            raise FileNotFoundError(self.path)
+        if data_version != self._versions[0]:
+            with open(self.path, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, record_size = _HEADER.unpack_from(self._map)
+            if magic != MAGIC or version != FORMAT or record_size != RECORD_SIZE:
+                raise ValueError(f'Not a keystore file: {self.path}')
+        if index_version != self._versions[1]:
+            self._index = None
+            if index_version is not None:
+                with open(self.index_path, 'rb') as f:
+                    index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, version, _, _ = _INDEX_HEADER.unpack_from(index)
+                if magic == INDEX_MAGIC and version == INDEX_FORMAT:
+                    self._index = index
+        self._versions = (data_version, index_version)
+
+    def _write_index(self):
+        """ Holding the file lock. Rebuilt (and replaced) once it's half full, otherwise written in place """
+        with open(self.path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            records = (len(data) - _HEADER.size) // RECORD_SIZE
+            slots, indexed = (0, 0)
+            if os.path.exists(self.index_path):
+                with open(self.index_path, 'rb') as f:
+                    magic, version, slots, indexed = _INDEX_HEADER.unpack(f.read(_INDEX_HEADER.size))
+                if magic != INDEX_MAGIC or version != INDEX_FORMAT or indexed > records:
+                    slots, indexed = 0, 0
+            if records == indexed:
+                return
+            if records * 2 > slots:
+                self._rebuild_index(data, records)
+            else:
+                self._extend_index(data, slots, indexed, records)
+        finally:
+            data.close()
+
+    def _rebuild_index(self, data: mmap.mmap, records: int):
+        """ A new index of every record, big enough to stay at most half full, that replaces the old one """
+        slots = _MIN_SLOTS
+        while records * 2 > slots:
+            slots *= 2
+        table = bytearray(_INDEX_HEADER.size + slots * _SLOT.size)
+        for number in range(records):
+            _insert(table, slots, _record_address(data, number), number)
+        _INDEX_HEADER.pack_into(table, 0, INDEX_MAGIC, INDEX_FORMAT, slots, records)
+        partial = f'{self.index_path}.{os.getpid()}.part'
+        with open(partial, 'wb') as f:
+            f.write(table)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(partial, self.index_path)
+
+    def _extend_index(self, data: mmap.mmap, slots: int, indexed: int, records: int):
+        """ Adds records `indexed` to `records` to the index, in place """
+        with open(self.index_path, 'r+b') as f:
+            table = mmap.mmap(f.fileno(), 0)
+            try:
+                for number in range(indexed, records):
+                    _insert(table, slots, _record_address(data, number), number)
+                # readers trust the slots once the count covers them
+                _INDEX_HEADER.pack_into(table, 0, INDEX_MAGIC, INDEX_FORMAT, slots, records)
+                table.flush()
+            finally:
+                table.close()
+
+    def _find(self, address: bytes) -> Optional[int]:
+        """ Offset of the address' record: a few slots of the index, and the record itself, are all that is read """
+        slots, _ = self._index_header()
+        records = self._records()
+        if slots:
+            slot = _slot(address, slots)
+            while True:
+                number = _SLOT.unpack_from(self._index, _INDEX_HEADER.size + slot * _SLOT.size)[0]  # type: ignore
+                if not number:
+                    break
+                offset = _HEADER.size + (number - 1) * RECORD_SIZE
+                if number <= records and self._map[offset:offset + _ADDRESS_LEN] == address:  # type: ignore
+                    return offset
+                slot = (slot + 1) & (slots - 1)
+        return self._unindexed.get(address)
+
+    def __contains__(self, address: str) -> bool:
+        with self._lock:
+            self._refresh()
+            return self._find(self._address_bytes(address)) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return self._records()
+
+    def addresses(self) -> List[str]:
+        with self._lock:
+            self._refresh()
+            return [Address(self._map[offset:offset + _ADDRESS_LEN])  # type: ignore
+                    for offset in range(_HEADER.size, _HEADER.size + self._records() * RECORD_SIZE, RECORD_SIZE)]
+
+    def get(self, address: str, password: str = '') -> EthereumKey:
+        """ The key for `address`. Raises KeyError if the file doesn't have it, and ValueError if the password is
+        wrong """
+        with self._lock:
+            self._refresh()
+            offset = self._find(self._address_bytes(address))
+            if offset is None:
+                raise KeyError(f'No key for {address} in {self.path}')
+            record = self._map[offset:offset + RECORD_SIZE]  # type: ignore
+        flags, key = record[_ADDRESS_LEN], record[_ADDRESS_LEN + 1:]
+        private_key = decrypt(password, key) if flags & _ENCRYPTED else key[IV_LEN:]
+        # a wrong password decrypts to some other key -- if to a key at all
+        try:
+            eth_key: Optional[EthereumKey] = EthereumKey(key='0x' + private_key.hex())
+        except Exception:  # pylint: disable=broad-except
+            eth_key = None
+        if eth_key is None or eth_key.address != Address(record[:_ADDRESS_LEN]):
+            raise ValueError(f'Wrong password for {Address(record[:_ADDRESS_LEN])} in {self.path}')
+        return eth_key
+
+    def append(self, keys: Iterable[Tuple[str, bytes]]) -> int:
+        """ Appends (address, record) pairs, as made by `record`, skipping addresses already in the file, and indexes
+        them. Returns how many were added """
+        keys = list(keys)
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, 'ab') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    if f.tell() == 0:
+                        f.write(_HEADER.pack(MAGIC, FORMAT, RECORD_SIZE))
+                        f.flush()
+                    self._refresh(locked=True)
+                    seen = set()
+                    new = []
+                    for address, record in keys:
+                        address_bytes = self._address_bytes(address)
+                        if address_bytes not in seen and self._find(address_bytes) is None:
+                            seen.add(address_bytes)
+                            new.append(record)
+                    if new:
+                        f.write(b''.join(new))
+                        f.flush()
+                        os.fsync(f.fileno())
+                        self._refresh(locked=True)
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+            return len(new)
+
+    def add(self, private_key: str, password: str = '') -> str:
+        """ Adds a key (hex) and returns its address """
+        address, record = self.record(private_key, password)
+        self.append([(address, record)])
+        return address
+
+    @staticmethod
+    def record(private_key: str, password: str = '') -> Tuple[str, bytes]:
+        """ (address, record) of a key (hex), encrypted with `password` unless it's empty """
+        key = bytes.fromhex(remove_0x(private_key))
+        address = EthereumKey(key=private_key).address
+        if password:
+            body = bytes([_ENCRYPTED]) + encrypt(password, key)
+        else:
+            body = bytes([0]) + bytes(IV_LEN) + key
+        return address, KeystoreFile._address_bytes(address) + body
+
+    def close(self):
+        with self._lock:
+            for mapped in (self._map, self._index):
+                if mapped is not None:
+                    mapped.close()
+            self._map, self._index, self._versions, self._unindexed = None, None, (None, None), {}
+
+
+def is_keystore_file(path: str) -> bool:
+    """ A keystore file holding many keys, rather than a keystore directory with one """
+    return os.path.isfile(path) or str(path).endswith(KEYSTORE_FILE_SUFFIX)
+
+
+def open_keystore_file(path: str, password: str = '', create: bool = True, address: str = None) -> EthereumKey:
+    """ The key for `address` from a keystore file -- or, without an address, a new key added to it if `create` """
+    keystore = KeystoreFile(path)
+    try:
+        if address is None:
+            if not create:
+                raise ValueError(f'{path} holds many keys, an address is needed to open one')
+            private_key, _ = get_eth_address()
+            address = keystore.add(private_key, password)
+            logger.info(f'Done! New address is {address}')
+        key = keystore.get(address, password)
+    finally:
+        keystore.close()
+    logger.info(f'Loaded key from keystore file {path}, ethereum address: {key.address}')
+    return key
+
+
+def open_keystore(path: str, config: UserDict, password: str = '', create: bool = True,
+                  address: str = None) -> EthereumKey:
+    """ crypto.open_eth_keystore for a keystore directory, open_keystore_file for a keystore file """
+    if is_keystore_file(path):
+        return open_keystore_file(str(path), password, create, address)
+    return open_eth_keystore(path, config, password, create)
+
+
+@dataclass(frozen=True)
+class GenerationReport:
+    # address -> keystore directory, of every keystore in the output directory
+    index: Dict[str, str]
+    generated: int
+    seconds: float
+    index_path: str
+
+    @property
+    def keys_per_second(self) -> float:
+        return self.generated / self.seconds if self.seconds else 0.0
+
+
+def _has_keystore(directory: str) -> bool:
+    """ Both files are there -- a directory with only one of them is written again """
+    return all((pathlib.Path(directory) / name).exists() for name in (PRIVATE_KEY_NAME, ETHER_ADDRESS_NAME))
+
+
+def _keystore(directory: str, password: str) -> Tuple[str, str]:
+    """ Creates the keystore in `directory`, unless it already has one. Returns (address, directory) """
+    privkey_path = pathlib.Path(directory) / PRIVATE_KEY_NAME
+    pubkey_path = pathlib.Path(directory) / ETHER_ADDRESS_NAME
+    if _has_keystore(directory):
+        return pubkey_path.read_text(), directory
+    _, address = _create_keystore(privkey_path, pubkey_path, password)
+    return address, directory
+
+
+def generate_keystores(n: int, out_dir: str, password: str = '', workers: Optional[int] = None) -> GenerationReport:
+    """ Creates keystores 0 to n-1 in numbered directories under `out_dir`, on `workers` processes (one per core by
+    default), and writes their index. Keystores that already exist are kept, so an interrupted run can be resumed """
+    workers = workers or os.cpu_count() or 1
+    directories = [os.path.join(out_dir, f'{i:05d}') for i in range(n)]
+    existing = sum(_has_keystore(d) for d in directories)
+
+    start = time.perf_counter()
+    if workers == 1:
+        results = [_keystore(directory, password) for directory in directories]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_keystore, directories, itertools.repeat(password),
+                                        chunksize=max(1, n // (workers * 4))))
+    seconds = time.perf_counter() - start
+
+    index = dict(results)
+    index_path = os.path.join(out_dir, INDEX_NAME)
+    os.makedirs(out_dir, exist_ok=True)
+    with open(f'{index_path}.part', 'w') as f:
+        json.dump(index, f, indent=1)
+    os.replace(f'{index_path}.part', index_path)
+
+    report = GenerationReport(index, n - existing, seconds, index_path)
+    logger.info(f'Generated {report.generated} keystores in {seconds:.2f}s on {workers} processes '
+                f'({report.keys_per_second:.1f}/s), {existing} already existed. Index: {index_path}')
+    return report
+
+
+def _new_record(password: str) -> Tuple[str, bytes]:
+    private_key, _ = get_eth_address()
+    return KeystoreFile.record(private_key, password)
+
+
+def generate_keystore_file(n: int, path: str, password: str = '', workers: Optional[int] = None) -> GenerationReport:
+    """ Adds n new keys to the keystore file at `path` (creating it if needed), generated and encrypted on `workers`
+    processes. The report's index maps the new addresses to the file """
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    if workers == 1:
+        records = [_new_record(password) for _ in range(n)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            records = list(executor.map(_new_record, itertools.repeat(password, n),
+                                        chunksize=max(1, n // (workers * 4))))
+    KeystoreFile(path).append(records)
+    seconds = time.perf_counter() - start
+
+    report = GenerationReport({address: path for address, _ in records}, n, seconds, path)
+    logger.info(f'Generated {n} keys in {seconds:.2f}s on {workers} processes ({report.keys_per_second:.1f}/s) '
+                f'into {path}')
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate ethereum keystores for many workers')
+    parser.add_argument('count', type=int, help='how many keystores')
+    parser.add_argument('out', help=f'directory to create them in, or a keystore file (*{KEYSTORE_FILE_SUFFIX}) to add '
+                                    f'them to')
+    parser.add_argument('--password', default=os.getenv('PASSWORD', ''), help='to encrypt the private keys with')
+    parser.add_argument('--workers', type=int, default=None, help='processes to use, one per core by default')
+    args = parser.parse_args()
+
+    if args.out.endswith(KEYSTORE_FILE_SUFFIX):
+        report = generate_keystore_file(args.count, args.out, args.password, workers=args.workers)
+    else:
+        report = generate_keystores(args.count, args.out, args.password, workers=args.workers)
+    print(f'{report.generated} keys in {report.seconds:.2f}s ({report.keys_per_second:.1f}/s), '
+          f'index at {report.index_path}')
+
+
+if __name__ == '__main__':
+    main()
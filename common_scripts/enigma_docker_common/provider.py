@@ -1,19 +1,115 @@
-import functools
+import argparse
 import io
 import os
+import threading
+import time
 import zipfile
-from collections.abc import MutableMapping
-from typing import Dict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+import requests
 
 from . import storage
+from .artifacts import ContractArtifact
+from .async_storage import AsyncAzureContainerFileService, AsyncHttpFileService, ConcurrentContainer
+from .config import Config
 from .logger import get_logger
+from .snapshot import SnapshotContainer, write_snapshot
 
 logger = get_logger('enigma_common.provider')
 
 
+@dataclass(frozen=True)
+class PrefetchResult:
+    name: str
+    seconds: float
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+# environments whose artifacts come from our own discovery servers, and those that use Azure blob storage
+HTTP_ENVS = ('COMPOSE', 'COMPOSE_DEV', 'K8S')
+AZURE_ENVS = ('TESTNET', 'MAINNET')
+
+
+class BackendRegistry:
+    """ Process-wide registry of storage backends, and of the artifacts resolved through them
+
+    A backend is only created the first time it's used, so only the current environment's are ever built. Backends
+    and artifacts are shared by every Provider with the same settings, so each artifact is fetched once per process
+    however many Providers ask for it, until `invalidate` """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._backends: Dict[tuple, Optional[storage.IndexableContainer]] = {}
+        self._artifacts: Dict[tuple, Any] = {}
+        self._loading: Dict[tuple, threading.Lock] = {}
+
+    def backend(self, key: tuple, create: Callable[[], Optional[storage.IndexableContainer]]) \
+            -> Optional[storage.IndexableContainer]:
+        with self._lock:
+            if key not in self._backends:
+                self._backends[key] = create()
+            return self._backends[key]
+
+    def artifact(self, key: tuple, load: Callable[[], Any]) -> Any:
+        """ Returns the artifact, loading it the first time. Concurrent requests for the same artifact share a
+        single load; if it fails, the next request tries again """
+        with self._lock:
+            if key in self._artifacts:
+                return self._artifacts[key]
+            loading = self._loading.setdefault(key, threading.Lock())
+        with loading:
+            with self._lock:
+                if key in self._artifacts:
+                    return self._artifacts[key]
+            value = load()
+            self.put(key, value)
+            return value
+
+    def get(self, key: tuple) -> Optional[Any]:
+        """ The artifact, if it was already resolved """
+        with self._lock:
+            return self._artifacts.get(key)
+
+    def put(self, key: tuple, value: Any):
+        with self._lock:
+            self._artifacts[key] = value
+            self._loading.pop(key, None)
+
+    def invalidate(self):
+        """ Forgets every resolved artifact, refreshes the discovery bundles, and makes anything cached on disk
+        revalidate on its next read """
+        with self._lock:
+            self._artifacts.clear()
+            backends = [fs for fs in self._backends.values() if fs is not None]
+        for fs in backends:
+            expire = getattr(fs, 'expire', None)
+            if expire is not None:
+                expire()
+            bundle = getattr(fs, 'bundle', None)
+            if bundle is not None:
+                bundle.refresh()
+
+
+registry = BackendRegistry()
+
+
 class Provider:
-    #  pylint: disable=too-many-statements,too-many-instance-attributes
-    def __init__(self, config: MutableMapping):
+    #  pylint: disable=too-many-instance-attributes
+    # everything prefetch can fetch
+    ARTIFACTS = ('enigma_contract_address', 'token_contract_address', 'voting_contract_address',
+                 'sample_contract_address', 'principal_address', 'enigma_abi', 'enigma_token_abi', 'key_management_abi',
+                 'enigma_artifact', 'enigma_token_artifact')
+    # what a snapshot holds by default -- the full build files only on request
+    SNAPSHOT_ARTIFACTS = ('enigma_contract_address', 'token_contract_address', 'voting_contract_address',
+                          'sample_contract_address', 'principal_address', 'enigma_artifact', 'enigma_token_artifact')
+
+    def __init__(self, config: Mapping):
         self.config = config
 
         self.CONTRACT_DISCOVERY_ADDRESS = config.get('CONTRACT_DISCOVERY_ADDRESS', '')
@@ -45,104 +141,277 @@ class Provider:
             self._enigma_contract_abi_filename = config.get('ENIGMA_CONTRACT_ABI_FILENAME', 'Enigma.json')
             self._enigma_contract_abi_filename_zip = config.get('ENIGMA_CONTRACT_ABI_FILENAME_ZIPPED', 'Enigma_v2.zip')
 
-        # strategy for information we get from enigma-contract
-        contract_timeout = self.config.get("CONTRACT_TIMEOUT", 120)
-        self.contract_strategy = {"COMPOSE": storage.HttpFileService(self.CONTRACT_DISCOVERY_ADDRESS,
-                                                                     timeout=contract_timeout),
-                                  "COMPOSE_DEV": storage.HttpFileService(self.CONTRACT_DISCOVERY_ADDRESS,
-                                                                         timeout=contract_timeout),
-                                  "K8S": storage.HttpFileService(self.CONTRACT_DISCOVERY_ADDRESS,
-                                                                 timeout=contract_timeout),
-                                  "TESTNET": storage.AzureContainerFileService('contract'),
-                                  "MAINNET": storage.AzureContainerFileService('contract')}
-
-        timeout = self.config.get("KEY_MANAGEMENT_TIMEOUT", 120)
-        self.key_management_discovery = {"COMPOSE": storage.HttpFileService(self.KM_DISCOVERY_ADDRESS,
-                                                                            namespace='km',
-                                                                            timeout=timeout),
-                                         "COMPOSE_DEV": storage.HttpFileService(self.KM_DISCOVERY_ADDRESS,
-                                                                                namespace='km',
-                                                                                timeout=timeout),
-                                         "K8S": storage.HttpFileService(self.KM_DISCOVERY_ADDRESS,
-                                                                        namespace='km',
-                                                                        timeout=timeout),
-                                         "TESTNET": storage.AzureContainerFileService('public'),
-                                         "MAINNET": storage.AzureContainerFileService('public')}
-
-        # information stored in global storage
-        self.backend_strategy: Dict[str, storage.IndexableContainer[bytes]] = \
-            {"COMPOSE": storage.HttpFileService(self.CONTRACT_DISCOVERY_ADDRESS, directory='abi'),
-             "COMPOSE_DEV": storage.HttpFileService(self.CONTRACT_DISCOVERY_ADDRESS, directory='abi'),
-             "K8S": storage.HttpFileService(self.CONTRACT_DISCOVERY_ADDRESS, directory='abi'),
-             "TESTNET": storage.AzureContainerFileService(self._km_abi_directory),
-             "MAINNET": storage.AzureContainerFileService(self._km_abi_directory)}
-
-        self._enigma_abi = None
-        self._enigma_token_abi = None
-        self._enigma_contract_address = None
-        self._principal_address = None
-        self._token_contract_address = None
-        self._key_management_abi = None
-
-    @property  # type: ignore
-    @functools.lru_cache()
+        self._contract_timeout = config.get("CONTRACT_TIMEOUT", 120)
+        self._km_timeout = config.get("KEY_MANAGEMENT_TIMEOUT", 120)
+        # timeouts and retries for each request to the discovery services
+        self._http_options: Dict[str, Any] = {'connect_timeout': float(config.get('DISCOVERY_CONNECT_TIMEOUT', 5)),
+                                              'read_timeout': float(config.get('DISCOVERY_READ_TIMEOUT', 30)),
+                                              'retries': int(config.get('DISCOVERY_RETRIES', 3))}
+        # keep what we download on disk, so restarts don't fetch artifacts that haven't changed
+        self._cache_dir = config.get('ARTIFACT_CACHE_DIR', '')
+        self._cache_ttl = float(config.get('ARTIFACT_CACHE_TTL', 3600))
+        # serve whatever is in this snapshot file (see snapshot.py) without asking the discovery services
+        self._snapshot_path = config.get('ARTIFACT_SNAPSHOT', '')
+
+        # everything that decides which backends we use and what they return. Providers with the same settings share
+        # backends and artifacts
+        self._settings = (self.CONTRACT_DISCOVERY_ADDRESS, self.KM_DISCOVERY_ADDRESS, self._contract_timeout,
+                          self._km_timeout, tuple(sorted(self._http_options.items())), self._cache_dir,
+                          self._cache_ttl, self._snapshot_path, self._enigma_contract_filename, self._token_contract_filename,
+                          self._voting_contract_filename, self._sample_contract_filename,
+                          self._principal_address_filename, self._enigma_token_abi_filename,
+                          self._enigma_token_abi_filename_zip, self._km_abi_directory, self._km_abi_filename,
+                          self._km_abi_filename_local, self._enigma_contract_abi_filename,
+                          self._enigma_contract_abi_filename_zip)
+
+    @staticmethod
+    def _env() -> str:
+        return os.getenv('ENIGMA_ENV', 'COMPOSE')
+
+    def _backend(self, kind: str) -> Optional[storage.IndexableContainer]:
+        """ The backend for `kind` ('contract', 'km', 'abi' or 'artifact') in the current environment. None if the
+        environment doesn't have one """
+        env = self._env()
+        return registry.backend((kind, env) + self._settings, lambda: self._create_backend(kind, env))
+
+    def _create_backend(self, kind: str, env: str) -> Optional[storage.IndexableContainer]:
+        fs: Optional[storage.IndexableContainer]
+        # get_many (see prefetch) runs on the async version of each backend, with the same settings
+        if env in HTTP_ENVS:
+            if kind == 'km':
+                url = self.KM_DISCOVERY_ADDRESS
+                options = dict(namespace='km', timeout=self._km_timeout, **self._http_options)
+            else:
+                url = self.CONTRACT_DISCOVERY_ADDRESS
+                directory = {'contract': 'address', 'abi': 'abi', 'artifact': 'artifact'}[kind]
+                timeout = self._contract_timeout if kind == 'contract' else 60
+                options = dict(directory=directory, timeout=timeout, bundle=self._bundle(), **self._http_options)
+            fs = ConcurrentContainer(storage.HttpFileService(url, **options), AsyncHttpFileService(url, **options))
+        elif env in AZURE_ENVS:
+            # slim artifacts aren't published to blob storage -- they are derived from the full build files
+            container = {'contract': 'contract', 'km': 'public', 'abi': self._km_abi_directory}.get(kind)
+            fs = None if container is None else ConcurrentContainer(storage.AzureContainerFileService(container),
+                                                                    AsyncAzureContainerFileService(container))
+        else:
+            raise KeyError(f'Unknown environment: {env}')
+
+        if fs is not None and self._cache_dir:
+            fs = storage.CachedContainer(fs, self._cache_dir, namespace=f'{env}/{kind}', ttl=self._cache_ttl)
+        if self._snapshot_path:
+            fs = SnapshotContainer(self._snapshot_path, kind, fallback=fs)
+        return fs
+
+    def _bundle(self) -> Optional[storage.DiscoveryBundle]:
+        """ every address and ABI we need from enigma-contract comes in one request, shared by the whole process """
+        if not self.CONTRACT_DISCOVERY_ADDRESS:
+            return None
+        return storage.discovery_bundle(self.CONTRACT_DISCOVERY_ADDRESS,
+                                        abis=[self._enigma_contract_abi_filename, self._km_abi_filename_local],
+                                        artifacts=[self._enigma_contract_abi_filename, self._enigma_token_abi_filename],
+                                        timeout=self._contract_timeout, **self._http_options)
+
+    def _artifact(self, name: str, load: Callable[[], Any]) -> Any:
+        return registry.artifact((name, self._env()) + self._settings, load)
+
+    @staticmethod
+    def invalidate():
+        """ Forgets every artifact the process has resolved, so each is fetched again the next time it's used (and
+        revalidated, if it is cached on disk). Call after contracts were redeployed or keys rotated """
+        registry.invalidate()
+
+    def prefetch(self, names: Iterable[str] = ARTIFACTS, max_workers: int = 8) -> Dict[str, PrefetchResult]:
+        """ Resolves the named artifacts (property names) concurrently, so that using them afterwards doesn't wait on
+        the network, and startup pays for the slowest fetch instead of all of them in a row
+
+        Errors are reported in the results rather than raised -- reading the property again retries, and raises
+        """
+        names = list(names)
+        unknown = set(names) - set(self.ARTIFACTS)
+        if unknown:
+            raise ValueError(f'Unknown artifacts: {", ".join(sorted(unknown))}')
+
+        def load(name: str) -> PrefetchResult:
+            start = time.monotonic()
+            try:
+                getattr(self, name)
+            except Exception as e:  # pylint: disable=broad-except
+                return PrefetchResult(name, time.monotonic() - start, e)
+            return PrefetchResult(name, time.monotonic() - start)
+
+        start = time.monotonic()
+        results = self._prefetch_addresses(names)
+        rest = [name for name in names if name not in results]
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(rest))),
+                                thread_name_prefix='prefetch') as executor:
+            results.update((result.name, result) for result in executor.map(load, rest))
+        for result in results.values():
+            if result.ok:
+                logger.debug(f'Prefetched {result.name} in {result.seconds:.2f}s')
+            else:
+                logger.warning(f'Failed to prefetch {result.name} after {result.seconds:.2f}s: {result.error}')
+        logger.info(f'Prefetched {sum(r.ok for r in results.values())}/{len(results)} artifacts '
+                    f'in {time.monotonic() - start:.2f}s')
+        return results
+
+    def _prefetch_addresses(self, names: Iterable[str]) -> Dict[str, PrefetchResult]:
+        """ Addresses are files as they are, so those from the same backend are fetched with one get_many --
+        concurrently, on the async backend """
+        sources = self._sources()
+        by_kind: Dict[str, Dict[str, str]] = {}
+        for name in names:
+            kind, filename = sources[name]
+            if kind in ('contract', 'km') and registry.get((name, self._env()) + self._settings) is None:
+                by_kind.setdefault(kind, {})[filename] = name
+
+        results: Dict[str, PrefetchResult] = {}
+        for kind, files in by_kind.items():
+            fs = self._backend(kind)
+            if fs is None:
+                continue
+            start = time.monotonic()
+            values = fs.get_many(files, return_exceptions=True)
+            seconds = time.monotonic() - start
+            for filename, name in files.items():
+                value = values[filename]
+                if isinstance(value, Exception):
+                    results[name] = PrefetchResult(name, seconds, value)
+                    continue
+                registry.put((name, self._env()) + self._settings,
+                             self._as_str(value) if kind == 'contract' else value)
+                results[name] = PrefetchResult(name, seconds)
+        return results
+
+    @property
     def key_management_abi(self):
         filename = self._km_abi_filename_local if os.getenv('ENIGMA_ENV', '') in ['COMPOSE', 'K8S'] \
             else self._km_abi_filename
-        return self.get_file(file_name=filename)
+        return self._artifact('key_management_abi', lambda: self.get_file(file_name=filename))
 
-    @property  # type: ignore
-    @functools.lru_cache()
+    @property
     def enigma_contract_address(self):
-        return self._deployed_contract_address(contract_name=self._enigma_contract_filename)
+        return self._artifact('enigma_contract_address',
+                              lambda: self._deployed_contract_address(contract_name=self._enigma_contract_filename))
 
-    @property  # type: ignore
-    @functools.lru_cache()
+    @property
     def token_contract_address(self):
-        return self._deployed_contract_address(contract_name=self._token_contract_filename)
+        return self._artifact('token_contract_address',
+                              lambda: self._deployed_contract_address(contract_name=self._token_contract_filename))
 
-    @property  # type: ignore
-    @functools.lru_cache()
+    @property
     def voting_contract_address(self):
-        return self._deployed_contract_address(contract_name=self._voting_contract_filename)
+        return self._artifact('voting_contract_address',
+                              lambda: self._deployed_contract_address(contract_name=self._voting_contract_filename))
 
-    @property  # type: ignore
-    @functools.lru_cache()
+    @property
     def sample_contract_address(self):
-        return self._deployed_contract_address(contract_name=self._sample_contract_filename)
+        return self._artifact('sample_contract_address',
+                              lambda: self._deployed_contract_address(contract_name=self._sample_contract_filename))
 
-    @property  # type: ignore
-    @functools.lru_cache()
+    @property
     def principal_address(self):
-        fs = self.key_management_discovery[os.getenv('ENIGMA_ENV', 'COMPOSE')]
-        return fs[self._principal_address_filename]
+        return self._artifact('principal_address',
+                              lambda: self._backend('km')[self._principal_address_filename])  # type: ignore
 
-    @property  # type: ignore
-    @functools.lru_cache()
+    @property
     def enigma_abi(self):
         filename = self._enigma_contract_abi_filename if os.getenv('ENIGMA_ENV', '') in ['COMPOSE', 'K8S'] \
             else self._enigma_contract_abi_filename_zip
-        file = self.get_file(file_name=filename)
-        try:
-            return self._unzip_bytes(file, self._enigma_contract_abi_filename)
-        except (zipfile.BadZipFile, TypeError, ValueError):
-            return file
+        return self._artifact('enigma_abi', lambda: self._build_file(filename, self._enigma_contract_abi_filename))
 
-    @property  # type: ignore
-    @functools.lru_cache()
+    @property
     def enigma_token_abi(self):
         filename = self._enigma_token_abi_filename if os.getenv('ENIGMA_ENV', '') in ['COMPOSE', 'K8S'] \
             else self._enigma_token_abi_filename_zip
+        return self._artifact('enigma_token_abi', lambda: self._build_file(filename, self._enigma_token_abi_filename))
+
+    def _build_file(self, filename: str, unzipped_filename: str) -> bytes:
         file = self.get_file(file_name=filename)
         try:
-            return self._unzip_bytes(file, self._enigma_token_abi_filename)
+            return self._unzip_bytes(file, unzipped_filename)
         except (zipfile.BadZipFile, TypeError, ValueError):
             return file
 
+    @property
+    def enigma_artifact(self) -> ContractArtifact:
+        """ ABI, function selectors and addresses of the Enigma contract, without the rest of its build file """
+        return self._artifact('enigma_artifact',
+                              lambda: self._contract_artifact(self._enigma_contract_abi_filename,
+                                                              lambda: self.enigma_abi))
+
+    @property
+    def enigma_token_artifact(self) -> ContractArtifact:
+        """ ABI, function selectors and addresses of the Enigma token contract, without the rest of its build file """
+        return self._artifact('enigma_token_artifact',
+                              lambda: self._contract_artifact(self._enigma_token_abi_filename,
+                                                              lambda: self.enigma_token_abi))
+
+    def _contract_artifact(self, filename: str, build: Callable[[], bytes]) -> ContractArtifact:
+        fs = self._backend('artifact')
+        if fs is not None:
+            try:
+                artifact, _ = fs.fetch(filename)  # type: ignore  # never None without validators
+                return ContractArtifact.from_dict(artifact)
+            except (IndexError, KeyError, requests.exceptions.RequestException) as e:
+                logger.info(f'No slim artifact for {filename} ({e}), using the full build file')
+        return ContractArtifact.from_build(build())
+
+    def wait_for(self, name: str, timeout: float = None):
+        """ Blocks until an artifact is published and returns it. `name` is one of the address properties, like
+        'enigma_contract_address' or 'principal_address'. Discovery servers hold the request until the artifact
+        exists, so this returns as soon as it does; other backends are polled. Raises TimeoutError """
+        kind, filename = self._sources().get(name, ('', ''))
+        if kind not in ('contract', 'km'):
+            raise ValueError(f'Unknown artifact: {name}')
+        resolved = registry.get((name, self._env()) + self._settings)
+        if resolved is not None:
+            return resolved
+        logger.info(f'Waiting for {filename} to be published...')
+        value, _ = self._backend(kind).watch(filename, timeout=timeout)  # type: ignore
+        if isinstance(value, (bytes, bytearray)):
+            value = value.decode()
+        # whoever asks next gets what we waited for
+        registry.put((name, self._env()) + self._settings, value)
+        return value
+
+    def _sources(self) -> Dict[str, Tuple[str, str]]:
+        """ property name -> the backend and file name it is read from """
+        local = os.getenv('ENIGMA_ENV', '') in ['COMPOSE', 'K8S']
+        return {'enigma_contract_address': ('contract', self._enigma_contract_filename),
+                'token_contract_address': ('contract', self._token_contract_filename),
+                'voting_contract_address': ('contract', self._voting_contract_filename),
+                'sample_contract_address': ('contract', self._sample_contract_filename),
+                'principal_address': ('km', self._principal_address_filename),
+                'enigma_abi': ('abi', self._enigma_contract_abi_filename if local
+                               else self._enigma_contract_abi_filename_zip),
+                'enigma_token_abi': ('abi', self._enigma_token_abi_filename if local
+                                     else self._enigma_token_abi_filename_zip),
+                'key_management_abi': ('abi', self._km_abi_filename_local if local else self._km_abi_filename),
+                'enigma_artifact': ('artifact', self._enigma_contract_abi_filename),
+                'enigma_token_artifact': ('artifact', self._enigma_token_abi_filename)}
+
+    def write_snapshot(self, path: str, with_abi: bool = False) -> Dict[str, PrefetchResult]:
+        """ Writes everything this Provider would look up to a snapshot file, for Providers configured with
+        ARTIFACT_SNAPSHOT=<path> to read instead of the discovery services. Artifacts that can't be resolved right
+        now are left out -- readers fetch those as usual """
+        names = self.SNAPSHOT_ARTIFACTS + (('enigma_abi', 'enigma_token_abi', 'key_management_abi') if with_abi else ())
+        results = self.prefetch(names)
+        sources = self._sources()
+        entries: Dict[str, Dict[str, Any]] = {}
+        for name, result in results.items():
+            if not result.ok:
+                continue
+            value = getattr(self, name)
+            if isinstance(value, ContractArtifact):
+                value = value.to_dict()
+            kind, filename = sources[name]
+            entries.setdefault(kind, {})[filename] = value
+        write_snapshot(path, entries, env=self._env())
+        return results
+
     def get_file(self, file_name: str) -> bytes:
-        fs = self.backend_strategy[os.getenv('ENIGMA_ENV', 'COMPOSE')]
+        fs = self._backend('abi')
         try:
-            file = fs[file_name]
+            file = fs[file_name]  # type: ignore
             if isinstance(file, str):
                 return file.encode()
             return file
@@ -154,9 +423,11 @@ class Provider:
             raise FileNotFoundError from None
 
     def _deployed_contract_address(self, contract_name):
-        fs = self.contract_strategy[os.getenv('ENIGMA_ENV', 'COMPOSE')]
-        address = fs[contract_name]
-        if isinstance(address, bytes):
+        return self._as_str(self._backend('contract')[contract_name])  # type: ignore
+
+    @staticmethod
+    def _as_str(address):
+        if isinstance(address, (bytes, bytearray)):
             return address.decode()
         return address
 
@@ -165,3 +436,18 @@ class Provider:
         """ unzip a file to a path """
         with zipfile.ZipFile(io.BytesIO(file_bytes), "r") as zip_ref:
             return zip_ref.read(file_name)
+
+
+def main():
+    """ Writes a snapshot (see snapshot.py) of the artifacts for this environment """
+    parser = argparse.ArgumentParser(description='Write a snapshot of the discovery artifacts for this environment')
+    parser.add_argument('path', help='where to write the snapshot')
+    parser.add_argument('--with-abi', action='store_true', help='include the full contract build files too')
+    args = parser.parse_args()
+
+    provider = Provider(config=Config())
+    provider.write_snapshot(args.path, with_abi=args.with_abi)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+""" Waiting for the services we depend on to come up
+
+Targets are either plain TCP ("host:port", "tcp://host:port"), which are ready once they accept a connection, or
+HTTP ("http://host:port/health"), which are ready once they answer with anything but a 5xx. All the targets are
+probed concurrently, each with its own exponential backoff (with jitter), under one overall deadline.
+
+Once a target has been seen up it is remembered for the rest of the process, so waiting on it again is free.
+"""
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, Set, Union
+from urllib.parse import urlparse
+
+import requests
+
+from .logger import get_logger
+
+logger = get_logger('enigma_common.readiness')
+
+__all__ = ['Target', 'probe', 'is_ready', 'wait_for', 'forget']
+
+# seconds to wait for a single connection attempt or health check
+PROBE_TIMEOUT = 2.0
+
+
+@dataclass(frozen=True)
+class Target:
+    host: str
+    port: int
+    url: str = ''  # HTTP health check url. Empty for a plain TCP connect
+
+    @classmethod
+    def parse(cls, target: str) -> 'Target':
+        if '://' not in target:
+            target = f'tcp://{target}'
+        p = urlparse(target)
+        if not p.hostname:
+            raise ValueError(f'Invalid target: {target}')
+        if p.scheme == 'tcp':
+            if not p.port:
+                raise ValueError(f'TCP target must have a port: {target}')
+            return cls(p.hostname, p.port)
+        if p.scheme in ('http', 'https'):
+            return cls(p.hostname, p.port or (443 if p.scheme == 'https' else 80), target)
+        raise ValueError(f'Unsupported scheme for target: {target}')
+
+    @classmethod
+    def endpoint(cls, url: str) -> 'Target':
+        """ TCP target for the host and port of a url """
+        p = urlparse(url)
+        return cls(p.hostname or '', p.port or (443 if p.scheme == 'https' else 80))
+
+    def __str__(self):
+        return self.url or f'{self.host}:{self.port}'
+
+
+TargetLike = Union[Target, str]
+
+_ready: Set[Target] = set()
+_ready_lock = threading.Lock()
+
+
+def _target(target: TargetLike) -> Target:
+    return target if isinstance(target, Target) else Target.parse(target)
+
+
+def probe(target: TargetLike, timeout: float = PROBE_TIMEOUT) -> bool:
+    """ Checks a target once, ignoring the cache """
+    target = _target(target)
+    if not target.url:
+        try:
+            with socket.create_connection((target.host, target.port), timeout=timeout):
+                return True
+        except OSError:
+            return False
+    try:
+        return requests.get(target.url, timeout=timeout).status_code < 500
+    except requests.exceptions.RequestException:
+        return False
+
+
+def is_ready(target: TargetLike) -> bool:
+    """ True if the target was already seen up, otherwise probes it once """
+    target = _target(target)
+    if target in _ready:
+        return True
+    if probe(target):
+        with _ready_lock:
+            _ready.add(target)
+        return True
+    return False
+
+
+def forget(target: TargetLike = None):
+    """ Drops a target (or all of them) from the cache, for example after its service was restarted """
+    with _ready_lock:
+        if target is None:
+            _ready.clear()
+        else:
+            _ready.discard(_target(target))
+
+
+def _wait_one(target: Target, deadline: Optional[float], backoff: float, max_backoff: float) -> bool:
+    attempt = 0
+    while True:
+        if is_ready(target):
+            return True
+        delay = min(max_backoff, backoff * 2 ** attempt)
+        delay = random.uniform(delay / 2, delay)
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            delay = min(delay, remaining)
+        if attempt == 0:
+            logger.info(f'Waiting for {target}...')
+        time.sleep(delay)
+        attempt += 1
+
+
+def wait_for(*targets: TargetLike, timeout: Optional[float] = 60, backoff: float = 0.5, max_backoff: float = 5):
+    """ Waits until all the targets are up, probing them concurrently
+
+    :param timeout: overall deadline in seconds for all the targets together. None waits forever
+    :param backoff: delay after the first failed probe of a target. Doubles after each failure, with jitter
+    :param max_backoff: longest delay between two probes of the same target
+    :raises TimeoutError: listing the targets that didn't come up in time
+    """
+    pending = [target for target in map(_target, targets) if target not in _ready]
+    if not pending:
+        return
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with ThreadPoolExecutor(max_workers=len(pending), thread_name_prefix='readiness') as executor:
+        results = executor.map(lambda target: _wait_one(target, deadline, backoff, max_backoff), pending)
+        failed = [str(target) for target, ready in zip(pending, results) if not ready]
+    if failed:
+        raise TimeoutError(f'Timeout waiting for {", ".join(failed)}')
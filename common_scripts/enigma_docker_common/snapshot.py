@@ -0,0 +1,183 @@
+""" Snapshot of everything Provider looks up, in a single file
+
+A snapshot holds the contract addresses, slim contract artifacts (and optionally the full build files) and the
+principal address, so that a Provider pointed at it (ARTIFACT_SNAPSHOT=<path>) starts without asking the discovery
+services anything. Mounted on a shared volume, every container on a host reads the same file, and since it is read
+through mmap, the same page cache copy of it.
+
+File layout:
+    8 bytes   magic, b'ENIGSNAP'
+    4 bytes   header length, little endian
+    header    JSON: {"format": 1, "created": <unix time>, "env": ..., "entries": {kind: {name: [offset, length, type]}}}
+    payloads  one after the other. Offsets are relative to the first one
+
+Kinds are the Provider's backends: 'contract' (addresses), 'km' (principal address), 'artifact' and 'abi'.
+
+Provider.write_snapshot writes one, also from the command line:
+    python -m enigma_docker_common.provider <output path> [--with-abi]
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from .logger import get_logger
+from .storage import IndexableContainer
+
+logger = get_logger('enigma_common.snapshot')
+
+MAGIC = b'ENIGSNAP'
+FORMAT = 1
+_PREFIX = struct.Struct('<8sI')
+
+
+def _encode(value: Any) -> Tuple[bytes, str]:
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value), 'bytes'
+    if isinstance(value, str):
+        return value.encode(), 'str'
+    return json.dumps(value).encode(), 'json'
+
+
+def _decode(data: bytes, kind: str) -> Any:
+    if kind == 'bytes':
+        return data
+    if kind == 'str':
+        return data.decode()
+    return json.loads(data)
+
+
+def write_snapshot(path: str, entries: Dict[str, Dict[str, Any]], env: str = ''):
+    """ Writes {kind: {name: value}} to a snapshot file. Replaces an existing file atomically, so processes that
+    have the old one open keep reading it undisturbed """
+    index: Dict[str, Dict[str, list]] = {}
+    payloads = []
+    offset = 0
+    for kind, items in entries.items():
+        for name, value in items.items():
+            data, value_type = _encode(value)
+            index.setdefault(kind, {})[name] = [offset, len(data), value_type]
+            payloads.append(data)
+            offset += len(data)
+    header = json.dumps({'format': FORMAT, 'created': time.time(), 'env': env, 'entries': index}).encode()
+
+    partial = f'{path}.{os.getpid()}.part'
+    with open(partial, 'wb') as f:
+        f.write(_PREFIX.pack(MAGIC, len(header)))
+        f.write(header)
+        for data in payloads:
+            f.write(data)
+    os.replace(partial, path)
+    logger.info(f'Wrote snapshot of {sum(len(items) for items in index.values())} artifacts '
+                f'({_PREFIX.size + len(header) + offset} bytes) to {path}')
+
+
+class Snapshot:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = _PREFIX.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f'Not a snapshot file: {path}')
+        header = json.loads(self._map[_PREFIX.size:_PREFIX.size + header_length])
+        if header['format'] != FORMAT:
+            raise ValueError(f'Unsupported snapshot format {header["format"]}: {path}')
+        self.created: float = header['created']
+        self.env: str = header['env']
+        self.entries: Dict[str, Dict[str, list]] = header['entries']
+        self._base = _PREFIX.size + header_length
+
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        kind, name = key
+        return name in self.entries.get(kind, {})
+
+    def get(self, kind: str, name: str) -> Any:
+        try:
+            offset, length, value_type = self.entries[kind][name]
+        except KeyError:
+            raise IndexError(f'Value {name} not found in snapshot {self.path} ({kind})') from None
+        start = self._base + offset
+        return _decode(self._map[start:start + length], value_type)
+
+    def close(self):
+        self._map.close()
+
+
+_snapshots: Dict[str, Tuple[Tuple[int, int], Snapshot]] = {}
+_snapshots_lock = threading.Lock()
+
+
+def open_snapshot(path: str) -> Optional[Snapshot]:
+    """ The process-wide mapping of the snapshot at `path`, reopened if the file was replaced since. None if there is
+    no snapshot there """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    version = (st.st_mtime_ns, st.st_ino)
+    with _snapshots_lock:
+        cached = _snapshots.get(path)
+        if cached is None or cached[0] != version:
+            # the old mapping stays valid for whoever still holds it, until it's garbage collected
+            _snapshots[path] = (version, Snapshot(path))
+        return _snapshots[path][1]
+
+
+class SnapshotContainer(IndexableContainer[Any]):
+    """ Serves one kind of artifact from a snapshot file. Anything the snapshot doesn't have (or all of it, if the
+    file doesn't exist) comes from the fallback backend, if there is one """
+    def __init__(self, path: str, kind: str, fallback: Optional[IndexableContainer] = None):
+        self.path = path
+        self.kind = kind
+        self.fallback = fallback
+
+    def __getattr__(self, name):
+        if name == 'fallback':
+            raise AttributeError(name)
+        return getattr(self.fallback, name)
+
+    def _snapshot(self, key: str) -> Optional[Snapshot]:
+        snapshot = open_snapshot(self.path)
+        return snapshot if snapshot is not None and (self.kind, key) in snapshot else None
+
+    def _fallback(self, key: str) -> IndexableContainer:
+        if self.fallback is None:
+            raise IndexError(f'Value {key} not found in snapshot {self.path} ({self.kind})')
+        return self.fallback
+
+    def __getitem__(self, key: str) -> Any:
+        snapshot = self._snapshot(key)
+        if snapshot is not None:
+            return snapshot.get(self.kind, key)
+        return self._fallback(key)[key]
+
+    def __setitem__(self, key: str, value: Any):
+        self._fallback(key)[key] = value
+
+    def get_many(self, keys: Iterable[str], *, return_exceptions: bool = False) -> Dict[str, Any]:
+        """ What the snapshot doesn't have comes from the fallback's get_many, all together """
+        keys = list(keys)
+        fallback = self.fallback
+        missing = [key for key in keys if self._snapshot(key) is None] if fallback is not None else []
+        values = super().get_many([key for key in keys if key not in missing], return_exceptions=return_exceptions)
+        if fallback is not None and missing:
+            values.update(fallback.get_many(missing, return_exceptions=return_exceptions))
+        return {key: values[key] for key in keys}
+
+    def fetch(self, key: str, validators: dict = None) -> Optional[Tuple[Any, dict]]:
+        snapshot = self._snapshot(key)
+        if snapshot is not None:
+            return snapshot.get(self.kind, key), {}
+        return self._fallback(key).fetch(key, validators)
+
+    def watch(self, key: str, validators: dict = None, timeout: Optional[float] = None,
+              interval: float = None) -> Tuple[Any, dict]:
+        snapshot = self._snapshot(key)
+        if snapshot is not None and not validators:
+            return snapshot.get(self.kind, key), {}
+        kwargs = {} if interval is None else {'interval': interval}
+        return self._fallback(key).watch(key, validators, timeout=timeout, **kwargs)
@@ -1,13 +1,27 @@
+import fcntl
+import hashlib
+import io
+import json
 import os
-import socket
+import random
+import threading
 import time
+import weakref
+from contextlib import contextmanager
+from dataclasses import dataclass
 from pathlib import Path
 from urllib.parse import urlparse
-from typing import AnyStr, Any, Generic, TypeVar
+from typing import AnyStr, Any, Dict, Generic, Iterable, Optional, Set, Tuple, TypeVar, Union, cast
 
 import requests
-from azure.core.exceptions import ResourceNotFoundError
-from azure.storage.blob import BlobClient
+from azure.core.exceptions import AzureError, ResourceNotFoundError
+from azure.core.pipeline.transport import RequestsTransport
+from azure.storage.blob import BlobClient, BlobServiceClient, ContainerClient
+
+from . import readiness
+from .logger import get_logger
+
+logger = get_logger('enigma_common.storage')
 
 T = TypeVar('T')
 
@@ -19,55 +33,363 @@ class IndexableContainer(Generic[T]):
     def __setitem__(self, key: str, value: Any):
         pass
 
+    def fetch(self, key: str, validators: dict = None) -> Optional[Tuple[T, dict]]:  # pylint: disable=unused-argument
+        """ Conditional get. Returns None if the item still matches `validators` (as returned by an earlier fetch),
+        otherwise the item and its current validators (ETag and/or Last-Modified). Backends that can't tell just
+        return the item every time """
+        return self[key], {}
+
+    def get_many(self, keys: Iterable[str], *, return_exceptions: bool = False) -> Dict[str, Any]:
+        """ Fetches several items. Done one at a time here -- see async_storage.ConcurrentContainer for concurrent
+        fetches. Raises the first error, unless return_exceptions: then a failed item's value is its error, as with
+        asyncio.gather """
+        values: Dict[str, Any] = {}
+        for key in keys:
+            try:
+                values[key] = self[key]
+            except Exception as e:  # pylint: disable=broad-except
+                if not return_exceptions:
+                    raise
+                values[key] = e
+        return values
+
+    def watch(self, key: str, validators: dict = None, timeout: Optional[float] = None,
+              interval: float = 5) -> Tuple[T, dict]:
+        """ Blocks until the item exists -- or, given the validators of the version we already have, until it
+        changes -- and returns it like `fetch`. Polls every `interval` seconds here; backends that can be told about
+        changes override this. Raises TimeoutError """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                result = self.fetch(key, validators)
+                if result is not None:
+                    return result
+            except (IndexError, FileNotFoundError):
+                pass
+            if deadline is not None and time.monotonic() + interval > deadline:
+                raise TimeoutError(f'Timeout waiting for {key}')
+            time.sleep(interval)
+
+
+class AzureClientPool:
+    """ Process-wide pool of Azure container clients, keyed by account and container
+
+    All the containers of an account are created from one BlobServiceClient, so they share its pipeline, and all
+    accounts share one keep-alive HTTP session -- several fetches at startup cost one connection setup instead of
+    one each """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        self._services: Dict[Tuple[str, Optional[str]], BlobServiceClient] = {}
+        self._containers: Dict[Tuple[str, str, Optional[str]], ContainerClient] = {}
+
+    def container(self, account_url: str, container_name: str, credential: Optional[str] = None) -> ContainerClient:
+        key = (account_url, container_name, credential)
+        with self._lock:
+            if key not in self._containers:
+                service = self._services.get((account_url, credential))
+                if service is None:
+                    service = BlobServiceClient(account_url=account_url, credential=credential,
+                                                transport=RequestsTransport(session=self._session))
+                    self._services[(account_url, credential)] = service
+                self._containers[key] = service.get_container_client(container_name)
+            return self._containers[key]
+
+    def blob(self, account_url: str, container_name: str, blob_name: str, credential: Optional[str] = None) -> BlobClient:
+        return self.container(account_url, container_name, credential).get_blob_client(blob_name)
+
+    def clear(self):
+        """ Drops all pooled clients and closes their connections """
+        with self._lock:
+            self._services.clear()
+            self._containers.clear()
+            self._session.close()
+            self._session = requests.Session()
+
+
+client_pool = AzureClientPool()
+
 
-class AzureContainerFileService(IndexableContainer[bytes]):
-    def __init__(self, directory: str):
+class _BufferWriter:
+    """ Seekable, writable view over a single preallocated buffer. Chunks are written in place (in any order), so
+    downloading a blob never copies or re-allocates what was already received """
+    def __init__(self, size: int = 0):
+        self.buffer = bytearray(size)
+        self._view = memoryview(self.buffer)
+        self._pos = 0
+        self.end = 0
+
+    @staticmethod
+    def writable() -> bool:
+        return True
+
+    @staticmethod
+    def seekable() -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.end
+        self._pos = offset
+        return self._pos
+
+    def write(self, data: bytes) -> int:
+        length = len(data)
+        end = self._pos + length
+        if end > len(self.buffer):
+            # only happens if the blob grew after we asked for its size -- resize once and carry on
+            self._view.release()
+            self.buffer.extend(bytes(end - len(self.buffer)))
+            self._view = memoryview(self.buffer)
+        self._view[self._pos:end] = data
+        self._pos = end
+        self.end = max(self.end, end)
+        return length
+
+    def getbuffer(self) -> bytearray:
+        self._view.release()
+        del self.buffer[self.end:]
+        return self.buffer
+
+
+class AzureContainerFileService(IndexableContainer[bytearray]):
+    # blobs larger than this are downloaded with parallel ranged requests
+    parallel_threshold = 4 * 1024 * 1024
+    max_concurrency = 4
+
+    def __init__(self, directory: str, pool: AzureClientPool = None):
         self.account_name = 'objectstorage2'
         self.account_url = f'https://{self.account_name}.blob.core.windows.net/'
         self.container_name = directory
         self.credential = os.getenv('STORAGE_CONNECTION_STRING')
+        self.pool = pool or client_pool
 
-    def __getitem__(self, item: str):
+    def _blob_client(self, item: str) -> BlobClient:
+        return self.pool.blob(self.account_url, self.container_name, item, credential=self.credential)
+
+    def _download(self, item: str):
+        """ Starts a download and returns the SDK downloader. Only the first range has been fetched at this point """
         try:
-            blob = BlobClient(account_url=self.account_url, container_name=self.container_name, blob_name=item,
-                              credential=self.credential)
-            blob_data = b''
-            for data in blob.download_blob():
-                blob_data += data
-            return blob_data
+            return self._blob_client(item).download_blob()
         except ResourceNotFoundError:
             raise IndexError(f'Value {item} not found in container {self.container_name}') from None
 
+    def _concurrency(self, size: int) -> int:
+        return self.max_concurrency if size > self.parallel_threshold else 1
+
+    def _read(self, downloader) -> bytearray:
+        size = len(downloader)
+        writer = _BufferWriter(size)
+        downloader.download_to_stream(writer, max_concurrency=self._concurrency(size))
+        return writer.getbuffer()
+
+    def get(self, item: str) -> bytearray:
+        """ Downloads a blob into one buffer, allocated up front from the blob size """
+        return self._read(self._download(item))
+
+    def fetch(self, key: str, validators: dict = None) -> Optional[Tuple[bytearray, dict]]:
+        """ The blob comes back in the buffer it was downloaded into (a bytearray), not copied again """
+        etag = (validators or {}).get('etag')
+        if etag:
+            try:
+                properties = self._blob_client(key).get_blob_properties()
+            except ResourceNotFoundError:
+                raise IndexError(f'Value {key} not found in container {self.container_name}') from None
+            if properties.etag == etag:
+                return None
+        downloader = self._download(key)
+        return self._read(downloader), {'etag': downloader.properties.etag}
+
+    def stream_to(self, item: str, path: Union[str, Path]) -> int:
+        """ Downloads a blob straight to disk, without holding it in memory
+
+        The file is written next to the target and renamed once complete, so a partial download never replaces a
+        good file. Returns the number of bytes written """
+        downloader = self._download(item)
+        target = Path(path)
+        os.makedirs(target.parent, exist_ok=True)
+        partial = target.with_name(target.name + '.part')
+        try:
+            with open(partial, 'wb') as f:
+                downloader.download_to_stream(f, max_concurrency=self._concurrency(len(downloader)))
+                # parallel chunks may land out of order, so the position isn't necessarily at the end
+                written = f.seek(0, io.SEEK_END)
+            os.replace(partial, target)
+        except BaseException:
+            if partial.exists():
+                partial.unlink()
+            raise
+        return written
+
+    def __getitem__(self, item: str) -> bytearray:
+        return self.get(item)
+
     def __setitem__(self, key: str, value: Any):
         if not self.credential:
             raise PermissionError('Credentials in environment variable "STORAGE_CONNECTION_STRING" not set')
         raise NotImplementedError
 
 
+@dataclass
+class RequestStats:
+    """ Latency of the requests made by a service, in seconds """
+    count: int = 0
+    errors: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    last: float = 0.0
+
+    def record(self, latency: float, error: bool = False):
+        self.count += 1
+        self.errors += int(error)
+        self.total += latency
+        self.max = max(self.max, latency)
+        self.last = latency
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+_http_sessions: Dict[str, requests.Session] = {}
+_http_sessions_lock = threading.Lock()
+
+
+def http_session(url: str) -> requests.Session:
+    """ Returns the process-wide keep-alive session for the endpoint (scheme, host and port) of `url` """
+    p = urlparse(url)
+    endpoint = f'{p.scheme}://{p.netloc}'
+    with _http_sessions_lock:
+        if endpoint not in _http_sessions:
+            _http_sessions[endpoint] = requests.Session()
+        return _http_sessions[endpoint]
+
+
 class HttpFileService(IndexableContainer[bytes]):
-    def __init__(self, url, namespace: str = 'contract', directory='address', timeout: int = 60):
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, url, namespace: str = 'contract', directory='address', timeout: int = 60,
+                 connect_timeout: float = 5, read_timeout: float = 30, retries: int = 3, backoff: float = 0.5,
+                 bundle: 'DiscoveryBundle' = None):
+        """
+        :param timeout: seconds to wait for the server to start accepting connections, before the first request
+        :param connect_timeout: seconds to wait to establish a connection for each request
+        :param read_timeout: seconds to wait for the server to respond to each request
+        :param retries: how many times to retry a request that failed to connect, timed out, or returned 5xx
+        :param backoff: base delay between retries. Doubles with each retry, with random jitter
+        :param bundle: served from first, if it has the item -- only items it doesn't have are requested one by one
+        """
         p = urlparse(url)
         self.hostname = p.hostname
         self.port = p.port
         self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.directory = directory
         self.account_url = f'{url}/{namespace}/{directory}?name='
+        self.watch_url = f'{url}/{namespace}/watch?name='
+        self.bundle = bundle
         self.credential = os.getenv('STORAGE_CONNECTION_STRING')
+        self.session = http_session(url)
+        self.stats = RequestStats()
         self._connected = False
 
     @property
     def connected(self):
         if not self._connected:
-            is_contract_ready = self._wait_till_open(timeout=self.timeout)
-            if not is_contract_ready:
-                raise TimeoutError(f'Timeout for server @ {self.account_url}')
+            try:
+                readiness.wait_for(readiness.Target(self.hostname, self.port), timeout=self.timeout)
+            except TimeoutError:
+                raise TimeoutError(f'Timeout for server @ {self.account_url}') from None
             self._connected = True
         return self._connected
 
+    def _get(self, item: str, headers: dict = None) -> requests.Response:
+        return self._request(f'{self.account_url}{item}', headers)
+
+    def _request(self, url: str, headers: dict = None, read_timeout: float = None) -> requests.Response:
+        """ GET with retries: connection errors, timeouts and 5xx responses are retried with jittered exponential
+        backoff. After the last retry the 5xx response is returned, or the connection error raised """
+        timeout = (self.connect_timeout, read_timeout or self.read_timeout)
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                resp = self.session.get(url, headers=headers, timeout=timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self.stats.record(time.monotonic() - start, error=True)
+                if attempt >= self.retries:
+                    raise
+                reason = str(e)
+            else:
+                self.stats.record(time.monotonic() - start, error=resp.status_code >= 500)
+                logger.debug(f'GET {url} -> {resp.status_code} in {self.stats.last * 1000:.1f}ms')
+                if resp.status_code < 500 or attempt >= self.retries:
+                    return resp
+                reason = f'status {resp.status_code}'
+            delay = random.uniform(0, self.backoff * 2 ** attempt)
+            logger.info(f'Request to {url} failed ({reason}), retrying in {delay:.2f}s')
+            time.sleep(delay)
+            attempt += 1
+
+    def _bundled(self, item: str) -> Optional[Any]:
+        return self.bundle.lookup(self.directory, item) if self.bundle is not None else None
+
     def __getitem__(self, item):
-        if self.connected:
-            addr = requests.get(f'{self.account_url}{item}')
-            return addr.json()
-        return {}
+        value, _ = self.fetch(item)  # type: ignore  # never None without validators
+        return value
+
+    def fetch(self, key: str, validators: dict = None) -> Optional[Tuple[Any, dict]]:
+        if not self.connected:
+            return {}, {}
+        bundled = self._bundled(key)
+        if bundled is not None:
+            return bundled, {}
+        headers = {}
+        if validators:
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+        resp = self._get(key, headers=headers)
+        if resp.status_code == 304:
+            return None
+        if resp.status_code == 404:
+            raise IndexError(f'Value {key} not found @ {self.account_url}')
+        resp.raise_for_status()
+        return resp.json(), self._validators(resp)
+
+    @staticmethod
+    def _validators(resp: requests.Response) -> dict:
+        return {'etag': resp.headers.get('ETag'), 'last_modified': resp.headers.get('Last-Modified')}
+
+    def watch(self, key: str, validators: dict = None, timeout: Optional[float] = None,
+              interval: float = 30) -> Tuple[Any, dict]:
+        """ Long-polls the server's watch endpoint, which answers as soon as the item is published (or changes),
+        or with a 304 after `interval` seconds. Falls back to polling servers without one """
+        if not self.connected:
+            raise TimeoutError(f'Timeout for server @ {self.account_url}')
+        deadline = None if timeout is None else time.monotonic() + timeout
+        headers = {'If-None-Match': validators['etag']} if validators and validators.get('etag') else {}
+        while True:
+            wait = interval if deadline is None else max(0.0, min(interval, deadline - time.monotonic()))
+            resp = self._request(f'{self.watch_url}{key}&wait={wait:.1f}', headers, read_timeout=self.read_timeout + wait)
+            if resp.status_code == 200:
+                return resp.json(), self._validators(resp)
+            if resp.status_code == 404:
+                logger.info(f'No watch endpoint @ {self.watch_url}, polling for {key} instead')
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                return super().watch(key, validators, timeout=remaining)
+            if resp.status_code != 304:
+                resp.raise_for_status()
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f'Timeout waiting for {key} @ {self.account_url}')
 
     def __setitem__(self, key: str, value: Any):
         if not self.credential:
@@ -75,16 +397,64 @@ class HttpFileService(IndexableContainer[bytes]):
         raise NotImplementedError
 
     def is_ready(self):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        result = sock.connect_ex((self.hostname, self.port))
-        return result == 0
+        return readiness.is_ready(readiness.Target(self.hostname, self.port))
+
+
+class DiscoveryBundle:
+    """ Every contract address, plus a set of ABIs and slim artifacts, from the contract discovery server's
+    /contract/bundle endpoint. Fetched in a single request the first time any of them is needed, then kept until
+    `refresh` """
+    def __init__(self, url: str, abis: Iterable[str] = (), artifacts: Iterable[str] = (), **http_options):
+        self.abis = sorted(abis)
+        self.artifacts = sorted(artifacts)
+        self.service = HttpFileService(url, directory='bundle', **http_options)
+        self._bundle: Optional[dict] = None
+        self._lock = threading.Lock()
 
-    def _wait_till_open(self, timeout: int = 60) -> bool:
-        for _ in range(timeout):
-            if self.is_ready():
-                return True
-            time.sleep(1)
-        return False
+    def get(self) -> dict:
+        with self._lock:
+            if self._bundle is None:
+                self._bundle = self._download()
+            return self._bundle
+
+    def _download(self) -> dict:
+        if not self.service.connected:
+            return {}
+        query = ','.join(self.abis)
+        if self.artifacts:
+            query += f'&artifact={",".join(self.artifacts)}'
+        resp = self.service._get(query)  # pylint: disable=protected-access
+        if resp.status_code == 404:
+            logger.info(f'No discovery bundle @ {self.service.account_url}, fetching artifacts one by one')
+            return {}
+        resp.raise_for_status()
+        bundle = resp.json()
+        logger.info(f'Loaded discovery bundle version {bundle.get("version")} '
+                    f'({len(resp.content)} bytes, {self.service.stats.last * 1000:.1f}ms)')
+        return bundle
+
+    def lookup(self, directory: str, item: str) -> Optional[Any]:
+        return self.get().get(directory, {}).get(item)
+
+    def refresh(self):
+        """ Drops the bundle, so the next lookup downloads it again """
+        with self._lock:
+            self._bundle = None
+
+
+_bundles: Dict[Tuple[str, Tuple[str, ...], Tuple[str, ...]], DiscoveryBundle] = {}
+_bundles_lock = threading.Lock()
+
+
+def discovery_bundle(url: str, abis: Iterable[str] = (), artifacts: Iterable[str] = (),
+                     **http_options) -> DiscoveryBundle:
+    """ Returns the process-wide bundle for the discovery server at `url` and this set of ABIs and artifacts. The
+    http options are only used when the bundle is first created """
+    key = (url, tuple(sorted(set(abis))), tuple(sorted(set(artifacts))))
+    with _bundles_lock:
+        if key not in _bundles:
+            _bundles[key] = DiscoveryBundle(*key, **http_options)
+        return _bundles[key]
 
 
 class LocalStorage:
@@ -100,3 +470,270 @@ class LocalStorage:
     def __setitem__(self, key: str, value: AnyStr):
         with open(self.path / key, 'w'+self.flags) as f:
             f.write(value)
+
+
+class _CacheStore:
+    """ Content-addressed files under objects/ plus an index.json of key -> object, shared by every CachedContainer
+    in the process that points at the same directory
+
+    Other processes may share the directory too. Every change is made holding index.lock, on the index as they last
+    saved it, and only objects this change left unreferenced are deleted """
+    index_name = 'index.json'
+    lock_name = 'index.lock'
+
+    def __init__(self, directory: Path, max_size: int):
+        self.path = directory
+        self.objects = directory / 'objects'
+        os.makedirs(self.objects, exist_ok=True)
+        self.max_size = max_size
+        self.lock = threading.RLock()
+        self.index: Dict[str, dict] = self._load()
+
+    def read(self, key: str) -> Optional[Tuple[dict, bytes]]:
+        entry = self.index.get(key)
+        if not entry:
+            return None
+        try:
+            content = (self.objects / entry['digest']).read_bytes()
+        except FileNotFoundError:
+            # evicted by another process sharing the directory
+            del self.index[key]
+            return None
+        entry['accessed'] = time.time()
+        return entry, content
+
+    def write(self, key: str, content: bytes, kind: str, validators: dict):
+        digest = hashlib.sha256(content).hexdigest()
+        with self._shared():
+            target = self.objects / digest
+            if not target.exists():
+                partial = target.with_name(f'{digest}.{os.getpid()}.part')
+                partial.write_bytes(content)
+                os.replace(partial, target)
+            now = time.time()
+            previous = self.index.get(key)
+            self.index[key] = {'digest': digest, 'size': len(content), 'kind': kind, 'validators': validators,
+                               'fetched': now, 'accessed': now}
+            dropped = self._evict()
+            if previous:
+                dropped.add(previous['digest'])
+            self._collect(dropped)
+            self.save()
+
+    def expire(self, prefix: str):
+        """ Marks every entry whose key starts with `prefix` as due for revalidation """
+        with self._shared():
+            for key, entry in self.index.items():
+                if key.startswith(prefix):
+                    entry['fetched'] = 0
+            self.save()
+
+    def remove(self, key: str):
+        with self._shared():
+            entry = self.index.pop(key, None)
+            if entry:
+                self._collect({entry['digest']})
+                self.save()
+
+    @contextmanager
+    def _shared(self):
+        """ Holds the directory's lock against other processes, with the index brought up to date with what they
+        saved. Entries are theirs as saved, except for when we last read them """
+        with open(self.path / self.lock_name, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                saved = self._load()
+                for key, entry in saved.items():
+                    ours = self.index.get(key)
+                    if ours and ours['digest'] == entry['digest']:
+                        entry['accessed'] = max(entry['accessed'], ours['accessed'])
+                self.index = saved
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self.path / self.index_name) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _evict(self) -> Set[str]:
+        """ Drops least recently used entries until the objects they reference fit in max_size. Returns the digests
+        of the objects no longer referenced """
+        sizes: Dict[str, int] = {}
+        references: Dict[str, int] = {}
+        for entry in self.index.values():
+            sizes[entry['digest']] = entry['size']
+            references[entry['digest']] = references.get(entry['digest'], 0) + 1
+        total = sum(sizes.values())
+        dropped = set()
+        for key in sorted(self.index, key=lambda k: self.index[k]['accessed']):
+            if total <= self.max_size:
+                break
+            digest = self.index.pop(key)['digest']
+            references[digest] -= 1
+            if not references[digest]:
+                total -= sizes[digest]
+                dropped.add(digest)
+        return dropped
+
+    def _collect(self, digests: Iterable[str]):
+        """ Deletes these objects, unless an entry still references them """
+        referenced = {entry['digest'] for entry in self.index.values()}
+        for digest in set(digests) - referenced:
+            try:
+                (self.objects / digest).unlink()
+            except FileNotFoundError:
+                pass
+
+    def save(self):
+        partial = self.path / f'{self.index_name}.{os.getpid()}.part'
+        with open(partial, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(partial, self.path / self.index_name)
+
+
+_cache_stores: 'weakref.WeakValueDictionary[str, _CacheStore]' = weakref.WeakValueDictionary()
+_cache_stores_lock = threading.Lock()
+
+
+def _cache_store(directory: Union[str, Path], max_size: int) -> _CacheStore:
+    path = Path(directory).resolve()
+    with _cache_stores_lock:
+        store = _cache_stores.get(str(path))
+        if store is None:
+            store = _CacheStore(path, max_size)
+            _cache_stores[str(path)] = store
+        return store
+
+
+class CachedContainer(IndexableContainer[T]):
+    """ Persistent on-disk cache in front of any IndexableContainer
+
+    Items are served from disk while their TTL holds (ttl=None never expires). After that they are revalidated
+    using the ETag or Last-Modified from the previous fetch, if the backend supports conditional fetches, and are
+    only downloaded again if they changed. If revalidation fails because the backend can't be reached, the cached
+    copy is served anyway.
+
+    Files are stored by content hash, so identical artifacts are stored once. Once the directory grows past
+    max_size bytes the least recently used items are evicted. Use a different `namespace` for each backend that
+    shares a cache directory
+    """
+    def __init__(self, backend: IndexableContainer[T], directory: Union[str, Path], namespace: str = '',
+                 ttl: Optional[float] = 3600, max_size: int = 64 * 1024 * 1024):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+        self.ttls: Dict[str, Optional[float]] = {}
+        self._store = _cache_store(directory, max_size)
+
+    def __getattr__(self, name):
+        # anything that isn't about caching goes to the backend (credential, stream_to, ...)
+        if name == 'backend':
+            raise AttributeError(name)
+        return getattr(self.backend, name)
+
+    def set_ttl(self, key: str, ttl: Optional[float]):
+        self.ttls[key] = ttl
+
+    def _expired(self, key: str, entry: dict) -> bool:
+        ttl = self.ttls.get(key, self.ttl)
+        return ttl is not None and time.time() - entry['fetched'] >= ttl
+
+    def _backend_fetch(self, key: str, validators: Optional[dict]):
+        fetch = getattr(self.backend, 'fetch', None)
+        if fetch is None:
+            return self.backend[key], {}
+        return fetch(key, validators)
+
+    def __getitem__(self, key: str) -> T:
+        name = f'{self.namespace}/{key}'
+        with self._store.lock:
+            cached = self._store.read(name)
+            if cached and not self._expired(key, cached[0]):
+                return self._decode(*cached)
+
+        # not holding the lock while we download, so fetches of other items can run at the same time
+        try:
+            result = self._backend_fetch(key, cached[0]['validators'] if cached else None)
+        except (ConnectionError, TimeoutError, requests.exceptions.RequestException, AzureError) as e:
+            if cached is None:
+                raise
+            logger.warning(f'Failed to revalidate {name}, using cached copy: {e}')
+            return self._decode(*cached)
+
+        with self._store.lock:
+            if result is None:  # not modified -- only possible if we sent validators from a cached entry
+                entry, content = cast(Tuple[dict, bytes], cached)
+                self._store.write(name, content, entry['kind'], entry['validators'])
+                return self._decode(entry, content)
+
+            value, validators = result
+            content, kind = self._encode(value)
+            self._store.write(name, content, kind, validators)
+            return value
+
+    def __setitem__(self, key: str, value: Any):
+        self.backend[key] = value
+        self.invalidate(key)
+
+    def get_many(self, keys: Iterable[str], *, return_exceptions: bool = False) -> Dict[str, Any]:
+        """ Items that aren't cached at all are fetched together, with the backend's get_many. Cached ones are read
+        (and revalidated if due) one by one, as with [] """
+        keys = list(keys)
+        with self._store.lock:
+            missing = [key for key in keys if self._store.read(f'{self.namespace}/{key}') is None]
+        fetched = self.backend.get_many(missing, return_exceptions=True) if missing else {}
+        with self._store.lock:
+            for key, value in fetched.items():
+                if not isinstance(value, Exception):
+                    content, kind = self._encode(value)
+                    # no validators from a plain get, so the first revalidation downloads the item again
+                    self._store.write(f'{self.namespace}/{key}', content, kind, {})
+        values = super().get_many([key for key in keys if key not in fetched], return_exceptions=return_exceptions)
+        values.update(fetched)
+        if not return_exceptions:
+            for value in values.values():
+                if isinstance(value, Exception):
+                    raise value
+        return {key: values[key] for key in keys}
+
+    def watch(self, key: str, validators: dict = None, timeout: Optional[float] = None,
+              interval: float = None) -> Tuple[T, dict]:
+        # the backend knows best how often to check, unless told otherwise
+        kwargs = {} if interval is None else {'interval': interval}
+        value, new_validators = self.backend.watch(key, validators, timeout=timeout, **kwargs)
+        # what we waited for replaces whatever we had cached
+        content, kind = self._encode(value)
+        with self._store.lock:
+            self._store.write(f'{self.namespace}/{key}', content, kind, new_validators)
+        return value, new_validators
+
+    def invalidate(self, key: str):
+        with self._store.lock:
+            self._store.remove(f'{self.namespace}/{key}')
+
+    def expire(self):
+        """ Makes every cached item revalidate with the backend on its next read, whatever its TTL. Unlike
+        `invalidate`, the cached copies are kept -- to skip the download if unchanged, or in case the backend is down
+        """
+        with self._store.lock:
+            self._store.expire(f'{self.namespace}/')
+
+    @staticmethod
+    def _encode(value: Any) -> Tuple[bytes, str]:
+        if isinstance(value, (bytes, bytearray)):
+            return bytes(value), 'bytes'
+        if isinstance(value, str):
+            return value.encode(), 'str'
+        return json.dumps(value).encode(), 'json'
+
+    @staticmethod
+    def _decode(entry: dict, content: bytes) -> Any:
+        if entry['kind'] == 'str':
+            return content.decode()
+        if entry['kind'] == 'json':
+            return json.loads(content)
+        return content
@@ -0,0 +1,100 @@
+""" Benchmark for enigma_docker_common.crypto
+
+Times key generation, public key (and address) derivation and signing with every secp256k1 backend installed --
+ecdsa always, coincurve if it is -- and address derivation through the memoized path, as EthereumKey does it.
+
+Then compares encrypting and decrypting a file with encrypt/decrypt (whole payload in memory) against
+encrypt_stream/decrypt_stream, at several payload sizes: throughput, and peak memory allocated, as measured by
+tracemalloc.
+
+usage (from common_scripts/):
+    python -m test.bench_crypto [--iterations 200] [--sizes 1 4 16 64]
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from Crypto.Hash import keccak
+
+from enigma_docker_common import crypto
+
+MB = 1024 * 1024
+
+
+def per_op(func, args_list) -> float:
+    start = time.perf_counter()
+    for args in args_list:
+        func(*args)
+    return (time.perf_counter() - start) / len(args_list) * 1e6
+
+
+def run(iterations: int):
+    digest = keccak.new(digest_bits=256, data=b'enigma').digest()
+    keys = [crypto.EcdsaBackend().generate() for _ in range(iterations)]
+
+    print(f'{iterations} iterations, microseconds per operation')
+    print(f'{"backend":>10} | {"generate":>9} | {"public key":>10} | {"address":>9} | {"sign":>9}')
+    for name, backend_class in crypto.BACKENDS.items():
+        backend = backend_class()
+        generate = per_op(backend.generate, [()] * iterations)
+        public_key = per_op(backend.public_key, [(key,) for key in keys])
+        address = per_op(lambda key: crypto.pubkey_to_addr.__wrapped__(backend.public_key(key).hex()),
+                         [(key,) for key in keys])
+        sign = per_op(backend.sign, [(key, digest) for key in keys])
+        print(f'{name:>10} | {generate:>9.1f} | {public_key:>10.1f} | {address:>9.1f} | {sign:>9.1f}')
+
+    # what EthereumKey pays for a key it has seen before: its public key again, but the address from the cache
+    hex_keys = ['0x' + key.hex() for key in keys]
+    for key in hex_keys:
+        crypto.checksum_address_from_private(key)
+    memoized = per_op(crypto.checksum_address_from_private, [(key,) for key in hex_keys])
+    print(f'{"memoized":>10} | {"":>9} | {"":>10} | {memoized:>9.1f} |')
+
+
+def whole_file(src: str, dst: str, password: str):
+    with open(src, 'rb') as f:
+        encrypted = crypto.encrypt(password, f.read())
+    with open(dst, 'wb') as f:
+        f.write(crypto.decrypt(password, encrypted))
+
+
+def streamed(src: str, dst: str, password: str):
+    encrypted = f'{dst}.enc'
+    with open(src, 'rb') as f_in, open(encrypted, 'wb') as f_out:
+        crypto.encrypt_stream(f_in, f_out, password)
+    with open(encrypted, 'rb') as f_in, open(dst, 'wb') as f_out:
+        crypto.decrypt_stream(f_in, f_out, password)
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def run_stream(sizes):
+    print('\nencrypt + decrypt of a file, MB/s and peak MB allocated')
+    print(f'{"size (MB)":>10} | {"whole MB/s":>10} {"peak MB":>8} | {"stream MB/s":>11} {"peak MB":>8}')
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, 'payload')
+        for size in sizes:
+            with open(src, 'wb') as f:
+                f.write(os.urandom(size * MB))
+            row = [measure(func, src, os.path.join(tmp, 'out'), 'cupcake') for func in (whole_file, streamed)]
+            print(f'{size:>10} | {size / row[0][0]:>10.1f} {row[0][1] / MB:>8.2f} | '
+                  f'{size / row[1][0]:>11.1f} {row[1][1] / MB:>8.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=200, help='operations timed per backend and operation')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1, 4, 16, 64], help='payload sizes in MB')
+    args = parser.parse_args()
+    run(args.iterations)
+    run_stream(args.sizes)
@@ -0,0 +1,109 @@
+""" Benchmark for blob downloads, run against a local stand-in for Azure blob storage (no network, no credentials)
+
+Compares the old `blob_data += chunk` loop with AzureContainerFileService.get (one preallocated buffer) and
+AzureContainerFileService.stream_to (straight to disk). Peak memory is what the download allocates on top of the
+blob itself, as measured by tracemalloc.
+
+usage (from common_scripts/):
+    python -m test.bench_storage [--sizes 1 2 4 8 16 32 64] [--chunk-size 65536]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from enigma_docker_common.storage import AzureContainerFileService
+
+MB = 1024 * 1024
+
+
+class LocalBlobDownloader:
+    """ Stand-in for the SDK's StorageStreamDownloader, serving a blob from memory in fixed-size chunks """
+    def __init__(self, data: bytes, chunk_size: int):
+        self.data = data
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        for start in range(0, len(self.data), self.chunk_size):
+            yield self.data[start:start + self.chunk_size]
+
+    def download_to_stream(self, stream, max_concurrency=1):
+        if max_concurrency <= 1:
+            for chunk in self:
+                stream.write(chunk)
+            return
+
+        # like the SDK: ranged requests complete in any order, and writes are serialized with a lock
+        base = stream.tell()
+        lock = threading.Lock()
+
+        def fetch(start):
+            chunk = self.data[start:start + self.chunk_size]
+            with lock:
+                stream.seek(base + start)
+                stream.write(chunk)
+
+        with ThreadPoolExecutor(max_concurrency) as executor:
+            list(executor.map(fetch, reversed(range(0, len(self.data), self.chunk_size))))
+
+
+class LocalBlobService(AzureContainerFileService):
+    """ AzureContainerFileService backed by an in-memory dict of blobs """
+    def __init__(self, blobs: dict, chunk_size: int = 64 * 1024):
+        super().__init__('local')
+        self.blobs = blobs
+        self.chunk_size = chunk_size
+
+    def _download(self, item: str):
+        try:
+            return LocalBlobDownloader(self.blobs[item], self.chunk_size)
+        except KeyError:
+            raise IndexError(f'Value {item} not found in container {self.container_name}') from None
+
+
+def legacy_get(fs: LocalBlobService, item: str) -> bytes:
+    blob_data = b''
+    for data in fs._download(item):  # pylint: disable=protected-access
+        blob_data += data
+    return blob_data
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def run(sizes, chunk_size):
+    print(f'chunk size: {chunk_size} bytes')
+    print(f'{"size (MB)":>10} | {"legacy s":>9} {"peak MB":>8} | {"get s":>8} {"peak MB":>8} | '
+          f'{"stream_to s":>11} {"peak MB":>8}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            fs = LocalBlobService({'blob': os.urandom(size * MB)}, chunk_size=chunk_size)
+            target = os.path.join(tmp, 'blob')
+            results = [measure(legacy_get, fs, 'blob'),
+                       measure(fs.get, 'blob'),
+                       measure(fs.stream_to, 'blob', target)]
+            # peak minus the result buffer itself, since that is the same for every strategy
+            row = [(t, (peak - (size * MB if i < 2 else 0)) / MB) for i, (t, peak) in enumerate(results)]
+            print(f'{size:>10} | {row[0][0]:>9.3f} {row[0][1]:>8.2f} | {row[1][0]:>8.3f} {row[1][1]:>8.2f} | '
+                  f'{row[2][0]:>11.3f} {row[2][1]:>8.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1, 2, 4, 8, 16, 32, 64], help='blob sizes in MB')
+    parser.add_argument('--chunk-size', type=int, default=64 * 1024, help='size of each downloaded chunk in bytes')
+    args = parser.parse_args()
+    run(args.sizes, args.chunk_size)
@@ -0,0 +1,93 @@
+""" Stub HTTP servers for the tests: discovery endpoints, health checks and ethereum nodes """
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable
+
+import pytest
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def answer(self):
+        server: StubServer = self.server  # type: ignore
+        with server.lock:
+            server.requests += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            reply = server.answer(self)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+        status, body, headers = reply if len(reply) == 3 else (*reply, {})
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = answer  # pylint: disable=invalid-name
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    """ Answers every request with answer(handler): (status, body) or (status, body, headers). A body that isn't bytes
+    is sent as JSON. Counts the requests, and how many were being answered at the same time """
+    # the concurrency tests connect many times at once
+    request_queue_size = 64
+
+    def __init__(self, answer: Callable[[BaseHTTPRequestHandler], tuple]):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.answer = answer
+        self.url = f'http://127.0.0.1:{self.server_address[1]}'
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+
+def _json_rpc(rpc: Callable[[str, list], Any]) -> Callable[[BaseHTTPRequestHandler], tuple]:
+    def reply(request: dict) -> dict:
+        try:
+            return {'jsonrpc': '2.0', 'id': request['id'], 'result': rpc(request['method'], request['params'])}
+        except ValueError as e:
+            return {'jsonrpc': '2.0', 'id': request['id'], 'error': {'code': -32000, 'message': str(e)}}
+
+    def answer(handler: BaseHTTPRequestHandler) -> tuple:
+        payload = json.loads(handler.rfile.read(int(handler.headers['Content-Length'])))
+        if isinstance(payload, list):
+            # in reverse: clients have to match the replies to their requests by id
+            return 200, [reply(request) for request in reversed(payload)]
+        return 200, reply(payload)
+    return answer
+
+
+@pytest.fixture()
+def http_server():
+    """ http_server(answer) starts a StubServer, until the end of the test """
+    servers = []
+
+    def start(answer: Callable[[BaseHTTPRequestHandler], tuple]) -> StubServer:
+        server = StubServer(answer)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture()
+def json_rpc_server(http_server):  # pylint: disable=redefined-outer-name
+    """ json_rpc_server(rpc) starts an ethereum node that answers each JSON-RPC request, on its own or in a batch, with
+    rpc(method, params). A ValueError becomes the request's error """
+    return lambda rpc: http_server(_json_rpc(rpc))
@@ -0,0 +1,29 @@
+import pytest
+
+from enigma_docker_common.address import Address
+
+CHECKSUMMED = '0x90F8bf6A479f320ead074411a4B0e7944Ea8c9C1'
+
+
+@pytest.mark.parametrize('value', [CHECKSUMMED, CHECKSUMMED.lower(), CHECKSUMMED[2:].lower(),
+                                   bytes.fromhex(CHECKSUMMED[2:]), bytearray.fromhex(CHECKSUMMED[2:]),
+                                   memoryview(bytes.fromhex(CHECKSUMMED[2:]))])
+def test_checksummed(value):
+    address = Address(value)
+    assert address == CHECKSUMMED
+    assert address.canonical == CHECKSUMMED.lower()
+    assert address.to_bytes() == bytes.fromhex(CHECKSUMMED[2:])
+
+
+def test_interned():
+    address = Address(CHECKSUMMED.lower())
+    assert Address(CHECKSUMMED.lower()) is address
+    assert Address(address) is address
+    assert {CHECKSUMMED: 1}[address] == 1
+
+
+@pytest.mark.parametrize('value', ['0x1234', CHECKSUMMED.lower().replace('c', 'C'), 'not an address', b'\x00' * 19,
+                                   bytearray(19), None, [CHECKSUMMED]])
+def test_invalid(value):
+    with pytest.raises(ValueError):
+        Address(value)
@@ -0,0 +1,40 @@
+import json
+
+from enigma_docker_common.artifacts import ContractArtifact, selectors
+
+BUILD = {
+    'contractName': 'EnigmaToken',
+    'abi': [
+        {'type': 'constructor', 'inputs': []},
+        {'type': 'function', 'name': 'transfer',
+         'inputs': [{'name': 'to', 'type': 'address'}, {'name': 'value', 'type': 'uint256'}]},
+        {'type': 'function', 'name': 'register',
+         'inputs': [{'name': 'worker', 'type': 'tuple[]',
+                     'components': [{'name': 'signer', 'type': 'address'}, {'name': 'report', 'type': 'bytes'}]}]},
+        {'type': 'event', 'name': 'Transfer', 'inputs': []},
+    ],
+    'bytecode': '0x' + '60' * 10000,
+    'ast': {'nodes': list(range(1000))},
+    'networks': {'4447': {'address': '0x1234', 'transactionHash': '0xabcd', 'events': {}, 'links': {}}},
+}
+
+
+def test_selectors():
+    # no constructor or events, and tuples spelled out in the signature
+    assert selectors(BUILD['abi']) == {'transfer(address,uint256)': '0xa9059cbb',
+                                       'register((address,bytes)[])': '0xe8c3c4ab'}
+
+
+def test_from_build():
+    artifact = ContractArtifact.from_build(json.dumps(BUILD))
+
+    assert artifact.contract_name == 'EnigmaToken'
+    assert artifact.abi == BUILD['abi']
+    assert artifact.address('4447') == '0x1234'
+    assert artifact.networks == {'4447': {'address': '0x1234', 'transactionHash': '0xabcd'}}
+    assert len(json.dumps(artifact.to_dict())) < len(json.dumps(BUILD)) / 10
+
+
+def test_round_trip():
+    artifact = ContractArtifact.from_build(BUILD)
+    assert ContractArtifact.from_dict(json.loads(json.dumps(artifact.to_dict()))) == artifact
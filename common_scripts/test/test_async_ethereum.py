@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+
+import pytest
+import rlp
+from Crypto.Hash import keccak
+
+from enigma_docker_common import blocks
+from enigma_docker_common.address import Address
+from enigma_docker_common.async_ethereum import AsyncContract, AsyncEthereumGateway
+from enigma_docker_common.crypto import EthereumKey
+
+TOKEN = '0x8f0483125FCb9aaAEFA9209D8E9d7b9C8B9Fb90F'
+ABI = [{'name': 'balanceOf', 'type': 'function', 'constant': True, 'stateMutability': 'view',
+        'inputs': [{'name': 'owner', 'type': 'address'}], 'outputs': [{'name': '', 'type': 'uint256'}]},
+       {'name': 'transfer', 'type': 'function', 'constant': False, 'stateMutability': 'nonpayable',
+        'inputs': [{'name': 'to', 'type': 'address'}, {'name': 'value', 'type': 'uint256'}],
+        'outputs': [{'name': '', 'type': 'bool'}]}]
+KEY = EthereumKey(key='0x' + '11' * 32)
+DELAY = 0.2
+
+
+class Node:
+    """ Mines whatever was sent since the last block, every DELAY seconds """
+    constants = {'eth_chainId': '0x1', 'eth_gasPrice': hex(10 ** 9), 'eth_getTransactionCount': '0x5',
+                 'eth_uninstallFilter': True}
+
+    def __init__(self):
+        self.number = 1
+        self.pending = []
+        self.mined = {}
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def mine(self, stop):
+        while not stop.wait(DELAY):
+            with self.lock:
+                self.number += 1
+                for tx_hash in self.pending:
+                    self.mined[tx_hash] = self.number
+                self.pending = []
+
+    def rpc(self, method, params):  # pylint: disable=too-many-return-statements
+        if method in self.constants:
+            return self.constants[method]
+        if method == 'eth_blockNumber':
+            return hex(self.number)
+        if method == 'eth_getBalance':
+            time.sleep(DELAY)
+            return hex(2 * 10 ** 18)
+        if method == 'eth_call':
+            return '0x' + params[0]['data'][-64:]
+        if method == 'eth_sendRawTransaction':
+            tx_hash = '0x' + keccak.new(digest_bits=256, data=bytes.fromhex(params[0][2:])).hexdigest()
+            with self.lock:
+                self.pending.append(tx_hash)
+            self.sent.append(rlp.decode(bytes.fromhex(params[0][2:])))
+            return tx_hash
+        if method == 'eth_getTransactionReceipt':
+            if params[0] not in self.mined:
+                return None
+            return {'transactionHash': params[0], 'blockNumber': hex(self.mined[params[0]]), 'status': '0x1'}
+        if method == 'eth_newBlockFilter':
+            self.seen = self.number
+            return '0x1'
+        if method == 'eth_getFilterChanges':
+            changes = ['0x' + f'{n:064x}' for n in range(self.seen + 1, self.number + 1)]
+            self.seen = self.number
+            return changes
+        raise ValueError(method)
+
+
+@pytest.fixture()
+def node(json_rpc_server, monkeypatch):
+    chain = Node()
+    chain.server = json_rpc_server(chain.rpc)
+    chain.url = chain.server.url
+    stop = threading.Event()
+    threading.Thread(target=chain.mine, args=(stop,), daemon=True).start()
+    # follow blocks over HTTP only, and quickly
+    monkeypatch.setitem(blocks._watchers, chain.url,  # pylint: disable=protected-access
+                        blocks.BlockWatcher(chain.url, ws_url=None, poll_interval=0.05))
+    yield chain
+    stop.set()
+
+
+def test_concurrent_reads(node):
+    async def balances():
+        async with AsyncEthereumGateway(node.url) as gateway:
+            return await asyncio.gather(*(gateway.balance(KEY.address) for _ in range(10)))
+
+    start = time.monotonic()
+    assert asyncio.run(balances()) == ['2'] * 10
+    # all in flight at once, not one after another
+    assert time.monotonic() - start < 5 * DELAY
+    assert node.server.max_in_flight == 10
+
+
+def test_call(node):
+    async def call():
+        token = AsyncContract(node.url, TOKEN, ABI)
+        try:
+            return await token.call('balanceOf', Address(f'0x{42:040x}'))
+        finally:
+            await token.close()
+
+    assert asyncio.run(call()) == 42
+
+
+def test_transact(node):
+    async def transfers():
+        token = AsyncContract(node.url, TOKEN, ABI)
+        try:
+            receipts = await asyncio.gather(*(token.transact(KEY.address, KEY.key, 'transfer',
+                                                             Address(f'0x{n:040x}'), n) for n in range(1, 4)))
+            assert await token.gateway.wait_for_confirmations(receipts[-1], 2, timeout=5)
+            return receipts
+        finally:
+            await token.close()
+
+    receipts = asyncio.run(transfers())
+    assert all(receipt.status == 1 and receipt.blockNumber > 1 for receipt in receipts)
+    # nonces from the shared nonce manager, starting at the node's pending count
+    assert sorted(int.from_bytes(tx[0], 'big') for tx in node.sent) == [5, 6, 7]
@@ -0,0 +1,90 @@
+import asyncio
+import time
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from enigma_docker_common.async_storage import AsyncHttpFileService, AsyncIndexableContainer, AsyncLocalStorage, \
+    SyncContainer
+
+DELAY = 0.2
+
+
+class SlowContainer(AsyncIndexableContainer[str]):
+    """ Every get takes DELAY seconds, and we track how many run at the same time """
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def get(self, key: str) -> str:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(DELAY)
+        self.in_flight -= 1
+        return key.upper()
+
+
+@pytest.fixture()
+def discovery_url(http_server):
+    """ Mimics contract_server: returns the requested name as a JSON string, slowly. 'missing.txt' doesn't exist, and
+    'flaky.txt' fails with a 503 the first time """
+    failed = set()
+
+    def answer(request):
+        time.sleep(DELAY)
+        name = parse_qs(urlparse(request.path).query)['name'][0]
+        if name == 'missing.txt':
+            return 404, f'0x{name}'
+        if name == 'flaky.txt' and name not in failed:
+            failed.add(name)
+            return 503, f'0x{name}'
+        return 200, f'0x{name}'
+    return http_server(answer).url
+
+
+def test_get_many_runs_concurrently():
+    container = SyncContainer(SlowContainer())
+    start = time.monotonic()
+    result = container.get_many(['a', 'b', 'c', 'd'])
+
+    assert result == {'a': 'A', 'b': 'B', 'c': 'C', 'd': 'D'}
+    assert time.monotonic() - start < 2 * DELAY
+
+
+def test_get_many_concurrency_limit():
+    slow = SlowContainer()
+    SyncContainer(slow).get_many([str(i) for i in range(6)], max_concurrency=2)
+    assert slow.max_in_flight == 2
+
+
+def test_local_storage(tmp_path):
+    (tmp_path / 'a').write_bytes(b'first')
+    (tmp_path / 'b').write_bytes(b'second')
+    container = SyncContainer(AsyncLocalStorage(str(tmp_path)))
+
+    assert container['a'] == b'first'
+    assert container.get_many(['a', 'b']) == {'a': b'first', 'b': b'second'}
+
+
+def test_http_file_service(discovery_url):
+    container = SyncContainer(AsyncHttpFileService(discovery_url))
+    names = ['enigmacontract.txt', 'enigmatokencontract.txt', 'votingcontract.txt', 'samplecontract.txt']
+    start = time.monotonic()
+    result = container.get_many(names)
+
+    assert result == {name: f'0x{name}' for name in names}
+    assert time.monotonic() - start < 2 * DELAY
+    container.close()
+
+
+def test_http_file_service_errors(discovery_url):
+    container = SyncContainer(AsyncHttpFileService(discovery_url, backoff=0.01))
+    with pytest.raises(IndexError):
+        _ = container['missing.txt']
+    # retried, like HttpFileService
+    assert container['flaky.txt'] == '0xflaky.txt'
+
+    result = container.get_many(['enigmacontract.txt', 'missing.txt'], return_exceptions=True)
+    assert result['enigmacontract.txt'] == '0xenigmacontract.txt'
+    assert isinstance(result['missing.txt'], IndexError)
+    container.close()
@@ -0,0 +1,57 @@
+import pytest
+
+from enigma_docker_common import batch as batch_module
+from enigma_docker_common.batch import BatchError
+from enigma_docker_common.enigma import EnigmaTokenContract
+from enigma_docker_common.ethereum import EthereumGateway
+
+TOKEN = '0x8f0483125FCb9aaAEFA9209D8E9d7b9C8B9Fb90F'
+BALANCE_OF = [{'name': 'balanceOf', 'type': 'function', 'constant': True, 'stateMutability': 'view',
+               'inputs': [{'name': 'owner', 'type': 'address'}], 'outputs': [{'name': '', 'type': 'uint256'}]}]
+# accounts that don't exist, as far as the node is concerned
+MISSING = '0x0000000000000000000000000000000000000bad'
+
+
+def rpc(method, params):
+    """ Balances are the account's last byte, in ether """
+    if method == 'eth_getBalance':
+        if params[0].lower() == MISSING:
+            raise ValueError('unknown account')
+        return hex(int(params[0][-2:], 16) * 10 ** 18)
+    if method == 'eth_getTransactionCount':
+        return '0x7'
+    if method == 'eth_call':
+        call = params[0]
+        assert call['to'] == TOKEN and call['data'].startswith('0x70a08231')  # balanceOf(address)
+        return '0x' + call['data'][-64:]  # the account, as a number
+    raise ValueError('method not found')
+
+
+@pytest.fixture()
+def node(json_rpc_server):
+    return json_rpc_server(rpc)
+
+
+def test_balances(node, monkeypatch):
+    monkeypatch.setattr(batch_module, 'MAX_BATCH_SIZE', 60)
+    accounts = [f'0x{n:040x}' for n in range(100)]
+    results = EthereumGateway(node.url).balances(accounts + [MISSING])
+
+    assert [result.value for result in results[:100]] == [str(n) for n in range(100)]
+    assert isinstance(results[100].error, BatchError) and not results[100].ok
+    assert node.requests == 2
+
+
+def test_mixed(node):
+    token = EnigmaTokenContract(node.url, TOKEN, BALANCE_OF)
+    batch = token.batch()
+    assert batch.call(token.contract.functions.balanceOf(f'0x{5:040x}')) == 0
+    batch.transaction_count(f'0x{5:040x}')
+    batch.balance(f'0x{3:040x}')
+    assert len(batch) == 3
+
+    assert [result.value for result in batch.execute()] == [5, 7, 3 * 10 ** 18]
+    assert node.requests == 1
+    assert len(batch) == 0
+
+    assert [result.value for result in token.balances([f'0x{n:040x}' for n in range(3)])] == [0, 1, 2]
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from enigma_docker_common import blocks
+from enigma_docker_common.blocks import BlockWatcher, block_watcher, websocket_url
+
+websockets = pytest.importorskip('websockets')
+
+
+class Chain:
+    """ A chain that only grows when told to, and the balance of every account on it """
+    def __init__(self):
+        self.number = 10
+        self.balance = 0
+        self.calls: dict = {}
+
+    def rpc(self, method, params):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == 'eth_blockNumber':
+            return hex(self.number)
+        if method == 'eth_getBalance':
+            return hex(self.balance)
+        if method == 'eth_newBlockFilter':
+            self.seen = self.number
+            return '0x1'
+        if method == 'eth_getFilterChanges':
+            changes = ['0x' + f'{n:064x}' for n in range(self.seen + 1, self.number + 1)]
+            self.seen = self.number
+            return changes
+        if method == 'eth_uninstallFilter':
+            return True
+        raise ValueError(method)
+
+
+@pytest.fixture()
+def chain(json_rpc_server):
+    chain = Chain()
+    chain.url = json_rpc_server(chain.rpc).url
+    return chain
+
+
+def mine(chain, blocks=1, delay=0.1):
+    def _mine():
+        for _ in range(blocks):
+            time.sleep(delay)
+            chain.number += 1
+    threading.Thread(target=_mine, daemon=True).start()
+
+
+def test_websocket_url():
+    assert websocket_url('http://contract:9545') == 'ws://contract:9545'
+    assert websocket_url('https://node.io/eth') == 'wss://node.io/eth'
+
+
+def test_one_watcher_per_node(chain, monkeypatch):
+    monkeypatch.setattr(blocks, '_watchers', {})
+    watcher = block_watcher(chain.url)
+    assert watcher.ws_url == websocket_url(chain.url)
+
+    # the first endpoint given is the one used
+    assert block_watcher(chain.url, ws_url=None) is watcher and watcher.ws_url is None
+    assert block_watcher(chain.url, ws_url='ws://elsewhere') is watcher and watcher.ws_url is None
+    assert block_watcher(chain.url) is watcher
+
+
+def test_polling(chain):
+    watcher = BlockWatcher(chain.url, ws_url=None, poll_interval=0.05)
+    try:
+        receipt = SimpleNamespace(blockNumber=10)
+        assert watcher.wait_for_confirmations(receipt, 0)
+        assert not watcher.wait_for_confirmations(receipt, 1, timeout=0.2)
+
+        mine(chain, 3)
+        assert watcher.wait_for_confirmations(receipt, 3, timeout=5)
+
+        mine(chain, 2)
+        chain.balance = 100
+        assert watcher.wait_for_balance('0x90F8bf6A479f320ead074411a4B0e7944Ea8c9C1', 100, timeout=5)
+    finally:
+        watcher.stop()
+
+
+def test_idle_watcher_stops_polling(chain):
+    watcher = BlockWatcher(chain.url, ws_url=None, poll_interval=0.05)
+    try:
+        mine(chain)
+        assert watcher.wait_for_block(10, timeout=5) == 11
+        time.sleep(0.2)
+        calls = dict(chain.calls)
+        time.sleep(0.3)
+        # nobody waits, so nobody asks the node
+        assert chain.calls == calls and calls['eth_uninstallFilter'] == 1
+
+        mine(chain)
+        assert watcher.wait_for_block(11, timeout=5) == 12
+        assert chain.calls['eth_newBlockFilter'] == 2
+    finally:
+        watcher.stop()
+
+
+def test_waiters_share_the_watcher(chain):
+    watcher = BlockWatcher(chain.url, ws_url=None, poll_interval=0.05)
+    results = []
+    threads = [threading.Thread(target=lambda n=n: results.append(watcher.wait_for_block(n, timeout=5)))
+               for n in range(10, 13)]
+    try:
+        for thread in threads:
+            thread.start()
+        mine(chain, 3)
+        for thread in threads:
+            thread.join()
+        assert sorted(results) == [11, 12, 13]
+        assert chain.calls['eth_newBlockFilter'] == 1
+    finally:
+        watcher.stop()
+
+
+@pytest.mark.skipif(sys.version_info >= (3, 10) and int(websockets.__version__.split('.')[0]) < 10,
+                    reason='this websockets client predates this python')
+def test_websocket(chain):
+    subscribed = threading.Event()
+
+    async def handler(ws, _path=None):
+        request = json.loads(await ws.recv())
+        assert request['method'] == 'eth_subscribe' and request['params'] == ['newHeads']
+        await ws.send(json.dumps({'jsonrpc': '2.0', 'id': request['id'], 'result': '0xabc'}))
+        subscribed.set()
+        while True:
+            await asyncio.sleep(0.05)
+            chain.number += 1
+            await ws.send(json.dumps({'jsonrpc': '2.0', 'method': 'eth_subscription',
+                                      'params': {'subscription': '0xabc', 'result': {'number': hex(chain.number)}}}))
+
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(websockets.serve(handler, '127.0.0.1', 0))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    port = server.sockets[0].getsockname()[1]
+
+    watcher = BlockWatcher(chain.url, ws_url=f'ws://127.0.0.1:{port}')
+    try:
+        assert watcher.wait_for_block(13, timeout=5) is not None
+        assert subscribed.is_set()
+        assert 'eth_newBlockFilter' not in chain.calls
+    finally:
+        watcher.stop()
+        loop.call_soon_threadsafe(server.close)
+        loop.call_soon_threadsafe(loop.stop)
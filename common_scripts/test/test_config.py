@@ -0,0 +1,122 @@
+import json
+import os
+import threading
+
+import pytest
+
+from enigma_docker_common.config import Config, ConfigError, Field, ReloadableConfig, load_config
+
+SCHEMA = {'MIN_CONFIRMATIONS': Field(int, required=True),
+          'MINIMUM_ETHER_BALANCE': Field(float, required=True),
+          'AUTO_MINER': Field(bool, default=False),
+          'CONTRACT_FILES': Field(list, default=[]),
+          'CONTRACT_TIMEOUT': Field(float, default=3600)}
+
+
+@pytest.fixture()
+def config_file(tmp_path):
+    path = tmp_path / 'compose_config.json'
+    path.write_text(json.dumps({'MIN_CONFIRMATIONS': 12, 'MINIMUM_ETHER_BALANCE': '0.1', 'CORE_PORT': '5552',
+                                'CONTRACT_FILES': ['enigmacontract.txt']}))
+    return str(path)
+
+
+def test_resolve(config_file, monkeypatch):
+    monkeypatch.setenv('AUTO_MINER', 'true')
+    monkeypatch.setenv('MIN_CONFIRMATIONS', '3')
+    config = Config(config_file=config_file).resolve(SCHEMA)
+
+    # environment first, then the config file, then the default
+    assert config['MIN_CONFIRMATIONS'] == 3
+    assert config['MINIMUM_ETHER_BALANCE'] == 0.1
+    assert config['AUTO_MINER'] is True
+    assert config['CONTRACT_FILES'] == ['enigmacontract.txt']
+    assert config['CONTRACT_TIMEOUT'] == 3600.0
+    # not in the schema -- as it is in the file
+    assert config['CORE_PORT'] == '5552'
+    with pytest.raises(TypeError):
+        config['CORE_PORT'] = '1234'  # type: ignore
+
+
+def test_environment_fallthrough(config_file, monkeypatch):
+    config = Config(config_file=config_file).resolve(SCHEMA)
+    monkeypatch.setenv('FORCE_NEW_ETH_ADDR', '1')
+    assert config.get('FORCE_NEW_ETH_ADDR') == '1'
+    assert config.get('NOT_SET_ANYWHERE', 'default') == 'default'
+
+
+def test_all_errors_reported(config_file, monkeypatch):
+    monkeypatch.setenv('MIN_CONFIRMATIONS', 'twelve')
+    monkeypatch.setenv('AUTO_MINER', 'maybe')
+    with pytest.raises(ConfigError) as e:
+        load_config({**SCHEMA, 'DEPOSIT_AMOUNT': Field(int, required=True)}, config_file=config_file,
+                    required=['ETH_NODE_ADDRESS'], cache_dir='')
+    assert len(e.value.errors) == 4
+    assert all(any(key in error for error in e.value.errors)
+               for key in ('MIN_CONFIRMATIONS', 'AUTO_MINER', 'DEPOSIT_AMOUNT', 'ETH_NODE_ADDRESS'))
+
+
+def test_cache(config_file, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    resolved = load_config(SCHEMA, config_file=config_file, cache_dir=cache_dir)
+
+    calls = []
+    monkeypatch.setattr(Config, 'resolve', lambda self, schema: calls.append(schema))
+    cached = load_config(SCHEMA, config_file=config_file, cache_dir=cache_dir)
+    assert dict(cached) == dict(resolved)
+    assert not calls
+
+    # an environment variable overriding one of the values makes it resolve again
+    monkeypatch.undo()
+    monkeypatch.setenv('MINIMUM_ETHER_BALANCE', '0.5')
+    assert load_config(SCHEMA, config_file=config_file, cache_dir=cache_dir)['MINIMUM_ETHER_BALANCE'] == 0.5
+
+
+def test_reload(config_file):
+    config = ReloadableConfig(SCHEMA, config_file=config_file)
+    before = config.snapshot
+    changes = []
+    config.subscribe(lambda snapshot, changed: changes.append(changed), keys=['MIN_CONFIRMATIONS'])
+    config.subscribe(lambda snapshot, changed: changes.append('core port'), keys=['CORE_PORT'])
+    config.subscribe(lambda snapshot, changed: changes.append('any'))
+
+    with open(config_file) as f:
+        values = json.load(f)
+    values['MIN_CONFIRMATIONS'] = 6
+    _write(config_file, values)
+    assert config.reload() == {'MIN_CONFIRMATIONS'}
+    assert config['MIN_CONFIRMATIONS'] == 6
+    assert changes == [{'MIN_CONFIRMATIONS'}, 'any']
+    # whoever held the old snapshot still has a consistent view
+    assert before['MIN_CONFIRMATIONS'] == 12
+
+    # written again with the same values -- nothing to tell anyone
+    _write(config_file, values)
+    assert config.reload() == set()
+    assert changes == [{'MIN_CONFIRMATIONS'}, 'any']
+
+    # invalid -- the last good configuration stays
+    _write(config_file, {**values, 'MIN_CONFIRMATIONS': 'six'})
+    assert config.reload() == set()
+    assert config['MIN_CONFIRMATIONS'] == 6
+
+
+def test_watch(config_file):
+    config = ReloadableConfig(SCHEMA, config_file=config_file).watch(interval=0.05)
+    changed = threading.Event()
+    config.subscribe(lambda *_: changed.set())
+    try:
+        with open(config_file) as f:
+            values = json.load(f)
+        _write(config_file, {**values, 'CONTRACT_TIMEOUT': 10})
+        assert changed.wait(5)
+        assert config['CONTRACT_TIMEOUT'] == 10.0
+    finally:
+        config.stop()
+
+
+def _write(path, values):
+    # replaced, the way editors and ConfigMaps do it
+    with open(f'{path}.new', 'w') as f:
+        json.dump(values, f)
+    os.replace(f'{path}.new', path)
@@ -1,4 +1,16 @@
-from enigma_docker_common.crypto import encrypt, decrypt, EthereumKey, address_from_private, auto_w3
+import io
+import os
+
+import pytest
+from Crypto.Hash import keccak
+from eth_account import Account
+
+from web3.auto import w3 as auto_w3
+
+from enigma_docker_common.crypto import encrypt, decrypt, EthereumKey, address_from_private
+from enigma_docker_common.crypto import BACKENDS, EcdsaBackend, checksum_address_from_private, pubkey_to_addr, \
+    public_key_from_private, sign_hash
+from enigma_docker_common.crypto import decrypt_stream, encrypt_stream
 
 
 def test_enc_dec():
@@ -24,3 +36,60 @@ def test_ethereum_key():
                            address='0x63C15192B8ED7294129b76A5a870bCFBf8D4c856')
 
     assert eth_key == expected
+
+
+def test_sign_hash():
+    key = '0x6c7adb28f9462347bcb30524030ed2f3e61a3bdf84e881a18b0c505d72b434d2'
+    digest = keccak.new(digest_bits=256, data=b'enigma').digest()
+    expected = Account.signHash(digest, key)
+
+    signature = sign_hash(key, digest)
+    assert int.from_bytes(signature[:32], 'big') == expected.r
+    assert int.from_bytes(signature[32:64], 'big') == expected.s
+    assert signature[64] + 27 == expected.v
+
+
+@pytest.mark.skipif('coincurve' not in BACKENDS, reason='coincurve is not installed')
+def test_backends_agree():
+    private_key = EcdsaBackend().generate()
+    digest = keccak.new(digest_bits=256, data=b'enigma').digest()
+    results = [(b().public_key(private_key), b().sign(private_key, digest)) for b in BACKENDS.values()]
+    assert all(result == results[0] for result in results)
+
+
+def test_address_memoized_by_public_key():
+    key = '0x61cabe95221171f4ee1d90d916a5f7f130f79c73dc818b3b38db734ab75ee55c'
+    EthereumKey(key=key)
+    hits = pubkey_to_addr.cache_info().hits
+    assert EthereumKey(key=key).address == '0x63C15192B8ED7294129b76A5a870bCFBf8D4c856'
+    assert pubkey_to_addr.cache_info().hits == hits + 1
+    # nothing is cached by private key
+    assert not hasattr(checksum_address_from_private, 'cache_info')
+    assert not hasattr(public_key_from_private, 'cache_info')
+
+
+@pytest.mark.parametrize('size', [0, 1, 1000, 64 * 1024 + 3])
+def test_stream_round_trip(size):
+    plaintext = os.urandom(size)
+
+    encrypted = io.BytesIO()
+    assert encrypt_stream(io.BytesIO(plaintext), encrypted, 'cupcake', chunk_size=4096) == size + 16
+    # same format as encrypt
+    assert decrypt('cupcake', encrypted.getvalue()) == plaintext
+
+    decrypted = bytearray(size)
+    assert decrypt_stream(memoryview(encrypted.getvalue()), decrypted, 'cupcake', chunk_size=4096) == size
+    assert decrypted == plaintext
+
+
+def test_stream_into_buffer():
+    plaintext = os.urandom(10000)
+    buffer = bytearray(len(plaintext) + 16)
+    encrypt_stream(memoryview(plaintext), buffer, 'cupcake', chunk_size=1024)
+
+    decrypted = io.BytesIO()
+    decrypt_stream(io.BytesIO(buffer), decrypted, 'cupcake')
+    assert decrypted.getvalue() == plaintext
+
+    with pytest.raises(ValueError):
+        encrypt_stream(plaintext, bytearray(len(plaintext)), 'cupcake')
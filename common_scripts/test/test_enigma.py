@@ -0,0 +1,128 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from enigma_docker_common.enigma import Contract, FixedGasPrice, GasOracle, GasPriceStrategy, NonceManager, \
+    PercentileGasPrice, nonce_manager
+
+SENDER = '0x90F8bf6A479f320ead074411a4B0e7944Ea8c9C1'
+
+
+class Node:
+    """ Just enough of web3 for NonceManager: counts how often it's asked for the transaction count """
+    def __init__(self, count: int):
+        self.count = count
+        self.asked = 0
+        self.eth = SimpleNamespace(getTransactionCount=self.get_transaction_count)
+
+    def get_transaction_count(self, address, block_identifier):
+        assert address == SENDER and block_identifier == 'pending'
+        self.asked += 1
+        return self.count
+
+
+def test_reserve():
+    node = Node(5)
+    nonces = NonceManager(node)
+    assert [nonces.reserve(SENDER) for _ in range(3)] == [5, 6, 7]
+    assert node.asked == 1
+
+
+def test_release():
+    node = Node(5)
+    nonces = NonceManager(node)
+    first, second = nonces.reserve(SENDER), nonces.reserve(SENDER)
+    nonces.release(SENDER, second)
+    assert nonces.reserve(SENDER) == second
+
+    # a nonce from the middle can't be reused -- the node is asked again
+    nonces.release(SENDER, first)
+    node.count = 7
+    assert nonces.reserve(SENDER) == 7
+    assert node.asked == 2
+
+
+def test_failed_send_asks_the_node_again():
+    node = Node(5)
+    contract = Contract.__new__(Contract)
+    contract.nonces = NonceManager(node)
+    contract.build = lambda sender, func, *args, nonce: {'nonce': nonce}
+    contract._sign = lambda transaction, key: SimpleNamespace(rawTransaction=b'', hash=b'')  # pylint: disable=protected-access
+
+    def send_raw_transaction(raw_transaction):
+        raise ValueError({'code': -32000, 'message': 'nonce too low'})
+    contract.w3 = SimpleNamespace(eth=SimpleNamespace(sendRawTransaction=send_raw_transaction))
+
+    with pytest.raises(ValueError):
+        contract.send(SENDER, None, 'transfer')
+    # the account was used somewhere else: 5 is gone, and so are 6 and 7
+    node.count = 8
+    assert contract.nonces.reserve(SENDER) == 8
+    assert node.asked == 2
+
+
+def test_shared_per_node():
+    node = Node(0)
+    assert nonce_manager('http://node-a:8545', node) is nonce_manager('http://node-a:8545', node)
+    assert nonce_manager('http://node-a:8545', node) is not nonce_manager('http://node-b:8545', node)
+
+
+class Chain:
+    """ Just enough of web3 for the gas oracle: blocks with the given transaction gas prices """
+    def __init__(self, blocks, gas_price=1000):
+        self.blocks = blocks
+        self.fetched = []
+        self.gasPrice = gas_price  # pylint: disable=invalid-name
+        self.eth = self
+
+    @property
+    def blockNumber(self):  # pylint: disable=invalid-name
+        return len(self.blocks) - 1
+
+    def getBlock(self, number, full_transactions=False):  # pylint: disable=invalid-name
+        assert full_transactions
+        self.fetched.append(number)
+        return {'transactions': [{'gasPrice': price} for price in self.blocks[number]]}
+
+
+class Counting(GasPriceStrategy):
+    def __init__(self):
+        self.calls = 0
+
+    def estimate(self, w3):
+        self.calls += 1
+        time.sleep(0.05)
+        return 100 * self.calls
+
+
+def test_gas_price_capped():
+    assert GasOracle(Chain([]), FixedGasPrice(10), cap=50).price() == 10
+    assert GasOracle(Chain([]), FixedGasPrice(100), cap=50).price() == 50
+
+
+def test_gas_price_cached():
+    strategy = Counting()
+    oracle = GasOracle(Chain([]), strategy, cap=10 ** 9, ttl=0.2)
+    assert oracle.price() == 100
+    assert oracle.price() == 100 and strategy.calls == 1
+
+    # stale: served as is, while a fresh estimate is fetched
+    time.sleep(0.25)
+    assert oracle.price() == 100
+    time.sleep(0.1)
+    assert oracle.price() == 200 and strategy.calls == 2
+
+
+def test_gas_price_percentile():
+    chain = Chain([[1], [10, 20], [30, 40, 50]])
+    strategy = PercentileGasPrice(percentile=50, blocks=2)
+    assert strategy.estimate(chain) == 30
+    assert chain.fetched == [1, 2]
+
+    chain.blocks.append([])
+    assert strategy.estimate(chain) == 40
+    assert chain.fetched == [1, 2, 3]
+
+    # no transactions at all -- what the node suggests
+    assert PercentileGasPrice(blocks=1).estimate(chain) == 1000
@@ -0,0 +1,87 @@
+import gzip
+import json
+import os
+import threading
+import time
+
+import pytest
+from flask import Flask, request
+
+from enigma_docker_common.file_cache import FileCache
+
+app = Flask(__name__)
+
+
+@pytest.fixture
+def abi_file(tmp_path):
+    path = tmp_path / 'Enigma.json'
+    path.write_text(json.dumps({'abi': [{'name': 'register'}] * 100}))
+    return str(path)
+
+
+def test_cached_until_modified(abi_file):
+    cache = FileCache()
+    first = cache.get(abi_file)
+    assert cache.get(abi_file) is first
+    assert json.loads(first.body) == first.text
+
+    with open(abi_file, 'a') as f:
+        f.write(' ')
+    os.utime(abi_file, ns=(0, 0))
+    second = cache.get(abi_file)
+    assert second is not first
+    assert second.etag != first.etag
+
+
+def test_conditional_get(abi_file):
+    entry = FileCache().get(abi_file)
+    with app.test_request_context(headers={'If-None-Match': f'"{entry.etag}"'}):
+        resp = entry.response(request)
+    assert resp.status_code == 304
+    assert resp.get_data() == b''
+
+    with app.test_request_context(headers={'If-None-Match': '"stale"'}):
+        assert entry.response(request).status_code == 200
+
+
+def test_compressed_when_accepted(abi_file):
+    entry = FileCache().get(abi_file)
+    with app.test_request_context(headers={'Accept-Encoding': 'gzip, deflate'}):
+        resp = entry.response(request)
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(resp.get_data()) == entry.body
+
+    with app.test_request_context():
+        resp = entry.response(request)
+    assert 'Content-Encoding' not in resp.headers
+    assert resp.get_data() == entry.body
+
+
+def test_missing_file(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        FileCache().get(str(tmp_path / 'missing.json'))
+
+
+def test_watch_until_published(tmp_path):
+    path = tmp_path / 'principal-sign-addr.txt'
+    threading.Timer(0.3, path.write_text, ('0x1234',)).start()
+    start = time.monotonic()
+
+    entry = FileCache().watch(str(path), timeout=5)
+    assert entry.text == '0x1234'
+    assert time.monotonic() - start < 1
+
+
+def test_watch_response_times_out(abi_file):
+    cache = FileCache()
+    etag = cache.get(abi_file).etag
+    with app.test_request_context('/?wait=0.3', headers={'If-None-Match': f'"{etag}"'}):
+        assert cache.watch_response(abi_file, request).status_code == 304
+    with app.test_request_context('/?wait=0.3'):
+        assert cache.watch_response(abi_file, request).status_code == 200
+
+
+def test_watch_response_bad_wait(abi_file):
+    for wait in ('abc', '-1', 'nan'):
+        with app.test_request_context(f'/?wait={wait}'):
+            assert FileCache().watch_response(abi_file, request).status_code == 400
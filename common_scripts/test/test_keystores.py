@@ -0,0 +1,90 @@
+import json
+import os
+
+import pytest
+
+from enigma_docker_common.crypto import EthereumKey, open_eth_keystore
+from enigma_docker_common.keystores import INDEX_SUFFIX, KeystoreFile, generate_keystore_file, generate_keystores, \
+    open_keystore
+
+
+def test_generate_keystores(tmp_path):
+    report = generate_keystores(6, str(tmp_path), password='cupcake', workers=2)
+
+    assert report.generated == 6
+    assert len(report.index) == 6
+    with open(report.index_path) as f:
+        assert json.load(f) == report.index
+    for address, directory in report.index.items():
+        assert open_eth_keystore(directory, {}, password='cupcake', create=False).address == address
+
+
+def test_resume(tmp_path):
+    first = generate_keystores(2, str(tmp_path), workers=1)
+    second = generate_keystores(3, str(tmp_path), workers=1)
+
+    assert second.generated == 1
+    assert first.index.items() <= second.index.items()
+
+    # interrupted between the two files: written again, and counted
+    os.remove(os.path.join(list(second.index.values())[0], 'eth_address.txt'))
+    assert generate_keystores(3, str(tmp_path), workers=1).generated == 1
+
+
+def test_keystore_file(tmp_path):
+    path = str(tmp_path / 'workers.keys')
+    report = generate_keystore_file(4, path, password='cupcake', workers=2)
+    keystore = KeystoreFile(path)
+    assert sorted(keystore.addresses()) == sorted(report.index)
+
+    key = '0x61cabe95221171f4ee1d90d916a5f7f130f79c73dc818b3b38db734ab75ee55c'
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        before = f.read()
+    assert keystore.add(key, password='cupcake') == '0x63C15192B8ED7294129b76A5a870bCFBf8D4c856'
+    # appended, nothing before it rewritten
+    with open(path, 'rb') as f:
+        assert f.read(size) == before
+    assert keystore.add(key, password='cupcake') == '0x63C15192B8ED7294129b76A5a870bCFBf8D4c856'
+    assert len(keystore) == 5
+
+    loaded = open_keystore(path, {}, password='cupcake', address='0x63c15192b8ed7294129b76a5a870bcfbf8d4c856')
+    assert loaded == EthereumKey(key=key, address='0x63C15192B8ED7294129b76A5a870bCFBf8D4c856')
+    with pytest.raises(KeyError):
+        KeystoreFile(path).get('0x' + '00' * 20)
+    for password in ('cupcakes', ''):
+        with pytest.raises(ValueError):
+            KeystoreFile(path).get(loaded.address, password=password)
+
+
+def test_keystore_file_create(tmp_path):
+    path = str(tmp_path / 'worker.keys')
+    created = open_keystore(path, {}, password='cupcake')
+    assert open_keystore(path, {}, password='cupcake', create=False, address=created.address) == created
+
+
+def test_keystore_file_index(tmp_path):
+    path = str(tmp_path / 'workers.keys')
+    # records of made up keys: generating real ones takes too long without coincurve
+    records = [(f'0x{address.hex()}', address + bytes(1 + 16) + os.urandom(32))
+               for address in (os.urandom(20) for _ in range(512))]
+    assert KeystoreFile(path).append(records) == 512
+    index_size = os.path.getsize(path + INDEX_SUFFIX)
+
+    # appended by another process: found, and the index is updated in place until it would be more than half full
+    keystore = KeystoreFile(path)
+    assert len(keystore) == 512
+    added = KeystoreFile(path).add('0x61cabe95221171f4ee1d90d916a5f7f130f79c73dc818b3b38db734ab75ee55c')
+    assert added in keystore and len(keystore) == 513
+    assert os.path.getsize(path + INDEX_SUFFIX) == 2 * index_size - 20
+
+    for address, _ in records[::50]:
+        assert address in keystore
+    assert keystore.get(added).address == added
+    # found through the index, nothing had to be indexed in memory
+    assert not keystore._unindexed  # pylint: disable=protected-access
+
+    # an index that was lost is built again
+    os.remove(path + INDEX_SUFFIX)
+    assert added in KeystoreFile(path)
+    assert os.path.exists(path + INDEX_SUFFIX)
@@ -0,0 +1,74 @@
+import time
+
+import pytest
+
+from enigma_docker_common.provider import Provider, registry
+
+
+class Discovery:
+    """ contract_server without a bundle endpoint. Counts the requests for each path, and takes `delay` seconds to
+    answer each address """
+    addresses = {'enigmacontract.txt': '0x1234', 'enigmatokencontract.txt': '0x5678'}
+    hits: dict = {}
+    delay = 0.0
+
+    @classmethod
+    def answer(cls, request):
+        cls.hits[request.path] = cls.hits.get(request.path, 0) + 1
+        path, _, name = request.path.partition('?name=')
+        if path == '/contract/address':
+            time.sleep(cls.delay)
+        if path == '/contract/address' and name in cls.addresses:
+            return 200, cls.addresses[name]
+        return 404, {}
+
+
+@pytest.fixture()
+def config(http_server, monkeypatch):
+    Discovery.hits = {}
+    monkeypatch.setenv('ENIGMA_ENV', 'COMPOSE')
+    yield {'CONTRACT_DISCOVERY_ADDRESS': http_server(Discovery.answer).url}
+    registry.invalidate()
+
+
+def test_artifacts_shared_between_providers(config):
+    assert Provider(config).enigma_contract_address == '0x1234'
+    assert Provider(config).enigma_contract_address == '0x1234'
+    assert Provider(config).token_contract_address == '0x5678'
+
+    assert Discovery.hits['/contract/address?name=enigmacontract.txt'] == 1
+    assert Discovery.hits['/contract/address?name=enigmatokencontract.txt'] == 1
+
+
+def test_only_active_environment_backends(config):
+    _ = Provider(config).enigma_contract_address
+    # pylint: disable=protected-access
+    assert {key[:2] for key in registry._backends if key[2] == config['CONTRACT_DISCOVERY_ADDRESS']} == \
+        {('contract', 'COMPOSE')}
+
+
+def test_invalidate(config, monkeypatch):
+    provider = Provider(config)
+    _ = provider.enigma_contract_address
+    monkeypatch.setitem(Discovery.addresses, 'enigmacontract.txt', '0x9999')
+    assert provider.enigma_contract_address == '0x1234'
+
+    Provider.invalidate()
+    assert provider.enigma_contract_address == '0x9999'
+    assert Discovery.hits['/contract/address?name=enigmacontract.txt'] == 2
+
+
+def test_prefetch(config, monkeypatch):
+    monkeypatch.setattr(Discovery, 'delay', 0.3)
+    provider = Provider(config)
+    start = time.monotonic()
+    results = provider.prefetch(['enigma_contract_address', 'token_contract_address', 'voting_contract_address'])
+
+    # one slow fetch's worth of time, not three
+    assert time.monotonic() - start < 0.6
+    assert results['enigma_contract_address'].ok and results['token_contract_address'].ok
+    assert isinstance(results['voting_contract_address'].error, IndexError)
+
+    start = time.monotonic()
+    assert provider.enigma_contract_address == '0x1234'
+    assert time.monotonic() - start < 0.1
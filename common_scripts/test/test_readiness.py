@@ -0,0 +1,87 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from enigma_docker_common import readiness
+from enigma_docker_common.readiness import Target
+
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    readiness.forget()
+    yield
+    readiness.forget()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def listen_later(port: int, delay: float) -> socket.socket:
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    def listen():
+        time.sleep(delay)
+        sock.bind(('127.0.0.1', port))
+        sock.listen()
+
+    threading.Thread(target=listen, daemon=True).start()
+    return sock
+
+
+@pytest.fixture
+def health_server(http_server):
+    return http_server(lambda request: (200 if request.path == '/health' else 503, b'')).url
+
+
+def test_parse():
+    assert Target.parse('contract:8081') == Target('contract', 8081)
+    assert Target.parse('tcp://contract:8081') == Target('contract', 8081)
+    assert Target.parse('http://contract:8081/health') == Target('contract', 8081, 'http://contract:8081/health')
+    assert Target.endpoint('http://contract:9545') == Target('contract', 9545)
+    with pytest.raises(ValueError):
+        Target.parse('contract')
+
+
+def test_waits_for_all_targets_concurrently():
+    ports = [free_port() for _ in range(3)]
+    sockets = [listen_later(port, 0.3) for port in ports]
+    start = time.monotonic()
+    readiness.wait_for(*(f'127.0.0.1:{port}' for port in ports), timeout=5, backoff=0.05)
+
+    # one after another it would take 3x as long
+    assert time.monotonic() - start < 0.8
+    for sock in sockets:
+        sock.close()
+
+
+def test_http_target(health_server):
+    readiness.wait_for(f'{health_server}/health', timeout=2)
+    assert not readiness.probe(f'{health_server}/other')
+
+
+def test_timeout_lists_the_missing_targets(health_server):
+    missing = f'127.0.0.1:{free_port()}'
+    with pytest.raises(TimeoutError) as e:
+        readiness.wait_for(f'{health_server}/health', missing, timeout=0.3, backoff=0.05)
+    assert missing in str(e.value)
+    assert health_server not in str(e.value)
+
+
+def test_ready_targets_are_remembered():
+    port = free_port()
+    sock = listen_later(port, 0)
+    readiness.wait_for(f'127.0.0.1:{port}', timeout=2, backoff=0.05)
+    sock.close()
+
+    # the listener is gone, but we already know the service came up
+    assert readiness.is_ready(f'127.0.0.1:{port}')
+    readiness.wait_for(f'127.0.0.1:{port}', timeout=0)
+
+    readiness.forget(f'127.0.0.1:{port}')
+    assert not readiness.is_ready(f'127.0.0.1:{port}')
@@ -0,0 +1,103 @@
+import pytest
+
+from enigma_docker_common.provider import Provider, registry
+from enigma_docker_common.snapshot import Snapshot, SnapshotContainer, open_snapshot, write_snapshot
+from enigma_docker_common.storage import IndexableContainer
+
+
+class DictBackend(IndexableContainer[str]):
+    def __init__(self, items: dict):
+        self.items = items
+
+    def __getitem__(self, key: str) -> str:
+        if key not in self.items:
+            raise IndexError(key)
+        return self.items[key]
+
+
+ARTIFACT = {'contractName': 'Enigma', 'abi': [], 'selectors': {}, 'networks': {'4447': {'address': '0x1234'}}}
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'artifacts.snapshot')
+    write_snapshot(path, {'contract': {'enigmacontract.txt': '0x1234'}, 'abi': {'Enigma.json': b'{"abi": []}'},
+                          'artifact': {'Enigma.json': ARTIFACT}}, env='COMPOSE')
+
+    snapshot = Snapshot(path)
+    assert snapshot.env == 'COMPOSE'
+    assert snapshot.get('contract', 'enigmacontract.txt') == '0x1234'
+    assert snapshot.get('abi', 'Enigma.json') == b'{"abi": []}'
+    assert snapshot.get('artifact', 'Enigma.json') == ARTIFACT
+    assert ('contract', 'Enigma.json') not in snapshot
+    with pytest.raises(IndexError):
+        snapshot.get('contract', 'Enigma.json')
+
+
+def test_not_a_snapshot(tmp_path):
+    path = tmp_path / 'artifacts.snapshot'
+    path.write_bytes(b'{"this is": "json"}')
+    with pytest.raises(ValueError):
+        Snapshot(str(path))
+
+
+def test_container_fallback(tmp_path):
+    path = str(tmp_path / 'artifacts.snapshot')
+    container = SnapshotContainer(path, 'contract', fallback=DictBackend({'votingcontract.txt': '0x9999'}))
+
+    # no snapshot yet -- everything comes from the fallback
+    assert container['votingcontract.txt'] == '0x9999'
+
+    write_snapshot(path, {'contract': {'votingcontract.txt': '0x1234'}})
+    assert container['votingcontract.txt'] == '0x1234'
+    assert SnapshotContainer(path, 'contract')['votingcontract.txt'] == '0x1234'
+    with pytest.raises(IndexError):
+        _ = SnapshotContainer(path, 'contract')['samplecontract.txt']
+
+
+def test_replaced_snapshot_reopened(tmp_path):
+    path = str(tmp_path / 'artifacts.snapshot')
+    write_snapshot(path, {'contract': {'enigmacontract.txt': '0x1234'}})
+    first = open_snapshot(path)
+    assert open_snapshot(path) is first
+
+    write_snapshot(path, {'contract': {'enigmacontract.txt': '0x5678'}})
+    assert open_snapshot(path).get('contract', 'enigmacontract.txt') == '0x5678'
+    # whoever still holds the old one can keep reading it
+    assert first.get('contract', 'enigmacontract.txt') == '0x1234'
+
+
+def test_provider_reads_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setenv('ENIGMA_ENV', 'COMPOSE')
+    path = str(tmp_path / 'artifacts.snapshot')
+    write_snapshot(path, {'contract': {'enigmacontract.txt': '0x1234'}, 'km': {'principal-sign-addr.txt': '0xabcd'},
+                          'artifact': {'Enigma.json': ARTIFACT}})
+    # nothing listens there, so any request would fail
+    provider = Provider({'CONTRACT_DISCOVERY_ADDRESS': 'http://127.0.0.1:1', 'KEY_MANAGEMENT_DISCOVERY':
+                         'http://127.0.0.1:1', 'DISCOVERY_RETRIES': 0, 'ARTIFACT_SNAPSHOT': path})
+    try:
+        assert provider.enigma_contract_address == '0x1234'
+        assert provider.wait_for('principal_address', timeout=1) == '0xabcd'
+        assert provider.enigma_artifact.address('4447') == '0x1234'
+    finally:
+        registry.invalidate()
+
+
+def test_provider_writes_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setenv('ENIGMA_ENV', 'COMPOSE')
+    source = str(tmp_path / 'source.snapshot')
+    write_snapshot(source, {'contract': {'enigmacontract.txt': '0x1234', 'enigmatokencontract.txt': '0x5678'},
+                            'artifact': {'Enigma.json': ARTIFACT, 'EnigmaToken.json': ARTIFACT}})
+    provider = Provider({'CONTRACT_DISCOVERY_ADDRESS': 'http://127.0.0.1:1', 'KEY_MANAGEMENT_DISCOVERY':
+                         'http://127.0.0.1:1', 'CONTRACT_TIMEOUT': 0.5, 'KEY_MANAGEMENT_TIMEOUT': 0.5,
+                         'DISCOVERY_RETRIES': 0, 'ARTIFACT_SNAPSHOT': source})
+    path = str(tmp_path / 'artifacts.snapshot')
+    try:
+        results = provider.write_snapshot(path)
+    finally:
+        registry.invalidate()
+
+    assert not results['principal_address'].ok
+    snapshot = Snapshot(path)
+    assert snapshot.entries.keys() == {'contract', 'artifact'}
+    assert snapshot.get('contract', 'enigmacontract.txt') == '0x1234'
+    assert snapshot.get('artifact', 'Enigma.json') == ARTIFACT
@@ -1,6 +1,12 @@
+import os
+import threading
+import time
+
 import pytest
+import requests
 
-from common_scripts.enigma_docker_common.storage import LocalStorage
+from common_scripts.enigma_docker_common.storage import AzureClientPool, AzureContainerFileService, CachedContainer, \
+    DiscoveryBundle, HttpFileService, IndexableContainer, LocalStorage, _CacheStore
 
 @pytest.fixture(scope='module')
 def localstorage():
@@ -14,3 +20,283 @@ def test_read_write_file(localstorage):
     content = localstorage["file"]
 
     assert content == expected
+
+
+@pytest.fixture(scope='module')
+def blobs():
+    from .bench_storage import LocalBlobService
+    data = {'small': b'enigma' * 1000, 'large': os.urandom(300 * 1024)}
+    fs = LocalBlobService(data, chunk_size=4096)
+    fs.parallel_threshold = 100 * 1024
+    yield fs, data
+
+
+@pytest.mark.parametrize('item', ['small', 'large'])
+def test_blob_get(blobs, item):
+    fs, data = blobs
+    assert fs.get(item) == data[item]
+    assert fs[item] == data[item]
+
+
+@pytest.mark.parametrize('item', ['small', 'large'])
+def test_blob_stream_to(blobs, item, tmp_path):
+    fs, data = blobs
+    target = tmp_path / 'nested' / item
+    written = fs.stream_to(item, target)
+
+    assert written == len(data[item])
+    assert target.read_bytes() == data[item]
+    assert not (tmp_path / 'nested' / f'{item}.part').exists()
+
+
+def test_blob_not_found(blobs):
+    fs, _ = blobs
+    with pytest.raises(IndexError):
+        fs.get('missing')
+
+
+def test_azure_client_pool_shares_clients():
+    pool = AzureClientPool()
+    first = AzureContainerFileService('contract', pool=pool)
+    second = AzureContainerFileService('contract', pool=pool)
+    public = AzureContainerFileService('public', pool=pool)
+
+    container = pool.container(first.account_url, 'contract', first.credential)
+    assert container is pool.container(second.account_url, 'contract', second.credential)
+    # pylint: disable=protected-access
+    assert first._blob_client('a')._pipeline is public._blob_client('b')._pipeline
+    pool.clear()
+
+
+class CountingBackend(IndexableContainer):
+    """ Backend that versions every item with an ETag and counts how often it was hit """
+    def __init__(self, items: dict):
+        self.items = items
+        self.downloads = 0
+        self.revalidations = 0
+
+    def __getitem__(self, key):
+        return self.fetch(key)[0]
+
+    def fetch(self, key, validators=None):
+        etag = repr(self.items[key])
+        if validators and validators.get('etag') == etag:
+            self.revalidations += 1
+            return None
+        self.downloads += 1
+        return self.items[key], {'etag': etag}
+
+
+def test_cached_container_serves_from_disk(tmp_path):
+    backend = CountingBackend({'address': '0xabc', 'abi': b'{"abi": []}', 'config': {'a': 1}})
+    cached = CachedContainer(backend, tmp_path)
+    for _ in range(2):
+        assert cached['address'] == '0xabc'
+        assert cached['abi'] == b'{"abi": []}'
+        assert cached['config'] == {'a': 1}
+    assert backend.downloads == 3
+
+    del cached  # a new process: the cache is read back from disk
+    restarted = CachedContainer(backend, tmp_path)
+    assert restarted['address'] == '0xabc'
+    assert backend.downloads == 3
+
+
+def test_cached_container_revalidates_after_ttl(tmp_path):
+    backend = CountingBackend({'address': '0xabc', 'other': '0xdef'})
+    cached = CachedContainer(backend, tmp_path, ttl=0)
+    cached.set_ttl('other', None)
+
+    assert cached['address'] == '0xabc'
+    assert cached['address'] == '0xabc'
+    assert (backend.downloads, backend.revalidations) == (1, 1)
+
+    backend.items['address'] = '0x123'
+    assert cached['address'] == '0x123'
+    assert backend.downloads == 2
+
+    assert cached['other'] == '0xdef'
+    backend.items['other'] = '0x456'
+    assert cached['other'] == '0xdef'
+
+
+def test_cached_container_lru_eviction(tmp_path):
+    backend = CountingBackend({'a': b'a' * 100, 'b': b'b' * 100, 'c': b'c' * 100})
+    cached = CachedContainer(backend, tmp_path, max_size=250)
+    _ = cached['a'], cached['b'], cached['a'], cached['c']  # 'b' is least recently used
+    assert backend.downloads == 3
+
+    _ = cached['a'], cached['c']
+    assert backend.downloads == 3
+    _ = cached['b']
+    assert backend.downloads == 4
+    assert len(list((tmp_path / 'objects').iterdir())) == 2
+
+
+def test_cached_container_get_many(tmp_path):
+    class ManyBackend(CountingBackend):
+        requested: list = []
+
+        def get_many(self, keys, *, return_exceptions=False):
+            self.requested.append(keys)
+            return super().get_many(keys, return_exceptions=return_exceptions)
+
+    backend = ManyBackend({'a': '0xa', 'b': '0xb', 'c': '0xc'})
+    cached = CachedContainer(backend, tmp_path)
+    assert cached['a'] == '0xa'
+
+    assert cached.get_many(['a', 'b', 'c']) == {'a': '0xa', 'b': '0xb', 'c': '0xc'}
+    # only what wasn't cached, all together
+    assert backend.requested == [['b', 'c']]
+    assert cached.get_many(['b', 'c']) == {'b': '0xb', 'c': '0xc'}
+    assert backend.downloads == 3
+
+
+def test_cache_store_shared_between_processes(tmp_path):
+    # two stores on one directory, as two processes would have
+    first = _CacheStore(tmp_path, max_size=250)
+    second = _CacheStore(tmp_path, max_size=250)
+    first.write('a', b'a' * 100, 'bytes', {})
+    second.write('b', b'b' * 100, 'bytes', {})
+    first.write('c', b'c' * 10, 'bytes', {})
+
+    assert sorted(_CacheStore(tmp_path, max_size=250).index) == ['a', 'b', 'c']
+    assert len(list((tmp_path / 'objects').iterdir())) == 3
+
+    # evicts what the other process wrote least recently, and only that
+    second.write('d', b'd' * 100, 'bytes', {})
+    assert sorted(_CacheStore(tmp_path, max_size=250).index) == ['b', 'c', 'd']
+    assert first.read('a') is None
+    assert first.read('b')[1] == b'b' * 100
+
+
+class Flaky:
+    """ Answers 503 to the first `failures` requests, then the contract address. Records client ports to count
+    connections """
+    failures = 0
+    client_ports: set = set()
+
+    @classmethod
+    def answer(cls, request):
+        cls.client_ports.add(request.client_address[1])
+        if cls.failures:
+            cls.failures -= 1
+            return 503, {}
+        return 200, '0x1234'
+
+
+@pytest.fixture()
+def flaky_server(http_server):
+    Flaky.client_ports = set()
+    return http_server(Flaky.answer).url
+
+
+def test_http_file_service_retries(flaky_server):
+    Flaky.failures = 2
+    fs = HttpFileService(flaky_server, backoff=0.01)
+
+    assert fs['enigmacontract.txt'] == '0x1234'
+    assert (fs.stats.count, fs.stats.errors) == (3, 2)
+
+
+def test_http_file_service_gives_up(flaky_server):
+    Flaky.failures = 10
+    fs = HttpFileService(flaky_server, retries=1, backoff=0.01)
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        fs.fetch('enigmacontract.txt')
+    assert fs.stats.count == 2
+
+
+def test_http_file_service_keeps_connection(flaky_server):
+    Flaky.failures = 0
+    contract = HttpFileService(flaky_server)
+    abi = HttpFileService(flaky_server, directory='abi')
+    for _ in range(3):
+        assert contract['enigmacontract.txt'] == '0x1234'
+        assert abi['Enigma.json'] == '0x1234'
+
+    assert len(Flaky.client_ports) == 1
+
+
+class Bundle:
+    """ Serves a bundle with one address and whichever ABIs were asked for, and the per-item endpoints. Records the
+    paths it was asked for """
+    paths: list = []
+
+    @classmethod
+    def answer(cls, request):
+        cls.paths.append(request.path)
+        path, _, name = request.path.partition('?name=')
+        if path == '/contract/bundle':
+            return 200, {'version': '1', 'address': {'enigmacontract.txt': '0x1234'},
+                         'abi': {abi: f'abi of {abi}' for abi in name.split(',')}}
+        return 200, f'{path} {name}'
+
+
+def test_discovery_bundle_single_request(http_server):
+    Bundle.paths = []
+    url = http_server(Bundle.answer).url
+
+    bundle = DiscoveryBundle(url, ['Enigma.json', 'EnigmaToken.json'])
+    contract = HttpFileService(url, bundle=bundle)
+    abi = HttpFileService(url, directory='abi', bundle=bundle)
+
+    assert contract['enigmacontract.txt'] == '0x1234'
+    assert abi['Enigma.json'] == 'abi of Enigma.json'
+    assert abi.fetch('EnigmaToken.json') == ('abi of EnigmaToken.json', {})
+    assert Bundle.paths == ['/contract/bundle?name=Enigma.json,EnigmaToken.json']
+
+    # anything not in the bundle is still requested on its own
+    assert contract['votingcontract.txt'] == '/contract/address votingcontract.txt'
+    assert len(Bundle.paths) == 2
+
+
+class Watch:
+    """ Holds /contract/watch requests until `published` is set, like contract_server does until a file exists. The
+    regular endpoints 404 until then """
+    published = threading.Event()
+
+    @classmethod
+    def answer(cls, request):
+        if request.path.startswith('/contract/watch'):
+            if cls.published.wait(float(request.path.rpartition('wait=')[2])):
+                return 200, '0x1234', {'ETag': '"v1"'}
+            return 304, b''
+        if cls.published.is_set():
+            return 200, '0x1234', {'ETag': '"v1"'}
+        return 404, b''
+
+
+@pytest.fixture()
+def watch_server(http_server):
+    Watch.published = threading.Event()
+    return http_server(Watch.answer)
+
+
+def test_http_file_service_watch(watch_server):
+    fs = HttpFileService(watch_server.url)
+    threading.Timer(0.3, Watch.published.set).start()
+    start = time.monotonic()
+
+    assert fs.watch('enigmacontract.txt', interval=5) == ('0x1234', {'etag': '"v1"', 'last_modified': None})
+    # answered the moment it was published, by the request that was waiting for it
+    assert time.monotonic() - start < 1
+    assert watch_server.requests == 1
+
+
+def test_http_file_service_watch_timeout(watch_server):
+    fs = HttpFileService(watch_server.url)
+    with pytest.raises(TimeoutError):
+        fs.watch('enigmacontract.txt', timeout=0.3)
+
+
+def test_polling_watch_until_changed(tmp_path):
+    backend = CountingBackend({'principal-sign-addr.txt': '0x1234'})
+    cached = CachedContainer(backend, tmp_path)
+    _, validators = backend.fetch('principal-sign-addr.txt')
+    threading.Timer(0.2, backend.items.__setitem__, ('principal-sign-addr.txt', '0x5678')).start()
+
+    assert cached.watch('principal-sign-addr.txt', validators, interval=0.05)[0] == '0x5678'
+    # and the cache has the new version
+    assert cached['principal-sign-addr.txt'] == '0x5678'
@@ -1,16 +1,42 @@
+import hashlib
 import logging
 import json
+import threading
+from collections import OrderedDict
+from typing import Dict, Tuple
 
 from flask import Flask, request
 from flask_cors import CORS
 from flask_restplus import Api, Resource
 from flask_restplus import abort
+from werkzeug.serving import WSGIRequestHandler
 
 
-from enigma_docker_common.config import Config
+from enigma_docker_common.artifacts import ContractArtifact
+from enigma_docker_common.config import Field, ReloadableConfig
+from enigma_docker_common.file_cache import CachedFile, FileCache
 from enigma_docker_common.logger import get_logger
 
-config = Config()
+# reloaded when the config file changes -- see start_server
+config = ReloadableConfig({'CONTRACT_FILES': Field(list, default=[])})
+
+
+def slim_artifact(build: str) -> CachedFile:
+    try:
+        return CachedFile.from_json(ContractArtifact.from_build(build).to_dict())
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f'Not a contract build file: {e!r}') from None
+
+
+# files we serve, kept in memory until they change on disk
+file_cache = FileCache()
+# slim artifacts of the contract build files, likewise
+artifact_cache = FileCache(render=slim_artifact)
+# rendered bundles, by the ABIs and artifacts they include -- only files that exist count, and the least recently used
+# bundle is dropped once there are MAX_BUNDLES
+MAX_BUNDLES = 16
+bundles: 'OrderedDict[Tuple[Tuple[str, ...], Tuple[str, ...]], CachedFile]' = OrderedDict()
+bundles_lock = threading.Lock()
 
 logger = get_logger('enigma-contract.server')
 
@@ -36,9 +62,7 @@ class GetAddress(Resource):
             if contract_name not in config["CONTRACT_FILES"]:
                 logger.error(f'Tried to retrieve file which was not in allowed file names: {contract_name}')
                 return abort(404)
-            contract_filename = f'{config["CONTRACT_PATH"]}{contract_name}'
-            with open(contract_filename) as f:
-                return f.read()
+            return file_cache.get(f'{config["CONTRACT_PATH"]}{contract_name}').response(request)
         except FileNotFoundError as e:
             logger.error(f'File not found: {e}')
             return abort(404)
@@ -57,9 +81,7 @@ class GetABI(Resource):
             if not contract_name.endswith('.json'):
                 logger.error(f'Tried to retrieve file which was not in allowed file names: {contract_name}')
                 return abort(404)
-            contract_filename = f'{config["BUILT_CONTRACT_FOLDER"]}{contract_name}'
-            with open(contract_filename, 'r') as f:
-                return f.read()
+            return file_cache.get(f'{config["BUILT_CONTRACT_FOLDER"]}{contract_name}').response(request)
         except FileNotFoundError as e:
             logger.error(f'File not found: {e}')
             return abort(404)
@@ -68,7 +90,112 @@ class GetABI(Resource):
             return abort(500)
 
 
+@contract_ns.route("/artifact")
+class GetArtifact(Resource):
+    """ Will return the slim artifact of a contract from the build/contracts folder: just its ABI, function selectors
+    and deployed addresses, as a JSON object """
+    @contract_ns.param('name', 'contract name -- Must be a single json file', 'query')
+    def get(self):  # pylint: disable=no-self-use
+        contract_name: str = request.args.get('name', '')
+        try:
+            if not contract_name.endswith('.json'):
+                logger.error(f'Tried to retrieve file which was not in allowed file names: {contract_name}')
+                return abort(404)
+            return artifact_cache.get(f'{config["BUILT_CONTRACT_FOLDER"]}{contract_name}').response(request)
+        except FileNotFoundError as e:
+            logger.error(f'File not found: {e}')
+            return abort(404)
+        except ValueError as e:
+            logger.error(f'Error decoding contract build file. Is it valid JSON? {e}')
+            return abort(500)
+
+
+@contract_ns.route("/bundle")
+class GetBundle(Resource):
+    """ returns every allowed contract address, plus the requested ABIs and slim artifacts, in a single response.
+    The response is compressed for clients that accept it, and versioned by a hash of its contents (also sent as the
+    ETag). Files that don't exist yet are left out, so clients can fall back to /address, /abi and /artifact for them
+    """
+    @contract_ns.param('name', 'comma separated ABI file names to include -- each must be a json file', 'query')
+    @contract_ns.param('artifact', 'comma separated contract build file names to include as slim artifacts', 'query')
+    def get(self):  # pylint: disable=no-self-use
+        abi_names = [name for name in request.args.get('name', '').split(',') if name]
+        artifact_names = [name for name in request.args.get('artifact', '').split(',') if name]
+        for name in abi_names + artifact_names:
+            if not name.endswith('.json'):
+                logger.error(f'Tried to retrieve file which was not in allowed file names: {name}')
+                return abort(404)
+
+        addresses = self._get_all(file_cache, config["CONTRACT_PATH"], config["CONTRACT_FILES"])
+        abis = self._get_all(file_cache, config["BUILT_CONTRACT_FOLDER"], abi_names)
+        artifacts = self._get_all(artifact_cache, config["BUILT_CONTRACT_FOLDER"], artifact_names)
+        # the bundle's version follows from the versions of the files in it, so it is only rebuilt when one changes
+        etags = {section: {name: f.etag for name, f in files.items()}
+                 for section, files in (('address', addresses), ('abi', abis), ('artifact', artifacts))}
+        version = hashlib.sha256(json.dumps(etags, sort_keys=True).encode()).hexdigest()[:16]
+
+        key = (tuple(sorted(abis)), tuple(sorted(artifacts)))
+        with bundles_lock:
+            cached = bundles.get(key)
+            if cached is not None:
+                bundles.move_to_end(key)
+        if cached is None or cached.etag != version:
+            bundle = {'version': version,
+                      'address': {name: f.text for name, f in addresses.items()},
+                      'abi': {name: f.text for name, f in abis.items()},
+                      'artifact': {name: json.loads(f.text) for name, f in artifacts.items()}}
+            cached = CachedFile.from_body(json.dumps(bundle).encode(), etag=version)
+            with bundles_lock:
+                bundles[key] = cached
+                bundles.move_to_end(key)
+                while len(bundles) > MAX_BUNDLES:
+                    bundles.popitem(last=False)
+        return cached.response(request)
+
+    @staticmethod
+    def _get_all(cache: FileCache, folder: str, names) -> Dict[str, CachedFile]:
+        files = {}
+        for name in names:
+            try:
+                files[name] = cache.get(f'{folder}{name}')
+            except (FileNotFoundError, ValueError) as e:
+                logger.debug(f'Leaving file out of bundle: {e}')
+        return files
+
+
+@contract_ns.route("/watch")
+class WatchFile(Resource):
+    """ long-poll: returns a contract address or ABI (like /address or /abi) as soon as it is published -- or, with
+    If-None-Match, as soon as it changes. Answers 304 if that didn't happen within `wait` seconds """
+    @contract_ns.param('name', 'contract address file name, or ABI json file name', 'query')
+    @contract_ns.param('wait', 'seconds to wait, at most 60', 'query')
+    def get(self):  # pylint: disable=no-self-use
+        contract_name: str = request.args.get('name', '')
+        if contract_name in config["CONTRACT_FILES"]:
+            contract_filename = f'{config["CONTRACT_PATH"]}{contract_name}'
+        elif contract_name.endswith('.json'):
+            contract_filename = f'{config["BUILT_CONTRACT_FOLDER"]}{contract_name}'
+        else:
+            logger.error(f'Tried to watch file which was not in allowed file names: {contract_name}')
+            return abort(400)
+        return file_cache.watch_response(contract_filename, request)
+
+
+def _forget_files(*_):
+    # files under the old paths won't be asked for again
+    file_cache.forget()
+    artifact_cache.forget()
+    with bundles_lock:
+        bundles.clear()
+
+
+config.subscribe(_forget_files, keys=('CONTRACT_PATH', 'BUILT_CONTRACT_FOLDER'))
+
+
 def start_server(port):
+    config.watch()
+    # HTTP/1.1, so discovery clients can keep their connection open between requests
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
     application.run(host='0.0.0.0', port=port, debug=False)
 
 
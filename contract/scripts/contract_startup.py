@@ -1,10 +1,13 @@
 # Environment options: LOCAL, K8S, TESTNET, MAINNET
+import argparse
 import os
 
+from enigma_docker_common.address import Address
+from enigma_docker_common.artifacts import ContractArtifact
 from enigma_docker_common.config import Config
 from enigma_docker_common.logger import get_logger
 from enigma_docker_common.provider import Provider
-from web3.auto import w3 as auto_w3
+from enigma_docker_common.snapshot import write_snapshot
 
 logger = get_logger(__file__)
 
@@ -19,13 +22,51 @@ def save_to_path(path, file):
         f.write(file)
 
 
+def save_snapshot(cfg, path, with_abi=False):
+    """ Writes the deployed addresses, slim artifacts of the contract build files and the principal address to a
+    snapshot file, named the way Provider asks for them, so Providers with ARTIFACT_SNAPSHOT set don't need to ask
+    this container or key management. Run after the contracts were deployed """
+    entries = {'contract': {}, 'km': {}, 'artifact': {}, 'abi': {}}
+    for name in cfg['CONTRACT_FILES']:
+        try:
+            with open(f'{cfg["CONTRACT_PATH"]}{name}') as f:
+                entries['contract'][name] = f.read()
+        except FileNotFoundError:
+            logger.warning(f'Contract address {name} not found, leaving it out of the snapshot')
+    with open(cfg['PRINCIPAL_ADDRESS_PATH']) as f:
+        entries['km'][os.path.basename(cfg['PRINCIPAL_ADDRESS_PATH'])] = f.read()
+
+    folder = cfg['BUILT_CONTRACT_FOLDER']
+    for name in sorted(os.listdir(folder)):
+        if not name.endswith('.json'):
+            continue
+        with open(os.path.join(folder, name), 'rb') as f:
+            build = f.read()
+        try:
+            entries['artifact'][name] = ContractArtifact.from_build(build).to_dict()
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.debug(f'Skipping {name}, not a contract build file: {e!r}')
+            continue
+        if with_abi:
+            entries['abi'][name] = build
+    write_snapshot(path, entries, env=os.getenv('ENIGMA_ENV', 'COMPOSE'))
+
+
 if __name__ == '__main__':
-    logger.info('STARTING CONTRACT STARTUP SCRIPT')
-
-    config = Config(required=required)
-    provider = Provider(config=config)
-    logger.info(f'Downloading key management enigma address...')
-    addr = provider.principal_address
-    addr = auto_w3.toChecksumAddress(addr)
-    logger.info(f'Downloaded key management enigma address successfully -- {addr}')
-    save_to_path(config['PRINCIPAL_ADDRESS_PATH'], addr)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--snapshot', metavar='PATH', help='write a snapshot of the deployment to PATH, and exit')
+    parser.add_argument('--with-abi', action='store_true', help='include the full contract build files in it')
+    args = parser.parse_args()
+
+    if args.snapshot:
+        save_snapshot(Config(), args.snapshot, with_abi=args.with_abi)
+    else:
+        logger.info('STARTING CONTRACT STARTUP SCRIPT')
+
+        config = Config(required=required)
+        provider = Provider(config=config)
+        logger.info(f'Downloading key management enigma address...')
+        addr = provider.wait_for('principal_address')
+        addr = Address(addr)
+        logger.info(f'Downloaded key management enigma address successfully -- {addr}')
+        save_to_path(config['PRINCIPAL_ADDRESS_PATH'], addr)
@@ -1,11 +1,13 @@
-import json
 import logging
 import random
 import threading
 import time
+from typing import Union
 
 import web3
-from enigma_docker_common.config import Config
+from enigma_docker_common.address import Address
+from enigma_docker_common.batch import Batch
+from enigma_docker_common.config import Field, ReloadableConfig
 from enigma_docker_common.logger import get_logger
 from enigma_docker_common.provider import Provider
 from flask import Flask, request
@@ -20,40 +22,46 @@ logger = get_logger('enigma-contract.faucet')
 
 required = ["ETH_NODE_ADDRESS", "CONTRACT_DISCOVERY_ADDRESS", "FAUCET_PORT", "BLOCK_TIME"]
 
-config = Config(required=required)
+# allowances and block time are reloaded when the config file changes -- see run
+config = ReloadableConfig({'FAUCET_PORT': Field(int),
+                           'ALLOWANCE_AMOUNT': Field(int, default=web3.Web3.toWei(100, 'ether')),
+                           'ENG_ALLOWANCE_AMOUNT': Field(int, default=int(500 * 1e+8)),
+                           'TIME_BETWEEN_BLOCKS': Field(int, default=60)},
+                          required=required)
 eng_provider = Provider(config=config)
 
 PORT = config['FAUCET_PORT']
 NODE_URL = config["ETH_NODE_ADDRESS"]
 
-ETH_ALLOWANCE_AMT = int(config.get('ALLOWANCE_AMOUNT', web3.Web3.toWei(100, 'ether')))
-ENG_ALLOWANCE_AMT = int(config.get('ENG_ALLOWANCE_AMOUNT', 500 * 1e+8))
-
-token_contract_abi = json.loads(eng_provider.enigma_token_abi)
+token_contract_abi = eng_provider.enigma_token_artifact.abi
 token_contract_address = eng_provider.token_contract_address
 
-enigma_abi = json.loads(eng_provider.enigma_abi)
+enigma_abi = eng_provider.enigma_artifact.abi
 enigma_contract_address = eng_provider.enigma_contract_address
 
 provider = web3.HTTPProvider(NODE_URL)
 w3 = web3.Web3(provider)
-erc20 = w3.eth.contract(token_contract_address, abi=token_contract_abi['abi'])
-enigma_contract = w3.eth.contract(enigma_contract_address, abi=enigma_abi['abi'])
+erc20 = w3.eth.contract(token_contract_address, abi=token_contract_abi)
+enigma_contract = w3.eth.contract(enigma_contract_address, abi=enigma_abi)
+
+
+# unlocked accounts of the local ganache chain, checksummed once
+COINBASE_ACCOUNTS = [Address(account) for account in ['0x90f8bf6a479f320ead074411a4b0e7944ea8c9c1',
+                                                      '0xffcf8fdee72ac11b5c542428b35eef5769c409f0',
+                                                      '0x22d491bde2303f2f43325b2108d26f1eaba1e32b',
+                                                      '0xe11ba2b4d45eaed5996cd0823791e0c93114882d',
+                                                      '0xd03ea8624c8c5987235048901fb614fdca89b117',
+                                                      '0x95ced938f7991cd0dfcb48f0a06a40fa1af46ebc',
+                                                      '0x3e5e9111ae8eb78fe1cc3bb8915d5d461f3ef9a9',
+                                                      '0x28a8746e75304c0780e011bed21c72cd78cd535e',
+                                                      '0xaca94ef8bd5ffee41947b4585a84bda5a3d3da6e']]
 
 
 class CoinBaseProvider:
     @staticmethod
     def address():
         """ returns an unlocked address """
-        return random.choice(['0x90f8bf6a479f320ead074411a4b0e7944ea8c9c1',
-                              '0xffcf8fdee72ac11b5c542428b35eef5769c409f0',
-                              '0x22d491bde2303f2f43325b2108d26f1eaba1e32b',
-                              '0xe11ba2b4d45eaed5996cd0823791e0c93114882d',
-                              '0xd03ea8624c8c5987235048901fb614fdca89b117',
-                              '0x95ced938f7991cd0dfcb48f0a06a40fa1af46ebc',
-                              '0x3e5e9111ae8eb78fe1cc3bb8915d5d461f3ef9a9',
-                              '0x28a8746e75304c0780e011bed21c72cd78cd535e',
-                              '0xaca94ef8bd5ffee41947b4585a84bda5a3d3da6e'])
+        return random.choice(COINBASE_ACCOUNTS)
 
     @staticmethod
     def eng_token_acc():
@@ -68,32 +76,41 @@ api = Api(app=application)
 faucet_ns = api.namespace('faucet', description='faucet operations')
 
 
+def _balances(add_call, to_str) -> Union[str, dict]:
+    """ Balances of the requested accounts, read in one batch. A single account's balance is returned as is; several
+    accounts' as {account: balance} """
+    accounts = request.args.getlist('account')
+    if not accounts:
+        return abort(400, 'Invalid ethereum address None')
+    batch = Batch(w3)
+    for account in accounts:
+        try:
+            add_call(batch, Address(account))
+        except ValueError:
+            return abort(400, f'Invalid ethereum address {account}')
+    results = batch.execute()
+    for account, result in zip(accounts, results):
+        if not result.ok:
+            return abort(500, f'Failed to get balance of {account}: {result.error}')
+    if len(accounts) == 1:
+        return to_str(results[0].value)
+    return {account: to_str(result.value) for account, result in zip(accounts, results)}
+
+
 @faucet_ns.route("/balance/ether")
 class BalanceEther(Resource):
     """ Returns the balance of an account """
-    @faucet_ns.param('account', 'Address to send currency to', 'query')
+    @faucet_ns.param('account', 'Address to get the balance of (may be repeated)', 'query')
     def get(self):  # pylint: disable=no-self-use
-        # your code here
-        account = request.args.get('account')
-        if not w3.isAddress(account):
-            return abort(400, f'Invalid ethereum address {account}')
-        account = w3.toChecksumAddress(account)
-        val = w3.fromWei(w3.eth.getBalance(account), 'ether')
-        return str(val)
+        return _balances(lambda batch, account: batch.balance(account), lambda val: str(w3.fromWei(val, 'ether')))
 
 
 @faucet_ns.route("/balance/eng")
 class BalanceEng(Resource):
     """ Returns the balance of an account """
-    @faucet_ns.param('account', 'Address to send currency to', 'query')
+    @faucet_ns.param('account', 'Address to get the balance of (may be repeated)', 'query')
     def get(self):  # pylint: disable=no-self-use
-        # your code here
-        account = request.args.get('account')
-        if not w3.isAddress(account):
-            return abort(400, f'Invalid ethereum address {account}')
-        account = w3.toChecksumAddress(account)
-        val = erc20.functions.balanceOf(account).call()
-        return str(val)
+        return _balances(lambda batch, account: batch.call(erc20.functions.balanceOf(account)), str)
 
 
 @faucet_ns.route("/ether")
@@ -103,14 +120,16 @@ class TransferEther(Resource):
     def get(self):  # pylint: disable=no-self-use
         # your code here
         account = request.args.get('account')
-        if not w3.isAddress(account):
+        try:
+            account = Address(account)
+        except ValueError:
             return abort(400, f'Invalid ethereum address {account}')
-        account = w3.toChecksumAddress(account)
-        coinbase = w3.toChecksumAddress(CoinBaseProvider.address())
-        w3.eth.sendTransaction({'to': account, 'from': coinbase, 'value': ETH_ALLOWANCE_AMT})
+        coinbase = CoinBaseProvider.address()
+        amount = config['ALLOWANCE_AMOUNT']
+        w3.eth.sendTransaction({'to': account, 'from': coinbase, 'value': amount})
 
         return {'status': 'success',
-                'result': {'to': account, 'from': coinbase, 'value': ETH_ALLOWANCE_AMT}}
+                'result': {'to': account, 'from': coinbase, 'value': amount}}
 
 
 @faucet_ns.route("/eng")
@@ -120,22 +139,23 @@ class TransferEng(Resource):
     def get(self):  # pylint: disable=no-self-use
         # your code here
         account = request.args.get('account')
-        if not w3.isAddress(account):
+        try:
+            account = Address(account)
+        except ValueError:
             return abort(400, f'Invalid ethereum address {account}')
-
-        account = w3.toChecksumAddress(account)
-        coinbase = w3.toChecksumAddress(CoinBaseProvider.eng_token_acc())
+        coinbase = Address(CoinBaseProvider.eng_token_acc())
 
         val = erc20.functions.balanceOf(coinbase).call()
         logger.debug(f'{account} ENG balance: {val}')
 
-        tx_hash = erc20.functions.transfer(account, ENG_ALLOWANCE_AMT).transact({'from': coinbase})
+        amount = config['ENG_ALLOWANCE_AMOUNT']
+        tx_hash = erc20.functions.transfer(account, amount).transact({'from': coinbase})
         _ = w3.eth.waitForTransactionReceipt(tx_hash)
         val = erc20.functions.balanceOf(account).call()
         logger.debug(f'{account} ENG balance: {val}')
 
         return {'status': 'success',
-                'result': {'to': account, 'from': coinbase, 'value': ENG_ALLOWANCE_AMT}}
+                'result': {'to': account, 'from': coinbase, 'value': amount}}
 
 ######################################
 
@@ -143,18 +163,17 @@ class TransferEng(Resource):
 def block_miner():
     if config.get('AUTO_MINER', None):
         logger.info('Starting auto miner')
-        mining_delay = int(config.get('TIME_BETWEEN_BLOCKS', 60))
-        logger.info(f'Time between transactions: {mining_delay}')
+        logger.info(f'Time between transactions: {config["TIME_BETWEEN_BLOCKS"]}')
         logger.info(f'Time to confirm block: {config["BLOCK_TIME"]}')
         # block_time = int(config["BLOCK_TIME"])
         # epoch_time = int(config["EPOCH_SIZE"]) * max(mining_delay, block_time)
         # logger.info(f'Min epoch time: {epoch_time}s')
         random_acc = '0x18A787C1e5fb92D7dFF1f920Ee740901Dc72BC1b'
         while True:
-            coinbase = w3.toChecksumAddress(CoinBaseProvider.address())
+            coinbase = CoinBaseProvider.address()
             w3.eth.sendTransaction({'to': random_acc, 'from': coinbase, 'value': 1})
             logger.info('Sent Transaction -- should create new block')
-            time.sleep(mining_delay)
+            time.sleep(config['TIME_BETWEEN_BLOCKS'])
 
 
 def shutdown_server():
@@ -166,6 +185,7 @@ def shutdown_server():
 
 
 def run(port: int = None):
+    config.watch()
     listen = config.get("FAUCET_ADDRESS", '0.0.0.0')
     application.run(host=listen, port=port or PORT)
 
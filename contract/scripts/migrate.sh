@@ -12,5 +12,10 @@ echo 'Running deployment...'
 truffle migrate --network develop
 echo 'Done deployment!'
 
+if [ -n "$ARTIFACT_SNAPSHOT_OUTPUT" ]; then
+  echo "Writing artifact snapshot to $ARTIFACT_SNAPSHOT_OUTPUT"
+  python3 scripts/contract_startup.py --snapshot "$ARTIFACT_SNAPSHOT_OUTPUT" --with-abi
+fi
+
 echo 'Serving enigmacontract address and enigmatoken address'
 python3 scripts/contract_server.py
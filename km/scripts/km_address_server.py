@@ -1,13 +1,19 @@
 import logging
 
-from enigma_docker_common.config import Config
+from enigma_docker_common.config import ReloadableConfig
+from enigma_docker_common.file_cache import FileCache
 from enigma_docker_common.logger import get_logger
 from flask import Flask, request
 from flask_cors import CORS
 from flask_restplus import Api, Resource
 from flask_restplus import abort
+from werkzeug.serving import WSGIRequestHandler
 
-config = Config()
+# reloaded when the config file changes -- see start_server
+config = ReloadableConfig()
+
+# files we serve, kept in memory until they change on disk
+file_cache = FileCache()
 
 logger = get_logger('km.server')
 
@@ -31,16 +37,31 @@ class KMAddress(Resource):
         if filename not in config["KM_FILENAME"]:
             logger.error(f'Tried to retrieve file which was not in allowed file names: {filename}')
             return abort(404)
-        contract_filename = f'{config["KEYPAIR_DIRECTORY"]}{filename}'
         try:
-            with open(contract_filename) as f:
-                return f.read()
+            return file_cache.get(f'{config["KEYPAIR_DIRECTORY"]}{filename}').response(request)
         except FileNotFoundError:
             logger.critical(f'KM address not found -- probably misconfigured filename')
             return abort(500)
 
 
+@ns.route("/watch")
+class WatchKMAddress(Resource):
+    """ long-poll: returns the key management address (like /address) as soon as it is published -- or, with
+    If-None-Match, as soon as it changes. Answers 304 if that didn't happen within `wait` seconds """
+    @ns.param('name', 'Key management address filename', 'query')
+    @ns.param('wait', 'seconds to wait, at most 60', 'query')
+    def get(self):  # pylint: disable=no-self-use
+        filename = request.args.get('name')
+        if filename not in config["KM_FILENAME"]:
+            logger.error(f'Tried to watch file which was not in allowed file names: {filename}')
+            return abort(400)
+        return file_cache.watch_response(f'{config["KEYPAIR_DIRECTORY"]}{filename}', request)
+
+
 def start_server(port):
+    config.watch()
+    # HTTP/1.1, so discovery clients can keep their connection open between requests
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
     application.run(host='0.0.0.0', port=port, debug=False)
 
 
@@ -8,7 +8,7 @@ import threading
 import time
 
 from enigma_docker_common.config import Config
-from enigma_docker_common.ethereum import check_eth_limit
+from enigma_docker_common.ethereum import wait_for_eth_limit
 from enigma_docker_common.faucet_api import get_initial_coins
 from enigma_docker_common.logger import get_logger
 from enigma_docker_common.provider import Provider
@@ -75,6 +75,9 @@ if __name__ == '__main__':  # noqa: C901
 
     config = Config(required=required)
     provider = Provider(config=config)
+    if env.startswith(('TESTNET', 'MAINNET')):
+        # already published -- get them all at once
+        provider.prefetch(['principal_address', 'enigma_contract_address', 'key_management_abi'])
 
     km_key_storage = AzureContainerFileService(config['KEYPAIR_STORAGE_DIRECTORY'])
 
@@ -147,7 +150,8 @@ if __name__ == '__main__':  # noqa: C901
                 time.sleep(30)
 
     logger.info(f'Getting enigma-contract...')
-    enigma_address = provider.enigma_contract_address
+    provider.prefetch(['enigma_contract_address', 'key_management_abi'])
+    enigma_address = provider.wait_for('enigma_contract_address')
     logger.info(f'Got address {enigma_address} for enigma contract')
 
     # engima_contract_address is passed to km application without 0x
@@ -183,8 +187,8 @@ if __name__ == '__main__':  # noqa: C901
 
     eth_address = '0x' + config['ACCOUNT_ADDRESS']
 
-    while not check_eth_limit(eth_address, float(config["MINIMUM_ETHER_BALANCE"]), ethereum_node):
-        time.sleep(5)
+    wait_for_eth_limit(eth_address, float(config["MINIMUM_ETHER_BALANCE"]), ethereum_node,
+                       ws_url=config.get('ETHEREUM_NODE_ADDRESS_WEBSOCKET', ''))
 
     logger.info(f'Running KM with arguments: {exec_args}')
 
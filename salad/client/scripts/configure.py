@@ -4,9 +4,7 @@ This script uses the enigma provider class to identify all the network parameter
 and writes them to the salad client's `.env` file.
 """
 
-import socket
-from time import sleep
-
+from enigma_docker_common import readiness
 from enigma_docker_common.config import Config
 from enigma_docker_common.logger import get_logger
 from enigma_docker_common.utils import parse_env_file, dump_env_file
@@ -37,12 +35,8 @@ except (ValueError, IOError) as e:
 
 
 def wait_for_operator_server():
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    result = 1
-    while result != 0:
-        print(f'Waiting for the operator server to start at {config["OPERATOR_HOST"]}:{config["OPERATOR_PORT"]}')
-        result = sock.connect_ex((config['OPERATOR_HOST'], int(config['OPERATOR_PORT'])))
-        sleep(5)
+    print(f'Waiting for the operator server to start at {config["OPERATOR_HOST"]}:{config["OPERATOR_PORT"]}')
+    readiness.wait_for(readiness.Target(config['OPERATOR_HOST'], int(config['OPERATOR_PORT'])), timeout=None)
 
 
 def main():
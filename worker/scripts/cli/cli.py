@@ -5,14 +5,11 @@
 import asyncio
 import logging
 import os
-import time
 import sys
 from asyncio import ensure_future
 from pathlib import Path
-from threading import Thread
 
 from enigma_docker_common.config import Config
-from enigma_docker_common.ethereum import EthereumGateway
 from prompt_toolkit import Application
 from prompt_toolkit.application.current import get_app
 from prompt_toolkit.buffer import Buffer
@@ -73,10 +70,9 @@ try:
 except (ValueError, IOError):
     sys.exit(1)
 
-# noinspection PyUnboundLocalVariable
-ethereum = EthereumGateway(config['ETH_NODE_ADDRESS'])
 # noinspection PyUnboundLocalVariable
 node_actions = WorkerInterface(config=config)
+ethereum = node_actions.ethereum
 
 # Flow: Setup - input staking address, generate eth, transfer funds (balance > 0.1),
 # register, wait for staker to do stuff, login
@@ -218,8 +214,8 @@ def accept(buff):  # pylint: disable=unused-argument, too-many-statements
             elif cmd.startswith('generate approve'):
                 try:
                     deposit_amount = int(float(cmd.split(' ')[2]) * (10**8))
-                    output = 'Generated data for transaction:' + node_actions.generate_approve(staking_address.text,
-                                                                                               deposit_amount)
+                    output = 'Generated data for transaction:' + await node_actions.generate_approve(staking_address.text,
+                                                                                                     deposit_amount)
                 except Exception:  # pylint: disable=broad-except
                     output = "Please enter a number of ENG to deposit. " \
                              "Usage: generate approve [N] [  N - amount of allowance in ENG  ]" \
@@ -227,16 +223,16 @@ def accept(buff):  # pylint: disable=unused-argument, too-many-statements
             elif cmd.startswith('generate deposit'):
                 try:
                     deposit_amount = int(float(cmd.split(' ')[2]) * (10**8))
-                    output = 'Generated data for transaction:' + node_actions.generate_deposit(staking_address.text,
-                                                                                               deposit_amount)
+                    output = 'Generated data for transaction:' + await node_actions.generate_deposit(staking_address.text,
+                                                                                                     deposit_amount)
                 except Exception:  # pylint: disable=broad-except
                     output = "Please enter a number of ENG to deposit. " \
                              "Usage: generate allowance [N] [  N - amount to deposit in ENG  ]" \
                              "\n\nExample: generate allowance 10000"
 
             elif cmd.startswith('generate set-address'):
-                output = 'Generated data for transaction:' + node_actions.generate_set_operating_address(staking_address.text,
-                                                                                                         ethereum_address.text)
+                output = 'Generated data for transaction:' + await node_actions.generate_set_operating_address(
+                    staking_address.text, ethereum_address.text)
             elif cmd in node_actions.available_actions:
                 if cmd == 'register' and not can_register():
                     output = '\n\nNot enough ETH in account to register. Please deposit at least 0.1 ETH'
@@ -371,17 +367,20 @@ async def do_get_status():
         await asyncio.sleep(1)
 
 
-def do_get_balance():
+async def do_get_balance():
     global balance  # pylint: disable=global-statement
     balance_buff.text = "N/A"
+    block = -1
     while True:
         try:
             if ethereum_address.text != 'N/A':
-                balance = ethereum.balance(ethereum_address.text)
+                balance = await ethereum.balance(ethereum_address.text)
                 balance_buff.text = str(balance) + ' ETH'
+            # the balance only changes with a new block -- but the address might, so look again after 5s regardless
+            block = await ethereum.wait_for_block(block, timeout=5) or block
         except Exception as e:  # pylint: disable=broad-except
             output_field.text = str(e)
-        time.sleep(5)
+            await asyncio.sleep(5)
 
 
 async def do_get_peers():
@@ -402,8 +401,6 @@ style = example_style
 
 async def main():
     app = Application(layout=layout, full_screen=True, key_bindings=kb, style=style)
-    worker = Thread(target=do_get_balance, args=(), daemon=True)
-    worker.start()
 
     # read the staking address so we know if we already initialized or not
     try:
@@ -415,7 +412,12 @@ async def main():
     app.create_background_task(do_get_ethereum_address())
     app.create_background_task(do_get_staking_address())
     app.create_background_task(do_get_peers())
-    await app.run_async()
+    app.create_background_task(do_get_balance())
+    try:
+        await app.run_async()
+    finally:
+        # the background tasks are cancelled by now -- nothing else uses the session
+        await node_actions.ethereum.close()
 
 
 if __name__ == '__main__':
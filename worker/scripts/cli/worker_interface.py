@@ -1,11 +1,11 @@
-import json
 import subprocess
 from typing import Union
 
 import aiohttp
 from aiofile import AIOFile
 from enigma_docker_common import storage
-from enigma_docker_common.enigma import EnigmaTokenContract, EnigmaContract
+from enigma_docker_common.address import Address
+from enigma_docker_common.async_ethereum import AsyncContract, AsyncEthereumGateway
 from enigma_docker_common.provider import Provider
 
 
@@ -19,12 +19,14 @@ class WorkerInterface:
         self.provider = Provider(config=config)
         eng_contract_addr = self._address_as_string(self.provider.enigma_contract_address)
         token_contract_addr = self._address_as_string(self.provider.token_contract_address)
-        self.eng_contract = EnigmaContract(config["ETH_NODE_ADDRESS"], eng_contract_addr,
-                                           json.loads(self.provider.enigma_abi)['abi'])
+        # one connection pool for everything the CLI asks the ethereum node
+        self.ethereum = AsyncEthereumGateway(config["ETH_NODE_ADDRESS"])
+        self.eng_contract = AsyncContract(config["ETH_NODE_ADDRESS"], eng_contract_addr,
+                                          self.provider.enigma_artifact.abi, gateway=self.ethereum)
 
-        self.erc20_contract = EnigmaTokenContract(config["ETH_NODE_ADDRESS"],
-                                                  token_contract_addr,
-                                                  json.loads(self.provider.enigma_token_abi)['abi'])
+        self.erc20_contract = AsyncContract(config["ETH_NODE_ADDRESS"],
+                                            token_contract_addr,
+                                            self.provider.enigma_token_artifact.abi, gateway=self.ethereum)
 
     @staticmethod
     def restart():
@@ -76,20 +78,21 @@ class WorkerInterface:
             addr = addr.decode()
         return addr
 
-    def generate_set_operating_address(self, staking_address, eth_address):
-        tx = self.eng_contract.setOperatingAddress_build(staking_address, eth_address)
+    async def generate_set_operating_address(self, staking_address, eth_address):
+        tx = await self.eng_contract.build(staking_address, 'setOperatingAddress', Address(eth_address))
         if 'data' in tx:
             return f'\nto: {tx["to"]}\ndata: {tx["data"]}'
         return "Failed to generate transaction data"
 
-    def generate_deposit(self, staking_address, deposit_amount):
-        tx = self.eng_contract.build(staking_address, 'deposit', staking_address, deposit_amount)
+    async def generate_deposit(self, staking_address, deposit_amount):
+        tx = await self.eng_contract.build(staking_address, 'deposit', Address(staking_address), deposit_amount)
         if 'data' in tx:
             return f'\nto: {tx["to"]}\ndata: {tx["data"]}'
         return "Failed to generate transaction data"
 
-    def generate_approve(self, staking_address, deposit_amount):
-        tx = self.erc20_contract.approve_build(staking_address, self.provider.enigma_contract_address, deposit_amount)
+    async def generate_approve(self, staking_address, deposit_amount):
+        tx = await self.erc20_contract.build(staking_address, 'approve', Address(self.eng_contract.contract_address),
+                                             deposit_amount)
         if 'data' in tx:
             return f'\nto: {tx["to"]}\ndata: {tx["data"]}'
         return "Failed to generate transaction data"
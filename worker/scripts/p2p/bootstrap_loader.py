@@ -38,6 +38,12 @@ class BootstrapLoader:
         else:
             self.storage = storage.AzureContainerFileService(directory='bootstrap')
             self.storage_public = storage.AzureContainerFileService(directory='bootstrap-public')
+            cache_dir = cfg.get('ARTIFACT_CACHE_DIR', '')
+            if cache_dir:
+                cache_ttl = float(cfg.get('ARTIFACT_CACHE_TTL', 3600))
+                self.storage = storage.CachedContainer(self.storage, cache_dir, namespace='bootstrap', ttl=cache_ttl)
+                self.storage_public = storage.CachedContainer(self.storage_public, cache_dir,
+                                                              namespace='bootstrap-public', ttl=cache_ttl)
         self._address: str = ''
         self._key: str = ''
         self._public: str = ''
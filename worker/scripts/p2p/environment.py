@@ -25,8 +25,8 @@ class Environment:  # pylint: disable=too-many-instance-attributes
         self.executable = '/root/p2p/src/cli/cli_app.js'
         self.ethereum_node = config["ETH_NODE_ADDRESS"]
         self.enigma_abi_path = f'{config["CONTRACTS_FOLDER"]}{config["ENIGMA_CONTRACT_FILE_NAME"]}'
-        self.deposit_amount = int(config['DEPOSIT_AMOUNT'])
-        self.confirmations = config["MIN_CONFIRMATIONS"]
+        self.deposit_amount: int = config['DEPOSIT_AMOUNT']
+        self.confirmations: int = config["MIN_CONFIRMATIONS"]
 
     def bootstrap(self):
         return self.is_bootstrap
@@ -1,4 +1,3 @@
-import json
 import os
 import pathlib
 import sys
@@ -6,9 +5,9 @@ import time
 from collections import UserDict
 from typing import Tuple
 
-from enigma_docker_common import enigma
-from enigma_docker_common.config import Config
-from enigma_docker_common.ethereum import check_eth_limit
+from enigma_docker_common import enigma, readiness
+from enigma_docker_common.config import Field, load_config
+from enigma_docker_common.ethereum import check_eth_limit, wait_for_eth_limit
 from enigma_docker_common.faucet_api import get_initial_coins
 from enigma_docker_common.logger import get_logger
 from enigma_docker_common.provider import Provider
@@ -38,7 +37,18 @@ logger = get_logger('worker.p2p.start')
 
 # required configuration parameters -- these can all be overridden as environment variables
 required_config = ['ETH_NODE_ADDRESS', 'ENIGMA_CONTRACT_FILE_NAME', 'CORE_ADDRESS', 'CORE_PORT', 'CONTRACTS_FOLDER',
-                   'KEY_MANAGEMENT_ADDRESS', 'MINIMUM_ETHER_BALANCE', 'MIN_CONFIRMATIONS']
+                   'KEY_MANAGEMENT_ADDRESS']
+
+# parameters that aren't strings, or have a default
+config_schema = {'ENIGMA_ENV': Field(str, default='COMPOSE'),
+                 'MINIMUM_ETHER_BALANCE': Field(float, required=True),
+                 'MINIMUM_ENG_BALANCE': Field(float),
+                 'MIN_CONFIRMATIONS': Field(int, required=True),
+                 'DEPOSIT_AMOUNT': Field(int, required=True),
+                 'BALANCE_WAIT_TIME': Field(int, default=1800),
+                 'CONTRACT_TIMEOUT': Field(float, default=3600),
+                 'KEY_MANAGEMENT_TIMEOUT': Field(float, default=120),
+                 'HEALTH_CHECK_PORT': Field(int, default=12345)}
 
 env_defaults = {'K8S': '/root/p2p/config/k8s_config.json',
                 'TESTNET': '/root/p2p/config/testnet_config.json',
@@ -60,10 +70,10 @@ def wait_for_register(p2p: P2PNode) -> P2PStatuses:
 def load_contracts(config: UserDict, provider: Provider) -> Tuple[enigma.EnigmaContract, enigma.EnigmaTokenContract]:
     erc20_contract = enigma.EnigmaTokenContract(config["ETH_NODE_ADDRESS"],
                                                 provider.token_contract_address,
-                                                json.loads(provider.enigma_token_abi)['abi'])
+                                                provider.enigma_token_artifact.abi)
     eng_contract = enigma.EnigmaContract(config["ETH_NODE_ADDRESS"],
                                          provider.enigma_contract_address,
-                                         json.loads(provider.enigma_abi)['abi'])
+                                         provider.enigma_artifact.abi)
 
     return eng_contract, erc20_contract
 
@@ -89,9 +99,64 @@ def request_coins_from_faucet(config: UserDict, operating_address: str, staking_
         sys.exit(-1)
 
 
+class StakingFailed(RuntimeError):
+    """ A staking transaction was mined, but reverted """
+
+
+def stake(eng_contract: enigma.EnigmaContract, erc20_contract: enigma.EnigmaTokenContract, staking,
+          operating_address: str, deposit_amount: int, confirmations: int):
+    """ Approves (unless the allowance already covers the deposit), sets the operating address and deposits. The
+    transactions are sent back to back -- nonces come from the contracts' shared nonce manager, so the node executes
+    them in order -- and only the last one's confirmations are waited for. Raises StakingFailed if any reverted """
+    key = bytes.fromhex(remove_0x(staking.key))
+    tx_hashes = []
+
+    allowance = erc20_contract.check_allowance(staking.address, eng_contract.contract_address)
+    logger.debug(f'Current allowance for {eng_contract.contract_address}, from {staking.address}:'
+                 f' {allowance / (10 ** 8)} ENG')
+    if allowance < deposit_amount:
+        tx_hashes.append(erc20_contract.approve_send(staking.address, eng_contract.contract_address, deposit_amount,
+                                                     key=key))
+    else:
+        logger.info('Allowance already covers the deposit, skipping approve')
+
+    logger.info(f'Attempting to set operating address -- staking:{staking.address} operating: {operating_address}')
+    tx_hashes.append(eng_contract.setOperatingAddress_send(staking.address, key, operating_address))
+    logger.info(f'Attempting deposit from {staking.address} on behalf of worker {operating_address}')
+    tx_hashes.append(eng_contract.deposit_send(staking.address, key, deposit_amount))
+
+    receipts = eng_contract.wait_for_transactions(tx_hashes, confirmations)
+    failed = [tx_hash.hex() for tx_hash, receipt in zip(tx_hashes, receipts) if not receipt.status]
+    if failed:
+        raise StakingFailed(f'Staking transactions failed: {", ".join(failed)}')
+    logger.info(f'Done waiting for {confirmations} confirmations for setOperatingAddress and deposit')
+
+
+def deposit_and_login(worker_env: Environment, p2p_runner: P2PNode, eng_contract: enigma.EnigmaContract,
+                      erc20_contract: enigma.EnigmaTokenContract, staking, operating_address: str):
+    """ The part of the deposit that comes after the p2p registers, then login -- unless staking failed """
+    worker_env.set_status('Setting staking address...')
+    try:
+        stake(eng_contract, erc20_contract, staking, operating_address, worker_env.deposit_amount,
+              worker_env.confirmations)
+    except enigma.StakingAddressAlreadySet:
+        logger.warning('Staking address already set. Probably due to restarting the node with the same staking address')
+    except StakingFailed as e:
+        logger.error(f'{e}. Not logging in')
+        worker_env.set_status('Failed to stake')
+        return
+
+    worker_env.set_status('Logging in...')
+    if p2p_runner.login():
+        worker_env.set_status('Running')
+    else:
+        worker_env.set_status('Failed to login')
+
+
 def main():  # pylint: disable=too-many-statements
 
-    config = Config(required=required_config, config_file=env_defaults[os.getenv('ENIGMA_ENV', 'COMPOSE')])
+    config = load_config(config_schema, config_file=env_defaults[os.getenv('ENIGMA_ENV', 'COMPOSE')],
+                         required=required_config)
 
     worker_env = Environment(config=config)
     worker_env.set_status('Down')
@@ -99,8 +164,17 @@ def main():  # pylint: disable=too-many-statements
 
     logger.debug(f'Running with config: {config.items()}')
 
+    if worker_env.testing():
+        # the local network comes up together with us -- wait for all of it at once, not one service after another
+        worker_env.set_status('Waiting for local network...')
+        readiness.wait_for(*(readiness.Target.endpoint(config[key])
+                             for key in ('CONTRACT_DISCOVERY_ADDRESS', 'ETH_NODE_ADDRESS', 'FAUCET_URL')),
+                           timeout=config['CONTRACT_TIMEOUT'])
+
     logger.info('Setting up worker...')
     logger.info('Loading contract addresses and ABI files...')
+    provider.prefetch(['enigma_abi', 'enigma_artifact', 'enigma_token_artifact', 'enigma_contract_address',
+                       'token_contract_address'])
     utils.save_to_path(worker_env.enigma_abi_path, provider.enigma_abi)
     eng_contract, erc20_contract = load_contracts(config, provider)
     logger.info('Done')
@@ -123,9 +197,10 @@ def main():  # pylint: disable=too-many-statements
     worker_env.set_status('Reticulating Splines...')
     bootstrap_params = load_bootstrap_parameters(config, worker_env.bootstrap())
 
-    while not check_eth_limit(operating.address, float(config["MINIMUM_ETHER_BALANCE"]), worker_env.ethereum_node):
+    if not check_eth_limit(operating.address, config["MINIMUM_ETHER_BALANCE"], worker_env.ethereum_node):
         worker_env.set_status('Waiting for ETH...')
-        time.sleep(5)
+        wait_for_eth_limit(operating.address, config["MINIMUM_ETHER_BALANCE"], worker_env.ethereum_node,
+                           ws_url=p2p_parse_url(env, worker_env.ethereum_node, config))
 
     required = RequiredParameters(
         public_address=operating.address,
@@ -162,36 +237,8 @@ def main():  # pylint: disable=too-many-statements
     status = wait_for_register(p2p_runner)
     logger.info(f'Node is registered!')
 
-    # now perform the part of the deposit that comes after the p2p registers
     if worker_env.should_auto_deposit() and status != P2PStatuses.LOGGEDIN:
-        erc20_contract.approve(staking.address,
-                               provider.enigma_contract_address,
-                               worker_env.deposit_amount,
-                               key=bytes.fromhex(remove_0x(staking.key)))
-
-        val = erc20_contract.check_allowance(staking.address, provider.enigma_contract_address)
-        logger.debug(f'Current allowance for {provider.enigma_contract_address}, from {staking.address}:'
-                     f' {val / (10 ** 8)} ENG')
-
-        worker_env.set_status('Setting staking address...')
-        logger.info(f'Attempting to set operating address -- staking:{staking.address} operating: {operating.address}')
-        # todo: wait for confirmations
-        try:
-            eng_contract.setOperatingAddress(staking.address, staking.key, operating.address, int(worker_env.confirmations))
-            logger.info(f'Done waiting for {worker_env.confirmations} confirmations for setOperatingAddress')
-            worker_env.set_status('Depositing...')
-
-            logger.info(f'Attempting deposit from {staking.address} on behalf of worker {operating.address}')
-            eng_contract.deposit(staking.address, staking.key, worker_env.deposit_amount, int(worker_env.confirmations))
-            logger.info(f'Done waiting for {worker_env.confirmations} confirmations for deposit')
-        except enigma.StakingAddressAlreadySet:
-            logger.warning('Staking address already set. Probably due to restarting the node with the same staking address')
-
-        worker_env.set_status('Logging in...')
-        if p2p_runner.login():
-            worker_env.set_status('Running')
-        else:
-            worker_env.set_status('Failed to login')
+        deposit_and_login(worker_env, p2p_runner, eng_contract, erc20_contract, staking, operating.address)
     elif status != P2PStatuses.LOGGEDIN:
         worker_env.set_status('Waiting for login...')
         logger.info('Waiting for deposit & login...')
@@ -4,7 +4,7 @@ import time
 from collections import UserDict
 from typing import Union
 
-from enigma_docker_common.crypto import open_eth_keystore
+from enigma_docker_common.keystores import is_keystore_file, open_keystore
 from enigma_docker_common.logger import get_logger
 
 logger = get_logger('worker.p2p.utils')
@@ -13,15 +13,24 @@ logger = get_logger('worker.p2p.utils')
 def load_ethereum_keys(config: UserDict):
     """ Will generate keys if they don't exist """
     keystore_dir = config.get('ETH_KEY_PATH', pathlib.Path.home())
-    password = config.get('PASSWORD', 'cupcake')  # :)
-    return open_eth_keystore(keystore_dir, config, password=password, create=True)
+    return _load_keys(keystore_dir, config, 'ETH_ADDRESS')
 
 
 def load_staking_keys(config: UserDict):
     """ Will generate keys if they don't exist """
     staking_key_dir = config.get('STAKE_KEY_PATH', pathlib.Path.home())
+    return _load_keys(staking_key_dir, config, 'STAKE_ADDRESS')
+
+
+def _load_keys(path, config: UserDict, address_key: str):
+    """ A keystore directory is created if needed. A keystore file holds many keys -- the one whose address is
+    config[address_key] (say, the ETH_ADDRESS environment variable) is used, and a missing address is an error rather
+    than a new key on every start """
     password = config.get('PASSWORD', 'cupcake')  # :)
-    return open_eth_keystore(staking_key_dir, config, password=password, create=True)
+    address = config.get(address_key)
+    if is_keystore_file(path) and not address:
+        raise ValueError(f'{path} is a keystore file, set {address_key} to the address of the key to use')
+    return open_keystore(path, config, password=password, create=not is_keystore_file(path), address=address)
 
 
 def wait_for_staking_address(config: UserDict) -> str: